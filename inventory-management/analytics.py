@@ -0,0 +1,197 @@
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+from sqlalchemy import select
+
+# Columnar analytics over the full movement history: ProductMovement is loaded into NumPy
+# arrays with product and location IDs dictionary-encoded as integer codes, and every report
+# is a vectorized group-by (bincount / np.add.at) over those codes
+
+NO_LOCATION = -1
+LOAD_BATCH_SIZE = 100000
+# Group-bys over more (product, location) cells than this sort the keys instead of
+# allocating a dense bincount
+DENSE_GROUP_LIMIT = 50_000_000
+
+class MovementColumns:
+    # product_code indexes product_ids, from_code/to_code index location_ids (NO_LOCATION
+    # where that side is empty), timestamp is datetime64[us]
+    def __init__(self, product_ids, location_ids, product_code, from_code, to_code, qty, timestamp):
+        self.product_ids = product_ids
+        self.location_ids = location_ids
+        self.product_code = product_code
+        self.from_code = from_code
+        self.to_code = to_code
+        self.qty = qty
+        self.timestamp = timestamp
+
+    def __len__(self):
+        return len(self.qty)
+
+def _encode(values, codes, ids):
+    # Integer codes for a batch of IDs, giving codes to IDs not seen before
+    try:
+        return np.fromiter(map(codes.__getitem__, values), np.int32, len(values))
+    except KeyError:
+        for value in set(values).difference(codes):
+            codes[value] = len(ids)
+            ids.append(value)
+        return np.fromiter(map(codes.__getitem__, values), np.int32, len(values))
+
+def encode_movements(batches, product_ids=(), location_ids=()):
+    # batches yields lists of (product_id, from_location, to_location, qty, timestamp) rows.
+    # Seeding product_ids/location_ids (e.g. from the catalogue tables) fixes their codes
+    product_ids, location_ids = list(product_ids), list(location_ids)
+    products = {product_id: code for code, product_id in enumerate(product_ids)}
+    locations = {location_id: code for code, location_id in enumerate(location_ids)}
+    locations.update({None: NO_LOCATION, '': NO_LOCATION})
+    chunks = {'product': [], 'from': [], 'to': [], 'qty': [], 'timestamp': []}
+    for batch in batches:
+        if not batch:
+            continue
+        product_col, from_col, to_col, qty_col, timestamp_col = (list(map(itemgetter(i), batch)) for i in range(5))
+        chunks['product'].append(_encode(product_col, products, product_ids))
+        chunks['from'].append(_encode(from_col, locations, location_ids))
+        chunks['to'].append(_encode(to_col, locations, location_ids))
+        chunks['qty'].append(np.fromiter(qty_col, np.int64, len(batch)))
+        chunks['timestamp'].append(np.array(timestamp_col, dtype='datetime64[us]'))
+
+    def concat(name, dtype):
+        return np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype)
+
+    return MovementColumns(
+        np.array(product_ids, dtype=object), np.array(location_ids, dtype=object),
+        concat('product', np.int32), concat('from', np.int32), concat('to', np.int32),
+        concat('qty', np.int64), concat('timestamp', 'datetime64[us]'))
+
+def load_movement_columns(session, movement_table, product_table=None, location_table=None,
+                          batch_size=LOAD_BATCH_SIZE, extra_batches=()):
+    # Streams the movement table through the session in batches; passing the catalogue tables
+    # gives products and locations without movements a code too. extra_batches (e.g. archived
+    # history) are encoded ahead of the table's rows
+    def ids(table):
+        if table is None:
+            return ()
+        return [value for (value,) in session.execute(select(table.primary_key.columns.values()[0]))]
+
+    c = movement_table.c
+    # Rows come straight off a DBAPI cursor, skipping SQLAlchemy's per-row result processing;
+    # NumPy parses SQLite's ISO timestamp strings itself and other drivers return datetimes
+    statement = select(c.product_id, c.from_location, c.to_location, c.qty, c.timestamp)
+    connection = session.connection()
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(str(statement.compile(connection)))
+        return encode_movements(chain(extra_batches, iter(lambda: cursor.fetchmany(batch_size), [])),
+                                ids(product_table), ids(location_table))
+    finally:
+        cursor.close()
+
+def _group_sum(keys, weights, size):
+    # (present_keys, sums, counts) for int64 keys in [0, size)
+    if size <= DENSE_GROUP_LIMIT:
+        counts = np.bincount(keys, minlength=size)
+        sums = np.zeros(size, np.int64)
+        np.add.at(sums, keys, weights)
+        present = np.flatnonzero(counts)
+        return present, sums[present], counts[present]
+    present, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    sums = np.zeros(len(present), np.int64)
+    np.add.at(sums, inverse, weights)
+    return present, sums, counts
+
+def _signed_sides(columns, mask=None):
+    # (product_code, location_code, signed qty) for every non-empty side, like the SQL union
+    incoming = columns.to_code != NO_LOCATION
+    outgoing = columns.from_code != NO_LOCATION
+    if mask is not None:
+        incoming &= mask
+        outgoing &= mask
+    return (np.concatenate([columns.product_code[incoming], columns.product_code[outgoing]]),
+            np.concatenate([columns.to_code[incoming], columns.from_code[outgoing]]),
+            np.concatenate([columns.qty[incoming], -columns.qty[outgoing]]))
+
+def _time_mask(columns, start=None, end=None):
+    # Movements in (start, end], matching _signed_movement_sides()
+    if start is None and end is None:
+        return None
+    mask = np.ones(len(columns), bool)
+    if start is not None:
+        mask &= columns.timestamp > np.datetime64(start, 'us')
+    if end is not None:
+        mask &= columns.timestamp <= np.datetime64(end, 'us')
+    return mask
+
+def balances(columns, start=None, end=None):
+    # {(product_id, location_id): qty} for every pair a movement in (start, end] touches,
+    # zero sums included - the same result as app.query_signed_balances()
+    products, locations, qty = _signed_sides(columns, _time_mask(columns, start, end))
+    width = max(len(columns.location_ids), 1)
+    keys, sums, _ = _group_sum(products.astype(np.int64) * width + locations, qty,
+                               len(columns.product_ids) * width)
+    product_ids = columns.product_ids[keys // width]
+    location_ids = columns.location_ids[keys % width]
+    return dict(zip(zip(product_ids.tolist(), location_ids.tolist()), sums.tolist()))
+
+def top_products(columns, limit=5):
+    # [(product_id, total |qty| moved)] ordered by total descending, then product_id - the
+    # same ranking as the dashboard's /api/top_products
+    totals = np.bincount(columns.product_code, weights=np.abs(columns.qty),
+                         minlength=len(columns.product_ids)).astype(np.int64)
+    moved = np.flatnonzero(np.bincount(columns.product_code, minlength=len(columns.product_ids)))
+    order = np.lexsort((columns.product_ids[moved].astype(str), -totals[moved]))[:limit]
+    return [(product_id, int(total)) for product_id, total
+            in zip(columns.product_ids[moved][order].tolist(), totals[moved][order])]
+
+def _stock_by_product(columns, mask):
+    # Net stock held across all locations per product from the movements in mask: stock-ins
+    # add, stock-outs subtract and transfers cancel out
+    net = np.where(columns.from_code == NO_LOCATION, columns.qty, 0) \
+        - np.where(columns.to_code == NO_LOCATION, columns.qty, 0)
+    if mask is not None:
+        net = np.where(mask, net, 0)
+    totals = np.zeros(len(columns.product_ids), np.int64)
+    np.add.at(totals, columns.product_code, net)
+    return totals
+
+def turnover(columns, start=None, end=None):
+    # Per product over (start, end]: quantity shipped out of the business, opening and closing
+    # stock, and turnover = shipped / average of opening and closing stock (0 when no stock)
+    opening = _stock_by_product(columns, _time_mask(columns, None, start)) if start is not None \
+        else np.zeros(len(columns.product_ids), np.int64)
+    closing = _stock_by_product(columns, _time_mask(columns, None, end))
+    window = _time_mask(columns, start, end)
+    shipped_mask = (columns.to_code == NO_LOCATION) & (columns.from_code != NO_LOCATION)
+    if window is not None:
+        shipped_mask &= window
+    shipped = np.bincount(columns.product_code[shipped_mask], weights=columns.qty[shipped_mask],
+                          minlength=len(columns.product_ids)).astype(np.int64)
+    average = (opening + closing) / 2
+    ratio = np.divide(shipped, average, out=np.zeros(len(average)), where=average > 0)
+    return [
+        {'product_id': product_id, 'shipped': int(s), 'opening': int(o), 'closing': int(c), 'turnover': float(r)}
+        for product_id, s, o, c, r in zip(columns.product_ids.tolist(), shipped, opening, closing, ratio)
+    ]
+
+def flow_matrix(columns, start=None, end=None, product_id=None):
+    # Quantities between locations over (start, end], optionally for one product. Returns
+    # (location_ids, transfers, received, shipped): transfers[i, j] is the quantity moved from
+    # location i to location j; received/shipped are stock entering and leaving the business
+    mask = _time_mask(columns, start, end)
+    if mask is None:
+        mask = np.ones(len(columns), bool)
+    if product_id is not None:
+        codes = np.flatnonzero(columns.product_ids == product_id)
+        mask &= columns.product_code == (codes[0] if len(codes) else -1)
+    size = len(columns.location_ids)
+    has_from, has_to = columns.from_code != NO_LOCATION, columns.to_code != NO_LOCATION
+    transfer = mask & has_from & has_to
+    transfers = np.bincount(columns.from_code[transfer].astype(np.int64) * size + columns.to_code[transfer],
+                            weights=columns.qty[transfer], minlength=size * size).astype(np.int64)
+    incoming, outgoing = mask & ~has_from & has_to, mask & has_from & ~has_to
+    received = np.bincount(columns.to_code[incoming], weights=columns.qty[incoming],
+                           minlength=size).astype(np.int64)
+    shipped = np.bincount(columns.from_code[outgoing], weights=columns.qty[outgoing],
+                          minlength=size).astype(np.int64)
+    return columns.location_ids, transfers.reshape(size, size), received, shipped
@@ -1,70 +1,1941 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, flash, jsonify, abort, g, has_app_context, has_request_context, send_file, session, stream_with_context
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import bindparam, case, event, func, literal, select, text, union_all, and_, or_, not_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased, joinedload
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+from functools import partial, wraps
+from itertools import chain, count, islice
+import archive
+from bisect import bisect_left
+from broker import create_broker
+from cache import create_cache
+from ids import derived_ulid, new_ulid
+from jobs import JobRunner
+from metrics import COUNT_BUCKETS, Registry
+from models import (db, database_url_from_env, engine_options_from_env, Product, Location, ProductMovement,
+                    StockBalance, BalanceSnapshot, MovementArchive, ArchivedBalance, ArchivedProductTotal,
+                    ArchivedMovementId, MovementRollup, Job, IdempotencyKey)
+from werkzeug.local import LocalProxy
+import base64
+import click
+import csv
+import gc
+import gzip
+import hashlib
+import io
+import json
+import math
 import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Application factory - the routes, hooks and CLI commands below live on the `inventory`
+# blueprint; create_app() builds an app around it with its own config, engine, cache, broker
+# and job pool. Nothing is created at import time, so importing this module stays cheap
+bp = Blueprint('inventory', __name__, cli_group=None)
 
-db = SQLAlchemy(app)
+def _app_state(name):
+    # Per-application objects created by create_app(), resolved against current_app
+    return LocalProxy(lambda: current_app.extensions['inventory'][name])
 
-# Database Models
-class Product(db.Model):
-    product_id = db.Column(db.String(50), primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text)
-    
-    def __repr__(self):
-        return f'<Product {self.product_id}: {self.name}>'
+dashboard_cache = _app_state('dashboard_cache')
+movement_broker = _app_state('movement_broker')
+job_runner = _app_state('job_runner')
 
-class Location(db.Model):
-    location_id = db.Column(db.String(50), primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text)
-    
-    def __repr__(self):
-        return f'<Location {self.location_id}: {self.name}>'
-
-class ProductMovement(db.Model):
-    movement_id = db.Column(db.String(50), primary_key=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    from_location = db.Column(db.String(50), db.ForeignKey('location.location_id'), nullable=True)
-    to_location = db.Column(db.String(50), db.ForeignKey('location.location_id'), nullable=True)
-    product_id = db.Column(db.String(50), db.ForeignKey('product.product_id'), nullable=False)
-    qty = db.Column(db.Integer, nullable=False)
-    
-    # Relationships
-    product = db.relationship('Product', backref='movements')
-    from_loc = db.relationship('Location', foreign_keys=[from_location], backref='outgoing_movements')
-    to_loc = db.relationship('Location', foreign_keys=[to_location], backref='incoming_movements')
-    
-    def __repr__(self):
-        return f'<Movement {self.movement_id}: {self.qty} of {self.product_id}>'
+def create_app(config=None):
+    # config overrides the settings read from the environment (e.g. for scripts and benchmarks)
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your-secret-key-here'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url_from_env()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite connection pragmas (WAL, busy timeout, synchronous, cache); SQLITE_TUNING=0 turns them off
+    app.config['SQLITE_TUNING'] = os.environ.get('SQLITE_TUNING', '1') != '0'
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '15000'))
+    app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '65536'))
+    # Per-request SQL statement budget; exceeding it logs a warning, or fails the request when strict
+    app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', '0')) or None
+    app.config['SQL_QUERY_BUDGET_STRICT'] = os.environ.get('SQL_QUERY_BUDGET_STRICT') == '1'
+    # Dashboard API cache: in-process LRU by default, CACHE_URL=redis://... to share it across workers
+    app.config['CACHE_URL'] = os.environ.get('CACHE_URL', '')
+    app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('DASHBOARD_CACHE_TTL', '60'))
+    # Rendered /products and /locations pages, invalidated by any committed product or location write
+    app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', '300'))
+    # Responses of at least COMPRESS_MIN_BYTES in a text type are gzip/brotli-compressed
+    app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', '500'))
+    # Movements that would take a balance below zero are rejected unless ALLOW_NEGATIVE_STOCK=1
+    app.config['ALLOW_NEGATIVE_STOCK'] = os.environ.get('ALLOW_NEGATIVE_STOCK') == '1'
+    # Live movement stream: in-process fan-out by default, BROKER_URL=redis://... across workers
+    app.config['BROKER_URL'] = os.environ.get('BROKER_URL', '')
+    app.config['STREAM_HEARTBEAT_SECONDS'] = float(os.environ.get('STREAM_HEARTBEAT_SECONDS', '15'))
+    # Each open stream holds a worker thread: a process serves at most STREAM_MAX_CONNECTIONS at
+    # once (0 = no limit), and each ends after STREAM_MAX_SECONDS for the client to resume it
+    app.config['STREAM_MAX_CONNECTIONS'] = int(os.environ.get('STREAM_MAX_CONNECTIONS', '2'))
+    app.config['STREAM_MAX_SECONDS'] = float(os.environ.get('STREAM_MAX_SECONDS', '300'))
+    # Profiling: PROFILE_REQUESTS=1 profiles every request, otherwise ?profile=1 with a matching
+    # X-Profile-Token header opts a single request in; profiles slower than PROFILE_SLOW_MS are saved
+    app.config['PROFILE_REQUESTS'] = os.environ.get('PROFILE_REQUESTS') == '1'
+    app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+    app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', '500'))
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    # Background jobs: JOB_WORKERS threads per web process run queued jobs (0 leaves them to
+    # `flask run-jobs`); a running job silent for JOB_STALE_SECONDS is assumed dead and requeued
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', '2'))
+    app.config['JOB_POLL_SECONDS'] = float(os.environ.get('JOB_POLL_SECONDS', '5'))
+    app.config['JOB_STALE_SECONDS'] = int(os.environ.get('JOB_STALE_SECONDS', '300'))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+    app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR', os.path.join(app.instance_path, 'jobs'))
+    # Movement archive: `flask archive-movements` moves movements older than ARCHIVE_RETENTION_DAYS
+    # out of the database into monthly files under ARCHIVE_DIR
+    app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    app.config['ARCHIVE_RETENTION_DAYS'] = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '365'))
+    # Idempotency-Key outcomes of the movement write APIs are replayed to retries for this long
+    app.config['IDEMPOTENCY_TTL_SECONDS'] = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+    # Create missing tables and seed derived ones on startup; INIT_DB=0 leaves that to `flask init-db`
+    app.config['INIT_DB'] = os.environ.get('INIT_DB', '1') != '0'
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    app.extensions['inventory'] = {
+        'dashboard_cache': create_cache(app.config['CACHE_URL']),
+        'movement_broker': create_broker(app.config['BROKER_URL']),
+        'stream_slots': threading.BoundedSemaphore(app.config['STREAM_MAX_CONNECTIONS'])
+                        if app.config['STREAM_MAX_CONNECTIONS'] else None,
+        'job_runner': JobRunner(partial(claim_next_job, app), partial(execute_job, app),
+                                workers=app.config['JOB_WORKERS'], poll_interval=app.config['JOB_POLL_SECONDS']),
+    }
+    app.register_blueprint(bp)
+    before_render_template.connect(_start_template_timer, app)
+    template_rendered.connect(_record_template_time, app)
+    if app.config['INIT_DB']:
+        with app.app_context():
+            init_database()
+    return app
+
+def init_database():
+    # Creates missing tables and indexes and seeds what older databases lack; cheap once done
+    db.create_all()
+    # create_all() skips indexes on tables that already exist
+    for index in ProductMovement.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    # Seed the ledger for databases created before it existed
+    if StockBalance.query.first() is None and ProductMovement.query.first() is not None:
+        rebuild_stock_balances()
+    # Likewise the trend rollups
+    if MovementRollup.query.first() is None and ProductMovement.query.first() is not None:
+        rebuild_movement_rollups()
+    # And the archived movement IDs
+    if ArchivedMovementId.query.first() is None and MovementArchive.query.first() is not None:
+        rebuild_archived_movement_ids()
+    if not _has_search_index(Product) or not _has_search_index(Location):
+        rebuild_search_index()
+    db.session.commit()
+
+def prepare_for_fork(app):
+    # For servers that load the app once and fork workers from it (gunicorn --preload, see
+    # wsgi.py): does the warm-up every worker would otherwise repeat, and drops what must not
+    # cross a fork. Returns the app
+    with app.app_context():
+        # Compiled templates and static fingerprints then sit in memory the workers share
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+        for root, _, filenames in os.walk(app.static_folder):
+            for filename in filenames:
+                static_fingerprint(os.path.relpath(os.path.join(root, filename), app.static_folder).replace(os.sep, '/'))
+        # Pooled connections must never be shared between processes
+        db.engine.dispose()
+    # Everything loaded so far lives as long as the process; freezing it keeps the cyclic GC
+    # from writing to those pages, which would hand every worker its own copy of them
+    gc.freeze()
+    return app
+
+# SQLite tuning - applied to every new DBAPI connection
+_read_only_scope = threading.local()
+
+@contextmanager
+def read_only_transactions():
+    # Marks work outside a GET request (background exports, queue polling) as read-only, so
+    # its transactions start deferred and never hold the write lock
+    previous = getattr(_read_only_scope, 'active', False)
+    _read_only_scope.active = True
+    try:
+        yield
+    finally:
+        _read_only_scope.active = previous
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not has_app_context() \
+            or not current_app.config['SQLITE_TUNING']:
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers proceed while a writer commits; it is a no-op for in-memory databases
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f"PRAGMA busy_timeout={current_app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f"PRAGMA cache_size=-{current_app.config['SQLITE_CACHE_SIZE_KB']}")
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+    # Take over BEGIN from pysqlite so write transactions can start IMMEDIATE (see below)
+    dbapi_connection.isolation_level = None
+    connection_record.info['sqlite_tuned'] = True
+
+@event.listens_for(Engine, 'begin')
+def begin_sqlite_transaction(conn):
+    if not conn.info.get('sqlite_tuned'):
+        return
+    # A deferred transaction that reads and then writes fails with "database is locked"
+    # as soon as another writer commits, without waiting on busy_timeout. Taking the write
+    # lock up front makes writers queue on busy_timeout instead; read-only requests stay deferred.
+    if (has_request_context() and request.method in ('GET', 'HEAD', 'OPTIONS')) \
+            or getattr(_read_only_scope, 'active', False):
+        conn.exec_driver_sql('BEGIN')
+    else:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+# SQL query-count and DB-time instrumentation
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if has_request_context() and started:
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started.pop()
+
+@bp.after_app_request
+def report_sql_query_count(response):
+    count = g.get('sql_query_count', 0)
+    response.headers['X-SQL-Query-Count'] = str(count)
+    budget = current_app.config['SQL_QUERY_BUDGET']
+    if budget is not None and count > budget:
+        message = f'{request.method} {request.path} issued {count} SQL statements (budget {budget})'
+        if current_app.config['SQL_QUERY_BUDGET_STRICT']:
+            raise RuntimeError(message)
+        current_app.logger.warning(message)
+    return response
+
+# Request metrics and profiling - exposed in Prometheus text format on /metrics
+metrics_registry = Registry()
+REQUEST_LABELS = ('endpoint', 'method', 'status')
+request_duration = metrics_registry.histogram(
+    'inventory_request_duration_seconds', 'Time spent handling a request', REQUEST_LABELS)
+request_sql_statements = metrics_registry.histogram(
+    'inventory_request_sql_statements', 'SQL statements issued per request', REQUEST_LABELS,
+    buckets=COUNT_BUCKETS)
+request_sql_duration = metrics_registry.histogram(
+    'inventory_request_sql_duration_seconds', 'Cumulative database time per request', REQUEST_LABELS)
+template_render_duration = metrics_registry.histogram(
+    'inventory_template_render_duration_seconds', 'Time spent rendering a template', ('template',))
+slow_requests_profiled = metrics_registry.counter(
+    'inventory_slow_requests_profiled_total', 'Slow requests whose profile was written to disk', ('endpoint',))
+
+def _profiling_requested():
+    if current_app.config['PROFILE_REQUESTS']:
+        return True
+    token = current_app.config['PROFILE_TOKEN']
+    return bool(token) and request.args.get('profile') == '1' \
+        and request.headers.get('X-Profile-Token') == token
+
+@bp.before_app_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    if _profiling_requested():
+        import cProfile  # only loaded once a request is profiled
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+def _record_template_time(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        template_render_duration.observe(time.perf_counter() - started, (template.name or 'string',))
+
+def _dump_profile(profiler, endpoint, elapsed):
+    import pstats
+    os.makedirs(current_app.config['PROFILE_DIR'], exist_ok=True)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    base = os.path.join(current_app.config['PROFILE_DIR'], f"{stamp}-{endpoint.replace('/', '_')}")
+    profiler.dump_stats(base + '.pstats')
+    with open(base + '.txt', 'w') as f:
+        f.write(f'{request.method} {request.full_path} took {elapsed * 1000:.1f} ms\n\n')
+        pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+    current_app.logger.warning(f'Slow request {request.method} {request.path} ({elapsed * 1000:.0f} ms), profile: {base}.pstats')
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (endpoint, request.method, str(response.status_code))
+    request_duration.observe(elapsed, labels)
+    request_sql_statements.observe(g.get('sql_query_count', 0), labels)
+    request_sql_duration.observe(g.get('sql_seconds', 0.0), labels)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= current_app.config['PROFILE_SLOW_MS']:
+            _dump_profile(profiler, endpoint, elapsed)
+            slow_requests_profiled.inc((endpoint,))
+    return response
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Static assets and compression - url_for('static') appends a content hash (?v=...) so a
+# fingerprinted URL can be cached for a year; text responses are brotli- or gzip-compressed
+STATIC_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+                          'application/javascript', 'application/json', 'image/svg+xml'}
+# Static files are read into memory to compress them; anything larger goes out as is
+COMPRESS_MAX_STATIC_BYTES = 4 * 1024 * 1024
+_static_fingerprints = {}
+# Compressed bodies, keyed on (path, etag, encoding)
+_compressed_bodies = create_cache(maxsize=256)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def static_fingerprint(filename):
+    # Content hash of a static file, recomputed only when its mtime changes
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_fingerprints.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _static_fingerprints[path] = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+    return cached[1]
+
+@bp.app_url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = static_fingerprint(values.get('filename', ''))
+        if fingerprint:
+            values['v'] = fingerprint
+
+def _response_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+@bp.after_app_request
+def cache_and_compress_response(response):
+    if request.endpoint == 'static' and response.status_code in (200, 304) \
+            and request.args.get('v') == static_fingerprint(request.view_args.get('filename', '')):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+
+    if response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    # Streamed bodies (exports, the event stream) are left alone; static files are streamed
+    # from disk too but are small enough to compress
+    if response.is_streamed and not (response.direct_passthrough and response.content_length is not None
+                                     and response.content_length <= COMPRESS_MAX_STATIC_BYTES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _response_encoding()
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    if response.content_length is not None and response.content_length < current_app.config['COMPRESS_MIN_BYTES']:
+        return response
+    # A strong ETag names the exact bytes (static files, cached pages and API bodies), so their
+    # compressed form is kept rather than recompressed on every request
+    key = f'{request.path}:{etag}:{encoding}' if etag and not weak else None
+    body = _compressed_bodies.get(key) if key else None
+    if body is None:
+        response.direct_passthrough = False
+        body = _compress(response.get_data(), encoding)
+        if key:
+            _compressed_bodies.set(key, body)
+    elif response.direct_passthrough:
+        response.direct_passthrough = False
+        if hasattr(response.response, 'close'):
+            response.response.close()
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # Weak, like nginx does: the compressed bytes differ but still revalidate against the
+    # uncompressed representation's ETag
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Live movement stream - committed movements and their balance deltas fan out to
+# server-sent-event subscribers through the broker
+def publish_movement_event(event_type, movement, deltas):
+    # Best-effort: the movement is already committed, so a broker outage costs live
+    # subscribers the event but never fails the write that caused it
+    movement = dict(movement)
+    if isinstance(movement.get('timestamp'), datetime):
+        movement['timestamp'] = movement['timestamp'].isoformat()
+    try:
+        movement_broker.publish(event_type, {
+            'movement': movement,
+            'balance_deltas': [
+                {'product_id': product_id, 'location_id': location_id, 'delta': delta}
+                for (product_id, location_id), delta in sorted(deltas.items()) if delta
+            ]
+        })
+    except Exception:
+        current_app.logger.exception('Could not publish %s for movement %s', event_type, movement.get('movement_id'))
+
+def _sse_messages(events):
+    yield 'retry: 3000\n\n'
+    for event in events:
+        if event is None:
+            yield ': keep-alive\n\n'
+            continue
+        if event.type is None:
+            # A checkpoint: sets the ID the client resumes from without dispatching an event
+            yield f'id: {event.id}\n\n'
+            continue
+        message = f'event: {event.type}\ndata: {json.dumps(event.data)}\n\n'
+        yield message if event.id is None else f'id: {event.id}\n' + message
+
+@bp.route('/api/stream/movements')
+def api_movement_stream():
+    slots = current_app.extensions['inventory']['stream_slots']
+    if slots is not None and not slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many open movement streams on this worker'}), 503, {'Retry-After': '30'}
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    events = movement_broker.subscribe(last_event_id, heartbeat=current_app.config['STREAM_HEARTBEAT_SECONDS'],
+                                       timeout=current_app.config['STREAM_MAX_SECONDS'] or None)
+    response = Response(_sse_messages(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if slots is not None:
+        # The server closes the response when the stream ends or the client goes away
+        response.call_on_close(slots.release)
+    return response
+
+# Dashboard API and catalogue page caching - API entries are keyed on a generation counter
+# that every committed write to Product, Location or ProductMovement bumps, catalogue pages on
+# a catalogue version that only Product and Location writes bump
+def _bump_cache_version(key):
+    # Runs once the write has committed, so a cache outage is logged rather than failing it;
+    # cached entries then stay stale for at most their TTL
+    try:
+        dashboard_cache.incr(key)
+    except Exception:
+        current_app.logger.exception('Could not invalidate cached entries (%s)', key)
+
+def invalidate_dashboard_cache():
+    _bump_cache_version('generation')
+
+def invalidate_catalogue_pages():
+    _bump_cache_version('catalogue_version')
+
+@event.listens_for(Session, 'after_flush')
+def _mark_dashboard_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Product, Location)):
+            session.info['dashboard_dirty'] = session.info['catalogue_dirty'] = True
+            return
+        if isinstance(obj, ProductMovement):
+            session.info['dashboard_dirty'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('dashboard_dirty', False):
+        invalidate_dashboard_cache()
+    if session.info.pop('catalogue_dirty', False):
+        invalidate_catalogue_pages()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_dashboard_writes(session):
+    session.info.pop('dashboard_dirty', None)
+    session.info.pop('catalogue_dirty', None)
+
+def _cached_response(key, ttl, view, args, kwargs):
+    # Caches the body and its ETag; clients presenting a current ETag get a 304 without
+    # touching the database
+    entry = dashboard_cache.get(key)
+    if entry is None:
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        body = response.get_data(as_text=True)
+        entry = {'body': body, 'etag': hashlib.sha1(body.encode()).hexdigest(),
+                 'mimetype': response.mimetype}
+        dashboard_cache.set(key, entry, ttl)
+    response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def cached_api(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = dashboard_cache.get('generation') or 0
+        key = f'api:{request.endpoint}:{request.query_string.decode()}:{generation}'
+        return _cached_response(key, current_app.config['DASHBOARD_CACHE_TTL'], view, args, kwargs)
+    return wrapper
+
+def cached_page(view):
+    # Rendered catalogue listings; a request with flash messages waiting renders fresh, as
+    # the page consumes them
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if '_flashes' in session:
+            return view(*args, **kwargs)
+        version = dashboard_cache.get('catalogue_version') or 0
+        key = f'page:{request.endpoint}:{request.query_string.decode()}:{version}'
+        return _cached_response(key, current_app.config['PAGE_CACHE_TTL'], view, args, kwargs)
+    return wrapper
+
+def with_movement_relations(query):
+    # Eager-load everything the movement templates touch so listings don't go N+1
+    return query.options(
+        joinedload(ProductMovement.product),
+        joinedload(ProductMovement.from_loc),
+        joinedload(ProductMovement.to_loc)
+    )
+
+# Reporting queries - aggregations pushed into the database, returning plain tuples
+def _signed_movement_sides(start=None, end=None):
+    # One row per side of a movement: +qty into to_location, -qty out of from_location
+    incoming = db.session.query(
+        ProductMovement.product_id.label('product_id'),
+        ProductMovement.to_location.label('location_id'),
+        ProductMovement.qty.label('qty')
+    ).filter(ProductMovement.to_location.isnot(None), ProductMovement.to_location != '')
+    outgoing = db.session.query(
+        ProductMovement.product_id.label('product_id'),
+        ProductMovement.from_location.label('location_id'),
+        (-ProductMovement.qty).label('qty')
+    ).filter(ProductMovement.from_location.isnot(None), ProductMovement.from_location != '')
+    if start is not None:
+        incoming = incoming.filter(ProductMovement.timestamp > start)
+        outgoing = outgoing.filter(ProductMovement.timestamp > start)
+    if end is not None:
+        incoming = incoming.filter(ProductMovement.timestamp <= end)
+        outgoing = outgoing.filter(ProductMovement.timestamp <= end)
+    return incoming.union_all(outgoing).subquery()
+
+def query_signed_balances(start=None, end=None):
+    # [(product_id, location_id, qty)] summed over movements in (start, end]
+    sides = _signed_movement_sides(start, end)
+    return db.session.query(
+        sides.c.product_id,
+        sides.c.location_id,
+        func.sum(sides.c.qty)
+    ).group_by(sides.c.product_id, sides.c.location_id).all()
+
+def query_top_products(limit=5):
+    # [(product_id, total |qty| moved)] including archived movements, largest first; ties go
+    # to the lower product_id
+    totals = union_all(
+        select(ProductMovement.product_id.label('product_id'), func.sum(func.abs(ProductMovement.qty)).label('qty'))
+        .group_by(ProductMovement.product_id),
+        select(ArchivedProductTotal.product_id, ArchivedProductTotal.qty_moved)
+    ).subquery()
+    total = func.sum(totals.c.qty)
+    return db.session.query(totals.c.product_id, total) \
+        .group_by(totals.c.product_id).order_by(total.desc(), totals.c.product_id).limit(limit).all()
+
+def query_movement_trend(granularity, start, end, product_id=None, location_id=None, dimension=None,
+                         limit=None):
+    # Reads MovementRollup for buckets in [start, end). Without a dimension returns
+    # [(bucket, count, qty_in, qty_out)]; with dimension 'product' or 'location' returns
+    # {key: [(bucket, ...)]} for the `limit` keys with the most movements in the range
+    query = db.session.query(MovementRollup).filter(
+        MovementRollup.granularity == granularity,
+        MovementRollup.bucket >= start, MovementRollup.bucket < end)
+    measures = [func.sum(getattr(MovementRollup, measure)) for measure in ROLLUP_MEASURES]
+    if dimension is None:
+        query = query.filter(MovementRollup.product_id == (product_id or ''),
+                             MovementRollup.location_id == (location_id or ''))
+        return query.with_entities(MovementRollup.bucket, *measures) \
+            .group_by(MovementRollup.bucket).order_by(MovementRollup.bucket).all()
+    if dimension == 'product':
+        key = MovementRollup.product_id
+        query = query.filter(MovementRollup.product_id != '', MovementRollup.location_id == (location_id or ''))
+    else:
+        key = MovementRollup.location_id
+        query = query.filter(MovementRollup.location_id != '', MovementRollup.product_id == (product_id or ''))
+    top = [value for value, _ in query.with_entities(key, func.sum(MovementRollup.movement_count).label('total'))
+           .group_by(key).order_by(func.sum(MovementRollup.movement_count).desc(), key).limit(limit)]
+    series = {value: [] for value in top}
+    for value, bucket, *totals in query.filter(key.in_(top)).with_entities(key, MovementRollup.bucket, *measures) \
+            .group_by(key, MovementRollup.bucket).order_by(key, MovementRollup.bucket):
+        series[value].append((bucket, *totals))
+    return series
+
+# Movement listing - keyset pagination on (timestamp, movement_id), newest first
+MOVEMENTS_PAGE_SIZE = 50
+MOVEMENTS_MAX_PAGE_SIZE = 500
+MOVEMENT_DIRECTIONS = ('in', 'out', 'transfer')
+
+def encode_movement_cursor(movement):
+    raw = f'{movement.timestamp.isoformat()}|{movement.movement_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_movement_cursor(cursor):
+    try:
+        timestamp, movement_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(timestamp), movement_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+def movement_filters_from_request(args):
+    # Raises ValueError on malformed filter values
+    filters = {
+        'product_id': args.get('product_id') or None,
+        'location_id': args.get('location_id') or None,
+        'direction': args.get('direction') or None,
+        'start': None,
+        'end': None,
+    }
+    if filters['direction'] and filters['direction'] not in MOVEMENT_DIRECTIONS:
+        raise ValueError(f"Invalid direction: {filters['direction']}")
+    if args.get('start'):
+        filters['start'] = datetime.combine(date.fromisoformat(args['start']), datetime.min.time())
+    if args.get('end'):
+        # The end date is inclusive
+        filters['end'] = datetime.combine(date.fromisoformat(args['end']) + timedelta(days=1), datetime.min.time())
+    return filters
+
+def filter_movements(query, product_id=None, location_id=None, direction=None, start=None, end=None):
+    if product_id:
+        query = query.filter(ProductMovement.product_id == product_id)
+    if location_id:
+        query = query.filter(or_(ProductMovement.from_location == location_id,
+                                 ProductMovement.to_location == location_id))
+    has_from = and_(ProductMovement.from_location.isnot(None), ProductMovement.from_location != '')
+    has_to = and_(ProductMovement.to_location.isnot(None), ProductMovement.to_location != '')
+    if direction == 'in':
+        query = query.filter(not_(has_from), has_to)
+    elif direction == 'out':
+        query = query.filter(has_from, not_(has_to))
+    elif direction == 'transfer':
+        query = query.filter(has_from, has_to)
+    if start is not None:
+        query = query.filter(ProductMovement.timestamp >= start)
+    if end is not None:
+        query = query.filter(ProductMovement.timestamp < end)
+    return query
+
+NEWEST_MOVEMENTS_FIRST = (ProductMovement.timestamp.desc(), ProductMovement.movement_id.desc())
+
+def _before_movement_cursor(query, cursor):
+    timestamp, movement_id = decode_movement_cursor(cursor)
+    return query.filter(or_(
+        ProductMovement.timestamp < timestamp,
+        and_(ProductMovement.timestamp == timestamp, ProductMovement.movement_id < movement_id)
+    ))
+
+def _newest_movements(filters, cursor, limit):
+    location_id = filters.get('location_id')
+    if not location_id:
+        query = filter_movements(with_movement_relations(ProductMovement.query), **filters)
+        if cursor:
+            query = _before_movement_cursor(query, cursor)
+        return query.order_by(*NEWEST_MOVEMENTS_FIRST).limit(limit).all()
+    # An OR across from_location and to_location follows neither location index's order, so
+    # SQLite would sort every matching row to cut one page. Each side alone walks its
+    # (location, timestamp, movement_id) index newest first, and UNION ALL merges the two
+    # ordered streams, stopping after `limit` rows
+    sides = []
+    for side in (ProductMovement.from_location == location_id,
+                 and_(ProductMovement.to_location == location_id,
+                      ProductMovement.from_location.is_distinct_from(location_id))):
+        query = filter_movements(select(ProductMovement), **dict(filters, location_id=None)).filter(side)
+        sides.append(_before_movement_cursor(query, cursor) if cursor else query)
+    merged = union_all(*sides)
+    page = merged.order_by(merged.selected_columns.timestamp.desc(), merged.selected_columns.movement_id.desc()) \
+        .limit(limit).subquery()
+    movement = aliased(ProductMovement, page)
+    rows = db.session.query(movement).options(
+        joinedload(movement.product), joinedload(movement.from_loc), joinedload(movement.to_loc)
+    ).all()
+    # The joins may hand the merged rows back in any order; there are at most `limit` of them
+    rows.sort(key=lambda m: (m.timestamp, m.movement_id), reverse=True)
+    return rows
+
+def query_movements_page(filters, cursor=None, limit=MOVEMENTS_PAGE_SIZE):
+    # Returns (movements, next_cursor); next_cursor is None on the last page
+    rows = _newest_movements(filters, cursor, limit + 1)
+    if len(rows) <= limit:
+        # Past the end of the table; older pages continue from the archive
+        before = decode_movement_cursor(cursor) if cursor else None
+        rows += with_archived_relations(list(islice(iter_archived_movements(filters, before), limit + 1 - len(rows))))
+    next_cursor = encode_movement_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def page_size_from_request(args):
+    limit = args.get('limit', MOVEMENTS_PAGE_SIZE, type=int)
+    return max(1, min(limit, MOVEMENTS_MAX_PAGE_SIZE))
+
+def movement_to_dict(m):
+    return {
+        'movement_id': m.movement_id,
+        'timestamp': m.timestamp.isoformat(),
+        'product_id': m.product_id,
+        'from_location': m.from_location,
+        'to_location': m.to_location,
+        'qty': m.qty
+    }
+
+# Catalogue search - typeahead over product and location IDs and names. On SQLite each table
+# gets an FTS5 prefix index kept in step by triggers, so every writer (forms, bulk loads, other
+# workers) updates it in the same transaction; other databases fall back to prefix LIKE
+SEARCH_RESULTS_LIMIT = 10
+SEARCH_MAX_RESULTS_LIMIT = 50
+CATALOGUE_PAGE_SIZE = 100
+SEARCHABLE_MODELS = {'products': Product, 'locations': Location}
+_search_index_present = {}
+
+def _search_index_ddl(table):
+    # External-content FTS5 table over (id, name), reading rows back from the source table by rowid
+    search, key = f'{table.name}_search', table.primary_key.columns.keys()[0]
+    insert = f'INSERT INTO {search}(rowid, {key}, name) VALUES (new.rowid, new.{key}, new.name);'
+    delete = (f"INSERT INTO {search}({search}, rowid, {key}, name) "
+              f"VALUES ('delete', old.rowid, old.{key}, old.name);")
+    return [
+        f'DROP TABLE IF EXISTS {search}',
+        f"CREATE VIRTUAL TABLE {search} USING fts5({key}, name, content='{table.name}', "
+        f"content_rowid='rowid', prefix='2 3 4 5 6')",
+        f'CREATE TRIGGER IF NOT EXISTS {search}_ai AFTER INSERT ON {table.name} BEGIN {insert} END',
+        f'CREATE TRIGGER IF NOT EXISTS {search}_ad AFTER DELETE ON {table.name} BEGIN {delete} END',
+        f'CREATE TRIGGER IF NOT EXISTS {search}_au AFTER UPDATE ON {table.name} BEGIN {delete} {insert} END',
+        f"INSERT INTO {search}({search}) VALUES ('rebuild')",
+    ]
+
+def _create_search_index(table, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    try:
+        for statement in _search_index_ddl(table):
+            connection.exec_driver_sql(statement)
+    except SQLAlchemyError as e:
+        # SQLite builds without FTS5 keep working on the LIKE fallback
+        current_app.logger.warning('Search index for %s not created: %s', table.name, e)
+        return
+    _search_index_present[(str(connection.engine.url), table.name)] = True
+
+for _model in SEARCHABLE_MODELS.values():
+    event.listen(_model.__table__, 'after_create', _create_search_index)
+
+def rebuild_search_index():
+    # Recreates the FTS5 indexes from the catalogue tables; needed once for databases created
+    # before the index existed, and after VACUUM, which may renumber the rowids it points at
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.begin() as connection:
+        for model in SEARCHABLE_MODELS.values():
+            _create_search_index(model.__table__, connection)
+    return True
+
+def _has_search_index(model):
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    key = (str(db.engine.url), model.__tablename__)
+    if key not in _search_index_present:
+        _search_index_present[key] = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': f'{model.__tablename__}_search'}
+        ).first() is not None
+    return _search_index_present[key]
+
+def search_catalogue(model, q, limit=SEARCH_RESULTS_LIMIT):
+    # Returns up to limit (id, name) pairs whose ID or name has a word starting with each term in q
+    terms = re.findall(r'\w+', q or '')
+    if not terms:
+        return []
+    key = model.__table__.primary_key.columns.values()[0]
+    if _has_search_index(model):
+        search = f'{model.__tablename__}_search'
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # No ORDER BY rank: ranking scores every match, while LIMIT alone stops at the first few
+        return db.session.execute(
+            text(f'SELECT {key.name}, name FROM {search} WHERE {search} MATCH :match LIMIT :limit'),
+            {'match': match, 'limit': limit}
+        ).all()
+    q = q.strip()
+    return db.session.query(key, model.name) \
+        .filter(or_(key.istartswith(q, autoescape=True), model.name.istartswith(q, autoescape=True))) \
+        .order_by(key).limit(limit).all()
+
+def catalogue_page(model, args):
+    # One page of the products/locations listing: search hits for ?q=, otherwise keyset
+    # pagination on the ID after ?after=. Returns (rows, next_after)
+    key = model.__table__.primary_key.columns.values()[0]
+    if args.get('q'):
+        ids = [row[0] for row in search_catalogue(model, args['q'], CATALOGUE_PAGE_SIZE)]
+        return model.query.filter(key.in_(ids)).order_by(key).all(), None
+    query = model.query.order_by(key)
+    if args.get('after'):
+        query = query.filter(key > args['after'])
+    rows = query.limit(CATALOGUE_PAGE_SIZE + 1).all()
+    next_after = getattr(rows[CATALOGUE_PAGE_SIZE - 1], key.name) if len(rows) > CATALOGUE_PAGE_SIZE else None
+    return rows[:CATALOGUE_PAGE_SIZE], next_after
+
+def require_catalogue_entries(product_id, *location_ids):
+    # The movement forms take typed IDs rather than a fixed <select>, so check they exist
+    if not db.session.get(Product, product_id or ''):
+        raise ValueError(f'Unknown product_id: {product_id}')
+    for location_id in location_ids:
+        if location_id and not db.session.get(Location, location_id):
+            raise ValueError(f'Unknown location_id: {location_id}')
+
+# Stock balance ledger
+class InsufficientStockError(ValueError):
+    def __init__(self, product_id, location_id, requested):
+        super().__init__(f'Insufficient stock of {product_id} at {location_id} to move {requested}')
+        self.product_id = product_id
+        self.location_id = location_id
+        self.requested = requested
+
+def _adjust_balance(product_id, location_id, delta):
+    # Single atomic UPDATE, so concurrent writers never lose each other's changes. Unless
+    # ALLOW_NEGATIVE_STOCK is set, a decrement only matches when enough stock is on hand;
+    # the row lock it takes (PostgreSQL) or the write lock (SQLite) makes check-and-move atomic.
+    table = StockBalance.__table__
+    enforce = delta < 0 and not current_app.config['ALLOW_NEGATIVE_STOCK']
+    for _ in range(2):
+        statement = table.update() \
+            .where(table.c.product_id == product_id, table.c.location_id == location_id) \
+            .values(qty=table.c.qty + delta)
+        if enforce:
+            statement = statement.where(table.c.qty + delta >= 0)
+        if db.session.execute(statement).rowcount:
+            return
+        if enforce:
+            # A missing row means nothing is on hand
+            raise InsufficientStockError(product_id, location_id, -delta)
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(product_id=product_id, location_id=location_id, qty=delta))
+            return
+        except IntegrityError:
+            # Another writer created the row first; retry as an update
+            continue
+    raise RuntimeError(f'Could not adjust balance of {product_id} at {location_id}')
+
+def adjust_balances(deltas):
+    # Keys are visited in sorted order so concurrent writers always lock rows in the same order
+    for (product_id, location_id), delta in sorted(deltas.items()):
+        if delta:
+            _adjust_balance(product_id, location_id, delta)
+
+def movement_balance_deltas(product_id, from_location, to_location, qty, sign=1):
+    # {(product_id, location_id): delta}; sign=-1 reverses a movement
+    deltas = {}
+    if to_location:
+        deltas[(product_id, to_location)] = sign * qty
+    if from_location:
+        key = (product_id, from_location)
+        deltas[key] = deltas.get(key, 0) - sign * qty
+    return deltas
+
+def merge_balance_deltas(*deltas_list):
+    merged = {}
+    for deltas in deltas_list:
+        for key, delta in deltas.items():
+            merged[key] = merged.get(key, 0) + delta
+    return merged
+
+def apply_movement_to_balances(product_id, from_location, to_location, qty, sign=1):
+    deltas = movement_balance_deltas(product_id, from_location, to_location, qty, sign)
+    adjust_balances(deltas)
+    return deltas
+
+def validate_movement_fields(from_location, to_location, qty):
+    # The rules every movement write shares; returns (from_location, to_location, qty) with an
+    # empty location as None and qty as a positive int, or raises ValueError
+    from_location = from_location or None
+    to_location = to_location or None
+    if not from_location and not to_location:
+        raise ValueError('from_location or to_location is required')
+    if from_location == to_location:
+        raise ValueError('from_location and to_location cannot be the same')
+    try:
+        qty = int(qty)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid qty: {qty}')
+    if qty <= 0:
+        raise ValueError('qty must be positive')
+    return from_location, to_location, qty
+
+def create_movement(row, before_commit=None):
+    # Inserts the movement and moves its stock in one transaction; raises ValueError for an
+    # invalid row, or InsufficientStockError (or an IntegrityError or ArchivedMovementIdError for
+    # a duplicate ID) after
+    # rolling back. before_commit(movement, deltas) can add its own writes to the same transaction
+    row = dict(row)
+    row['from_location'], row['to_location'], row['qty'] = validate_movement_fields(
+        row.get('from_location'), row.get('to_location'), row.get('qty'))
+    movement = ProductMovement(**{key: value for key, value in row.items() if value is not None})
+    movement.movement_id = movement.movement_id or new_ulid()
+    movement.timestamp = movement.timestamp or datetime.utcnow()
+    try:
+        check_not_archived(movement.timestamp)
+        if archived_movement_ids([movement.movement_id]):
+            raise ArchivedMovementIdError(movement.movement_id)
+        db.session.add(movement)
+        deltas = apply_movement_to_balances(movement.product_id, movement.from_location,
+                                            movement.to_location, movement.qty)
+        apply_rollup_deltas(movement_rollup_deltas(movement.product_id, movement.from_location,
+                                                   movement.to_location, movement.qty, movement.timestamp))
+        invalidate_snapshots_from(row.get('timestamp'))
+        if before_commit is not None:
+            before_commit(movement, deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    publish_movement_event('movement_created', movement_to_dict(movement), deltas)
+    return movement, deltas
+
+def compute_balances_from_movements():
+    # The archive checkpoint plus every movement still in ProductMovement
+    balances = archived_checkpoint()
+    for product_id, location_id, qty in query_signed_balances():
+        balances[(product_id, location_id)] = balances.get((product_id, location_id), 0) + qty
+    return balances
+
+def verify_stock_balances():
+    # Returns {(product_id, location_id): (ledger_qty, expected_qty)} for every drifted pair
+    expected = compute_balances_from_movements()
+    ledger = {(b.product_id, b.location_id): b.qty for b in StockBalance.query.all()}
+    drift = {}
+    for key in set(expected) | set(ledger):
+        ledger_qty = ledger.get(key, 0)
+        expected_qty = expected.get(key, 0)
+        if ledger_qty != expected_qty:
+            drift[key] = (ledger_qty, expected_qty)
+    return drift
+
+def rebuild_stock_balances():
+    expected = compute_balances_from_movements()
+    StockBalance.query.delete()
+    db.session.add_all(
+        StockBalance(product_id=product_id, location_id=location_id, qty=qty)
+        for (product_id, location_id), qty in expected.items()
+    )
+    db.session.commit()
+    return len(expected)
+
+# Point-in-time balances - nearest earlier snapshot plus the movements after it
+def latest_snapshot_time(at=None):
+    query = db.session.query(func.max(BalanceSnapshot.snapshot_time))
+    if at is not None:
+        query = query.filter(BalanceSnapshot.snapshot_time <= at)
+    return query.scalar()
+
+def balances_as_of(at):
+    # {(product_id, location_id): qty} on hand at `at`; the archived balances count as a
+    # snapshot at the archive cutoff, and before it the archive files are replayed
+    snapshot_time = latest_snapshot_time(at)
+    cutoff = archive_cutoff()
+    balances = {}
+    if cutoff is not None and cutoff <= at and (snapshot_time is None or snapshot_time < cutoff):
+        snapshot_time, balances = cutoff, archived_checkpoint()
+    elif snapshot_time is not None:
+        rows = db.session.query(BalanceSnapshot.product_id, BalanceSnapshot.location_id, BalanceSnapshot.qty) \
+            .filter(BalanceSnapshot.snapshot_time == snapshot_time)
+        balances = {(product_id, location_id): qty for product_id, location_id, qty in rows}
+    sums = query_signed_balances(start=snapshot_time, end=at)
+    if cutoff is not None and at < cutoff:
+        sums += [(product_id, location_id, qty) for (product_id, location_id), qty
+                 in archived_signed_balances(snapshot_time, at).items()]
+    for product_id, location_id, qty in sums:
+        balances[(product_id, location_id)] = balances.get((product_id, location_id), 0) + qty
+    return balances
+
+def create_balance_snapshot(at=None):
+    at = at or datetime.utcnow()
+    balances = balances_as_of(at)
+    rows = [{'snapshot_time': at, 'product_id': product_id, 'location_id': location_id, 'qty': qty}
+            for (product_id, location_id), qty in balances.items() if qty]
+    BalanceSnapshot.query.filter(BalanceSnapshot.snapshot_time == at).delete()
+    if rows:
+        db.session.execute(BalanceSnapshot.__table__.insert(), rows)
+    db.session.commit()
+    return at, len(rows)
+
+def invalidate_snapshots_from(timestamp):
+    # A movement written at or before a checkpoint makes that checkpoint stale
+    if timestamp is not None:
+        BalanceSnapshot.query.filter(BalanceSnapshot.snapshot_time >= timestamp) \
+            .delete(synchronize_session=False)
+
+def parse_as_of(value):
+    # A bare date means the end of that day
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), datetime.max.time())
+    return datetime.fromisoformat(value)
+
+def balance_rows(balances):
+    # Turns {(product_id, location_id): qty} into the report's row dicts, skipping zeros
+    product_ids = {product_id for product_id, _ in balances}
+    location_ids = {location_id for _, location_id in balances}
+    product_names = dict(db.session.query(Product.product_id, Product.name)
+                         .filter(Product.product_id.in_(product_ids)).all())
+    location_names = dict(db.session.query(Location.location_id, Location.name)
+                          .filter(Location.location_id.in_(location_ids)).all())
+    balance_list = []
+    for (product_id, location_id), qty in sorted(balances.items()):
+        if qty != 0:
+            balance_list.append({
+                'product_id': product_id,
+                'product_name': product_names.get(product_id, product_id),
+                'location_id': location_id,
+                'location_name': location_names.get(location_id, location_id),
+                'qty': qty
+            })
+    return balance_list
+
+# Movement archive - movements at or before a cutoff move out of ProductMovement into monthly
+# columnar files (archive.py). Their effect on stock is folded into ArchivedBalance, which acts
+# as a snapshot at the cutoff for the ledger check and point-in-time balances; listings, exports
+# and as-of dates before the cutoff read the files. History up to the cutoff is closed to writes.
+# Decoded partitions by file path; a path's contents never change
+_archive_partitions = create_cache(maxsize=4)
+
+class ArchivedMovement(namedtuple('ArchivedMovement', archive.FIELDS + ('product', 'from_loc', 'to_loc'))):
+    # Read-only stand-in for a ProductMovement row that now lives in an archive file
+    archived = True
+
+def archive_cutoff():
+    return db.session.query(func.max(MovementArchive.archived_through)).scalar()
+
+def archived_checkpoint():
+    # {(product_id, location_id): qty} summed over every archived movement
+    rows = db.session.query(ArchivedBalance.product_id, ArchivedBalance.location_id, ArchivedBalance.qty)
+    return {(product_id, location_id): qty for product_id, location_id, qty in rows}
+
+class ArchivedMovementIdError(ValueError):
+    def __init__(self, movement_id):
+        super().__init__(f'Duplicate movement_id: {movement_id} is in archived history')
+        self.movement_id = movement_id
+
+def archived_movement_ids(movement_ids):
+    # The subset of movement_ids already in the archive
+    return set(movement_id for (movement_id,) in db.session.query(ArchivedMovementId.movement_id)
+               .filter(ArchivedMovementId.movement_id.in_(movement_ids)))
+
+def rebuild_archived_movement_ids():
+    # Refills ArchivedMovementId from the partition files, for archives written before it existed
+    ArchivedMovementId.query.delete()
+    seen = set()
+    for partition in _archived_partitions():
+        ids = [row[0] for row in _partition_rows(partition.path) if row[0] not in seen]
+        seen.update(ids)
+        if ids:
+            db.session.execute(ArchivedMovementId.__table__.insert(),
+                               [{'movement_id': movement_id, 'partition': partition.partition} for movement_id in ids])
+    db.session.commit()
+
+def check_not_archived(timestamp, cutoff=None):
+    cutoff = cutoff or archive_cutoff()
+    if cutoff is not None and timestamp <= cutoff:
+        raise ValueError(f'{timestamp.isoformat()} is in archived history (archived through {cutoff.isoformat()})')
+
+def count_movements():
+    archived = db.session.query(func.coalesce(func.sum(MovementArchive.row_count), 0)).scalar()
+    return ProductMovement.query.count() + archived
+
+def _partition_rows(path):
+    path = os.path.join(current_app.config['ARCHIVE_DIR'], path)
+    rows = _archive_partitions.get(path)
+    if rows is None:
+        rows = archive.read_partition(path)
+        _archive_partitions.set(path, rows)
+    return rows
+
+def _archived_partitions(start=None, end=None, newest_first=False):
+    # Partitions that can hold movements in [start, end)
+    query = MovementArchive.query
+    if start is not None:
+        query = query.filter(MovementArchive.last_timestamp >= start)
+    if end is not None:
+        query = query.filter(MovementArchive.first_timestamp < end)
+    order = MovementArchive.partition.desc() if newest_first else MovementArchive.partition
+    return query.order_by(order).all()
+
+def _movement_direction(from_location, to_location):
+    if from_location and to_location:
+        return 'transfer'
+    return 'out' if from_location else 'in'
+
+def _archived_row_matches(row, product_id=None, location_id=None, direction=None, start=None, end=None):
+    # The filter_movements() filters applied to an archived row
+    _, timestamp, row_product_id, from_location, to_location, _ = row
+    return (not product_id or row_product_id == product_id) \
+        and (not location_id or location_id in (from_location, to_location)) \
+        and (not direction or _movement_direction(from_location, to_location) == direction) \
+        and (start is None or timestamp >= start) and (end is None or timestamp < end)
+
+def iter_archived_movements(filters=None, before=None):
+    # Archived rows matching the movement listing filters, newest first, as archive.FIELDS
+    # tuples; before=(timestamp, movement_id) resumes after a listing cursor
+    filters = filters or {}
+    end = filters.get('end')
+    if before is not None and (end is None or before[0] < end):
+        end = before[0] + timedelta(microseconds=1)
+    for partition in _archived_partitions(filters.get('start'), end, newest_first=True):
+        rows = _partition_rows(partition.path)
+        stop = bisect_left(rows, before, key=lambda row: (row[1], row[0])) if before else len(rows)
+        for index in range(stop - 1, -1, -1):
+            if _archived_row_matches(rows[index], **filters):
+                yield rows[index]
+
+def estimate_archived_movements(filters=None):
+    # Upper bound on iter_archived_movements(filters) from the partition row counts
+    filters = filters or {}
+    return sum(partition.row_count for partition in _archived_partitions(filters.get('start'), filters.get('end')))
+
+def with_archived_relations(rows):
+    # Wraps archived rows with their product and locations, as the movement templates expect
+    product_ids = {row[2] for row in rows}
+    location_ids = {location_id for row in rows for location_id in row[3:5] if location_id}
+    if not rows:
+        return []
+    products = {product.product_id: product for product in Product.query.filter(Product.product_id.in_(product_ids))}
+    locations = {location.location_id: location
+                 for location in Location.query.filter(Location.location_id.in_(location_ids))}
+    return [ArchivedMovement(*row, products.get(row[2]), locations.get(row[3]), locations.get(row[4]))
+            for row in rows]
+
+def find_archived_movement(movement_id):
+    # The ID index names the partition, so an unknown ID costs one lookup and a known one one file
+    entry = db.session.get(ArchivedMovementId, movement_id)
+    partition = db.session.get(MovementArchive, entry.partition) if entry else None
+    if partition is None:
+        return None
+    for row in _partition_rows(partition.path):
+        if row[0] == movement_id:
+            return with_archived_relations([row])[0]
+    return None
+
+def archived_signed_balances(start=None, end=None):
+    # {(product_id, location_id): qty} summed over archived movements in (start, end]
+    balances = {}
+    for partition in _archived_partitions(start, end + timedelta(microseconds=1) if end else None):
+        for _, timestamp, product_id, from_location, to_location, qty in _partition_rows(partition.path):
+            if (start is None or timestamp > start) and (end is None or timestamp <= end):
+                for key, delta in movement_balance_deltas(product_id, from_location, to_location, qty).items():
+                    balances[key] = balances.get(key, 0) + delta
+    return balances
+
+def archived_movement_batches():
+    # Archived movements as (product_id, from_location, to_location, qty, timestamp) batches,
+    # one per partition, for analytics.load_movement_columns()
+    for partition in _archived_partitions():
+        yield [(product_id, from_location, to_location, qty, timestamp)
+               for _, timestamp, product_id, from_location, to_location, qty in _partition_rows(partition.path)]
+
+def _add_to_archive_totals(model, column, increments):
+    # Adds {primary key tuple: amount} onto `column` of the model's rows, inserting missing ones
+    table = model.__table__
+    keys = list(table.primary_key.columns)
+    existing = set(tuple(row) for row in db.session.execute(
+        select(*keys).where(keys[0].in_({key[0] for key in increments}))))
+    updates = [dict({f'b_{c.name}': value for c, value in zip(keys, key)}, amount=amount)
+               for key, amount in increments.items() if key in existing]
+    inserts = [dict({c.name: value for c, value in zip(keys, key)}, **{column: amount})
+               for key, amount in increments.items() if key not in existing]
+    if updates:
+        db.session.execute(table.update().where(*(c == bindparam(f'b_{c.name}') for c in keys))
+                           .values({column: table.c[column] + bindparam('amount')}), updates)
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+def _archive_oldest_partition(before):
+    # Moves the oldest month of movements at or before `before` into its partition file and
+    # folds it into ArchivedBalance in one transaction. Returns (partition, rows archived),
+    # (partition, None) if a movement landed in the month meanwhile and the step was rolled
+    # back, or None when nothing is left
+    oldest = db.session.query(func.min(ProductMovement.timestamp)).filter(ProductMovement.timestamp <= before).scalar()
+    if oldest is None:
+        db.session.rollback()
+        return None
+    key = archive.partition_key(oldest)
+    _, month_end = archive.partition_bounds(key)
+    in_step = and_(ProductMovement.timestamp < month_end, ProductMovement.timestamp <= before)
+    rows = [tuple(row) for row in db.session.execute(
+        select(*(getattr(ProductMovement, field) for field in archive.FIELDS)).where(in_step))]
+    cutoff = archive_cutoff()
+    through = max(before if month_end > before else max(row[1] for row in rows), cutoff or oldest)
+
+    deltas, moved = {}, {}
+    for _, _, product_id, from_location, to_location, qty in rows:
+        for balance_key, delta in movement_balance_deltas(product_id, from_location, to_location, qty).items():
+            deltas[balance_key] = deltas.get(balance_key, 0) + delta
+        moved[(product_id,)] = moved.get((product_id,), 0) + abs(qty)
+
+    # The new file carries the partition's earlier rows too; the old one is removed once the
+    # transaction commits, and a crash before that only leaves an unreferenced file behind
+    partition = db.session.get(MovementArchive, key)
+    previous = _partition_rows(partition.path) if partition else []
+    # IDs are unique across the table and the archive (new movements cannot reuse archived
+    # ones), so a clash means one of the two rows would be lost: stop rather than drop it
+    clashes = set(movement_id for (movement_id,) in db.session.query(ArchivedMovementId.movement_id).filter(
+        ArchivedMovementId.movement_id.in_(select(ProductMovement.movement_id).where(in_step))))
+    clashes |= {row[0] for row in previous} & {row[0] for row in rows}
+    if clashes:
+        db.session.rollback()
+        raise RuntimeError(f'Cannot archive {key}: movement ID(s) already archived: {", ".join(sorted(clashes)[:10])}')
+    db.session.execute(ArchivedMovementId.__table__.insert(), [{'movement_id': row[0], 'partition': key} for row in rows])
+    merged = previous + rows
+    os.makedirs(current_app.config['ARCHIVE_DIR'], exist_ok=True)
+    filename = f'movements-{key}-{uuid.uuid4().hex[:8]}.zip'
+    path = os.path.join(current_app.config['ARCHIVE_DIR'], filename)
+    meta = archive.write_partition(path, merged)
+    old_path = partition.path if partition else None
+    if partition is None:
+        partition = MovementArchive(partition=key)
+        db.session.add(partition)
+    partition.path = filename
+    partition.row_count = meta['rows']
+    partition.first_timestamp = datetime.fromisoformat(meta['first_timestamp'])
+    partition.last_timestamp = datetime.fromisoformat(meta['last_timestamp'])
+    partition.archived_through = through
+
+    _add_to_archive_totals(ArchivedBalance, 'qty', {key: delta for key, delta in deltas.items() if delta})
+    _add_to_archive_totals(ArchivedProductTotal, 'qty_moved', moved)
+    # SQLite's write lock keeps other writers out of the month; elsewhere a movement written
+    # since the SELECT shows up as an extra deleted row and the step is retried
+    if db.session.execute(ProductMovement.__table__.delete().where(in_step)).rowcount != len(rows):
+        db.session.rollback()
+        os.remove(path)
+        return key, None
+    db.session.commit()
+    if old_path:
+        try:
+            os.remove(os.path.join(current_app.config['ARCHIVE_DIR'], old_path))
+        except OSError:
+            current_app.logger.warning(f'Could not remove superseded archive file {old_path}')
+    return key, len(rows)
+
+def archive_movements(before=None, progress=None):
+    # Archives every movement with timestamp <= before (default: older than
+    # ARCHIVE_RETENTION_DAYS), a month per transaction; returns {partition: rows archived}
+    before = before or datetime.utcnow() - timedelta(days=current_app.config['ARCHIVE_RETENTION_DAYS'])
+    archived = {}
+    while True:
+        step = _archive_oldest_partition(before)
+        if step is None:
+            break
+        key, rows = step
+        if rows is None:
+            if progress:
+                progress(None, f'{key} changed while archiving it; retrying')
+            continue
+        archived[key] = archived.get(key, 0) + rows
+        if progress:
+            progress(None, f'Archived {rows} movement(s) into {key}')
+    if archived:
+        invalidate_dashboard_cache()
+    return archived
+
+# Movement rollups - hourly and daily totals per product/location maintained alongside the
+# ledger, so trend charts over long ranges read a few rows per bucket instead of every movement
+ROLLUP_GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+ROLLUP_MEASURES = ('movement_count', 'qty_in', 'qty_out')
+
+def rollup_bucket(timestamp, granularity):
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def movement_rollup_deltas(product_id, from_location, to_location, qty, timestamp, sign=1):
+    # {(granularity, product_id, location_id, bucket): (count, qty_in, qty_out)} for one movement
+    sides = [('', 0 if from_location else qty, 0 if to_location else qty)]
+    if from_location:
+        sides.append((from_location, 0, qty))
+    if to_location:
+        sides.append((to_location, qty, 0))
+    deltas = {}
+    for granularity in ROLLUP_GRANULARITIES:
+        bucket = rollup_bucket(timestamp, granularity)
+        for product in (product_id, ''):
+            for location_id, qty_in, qty_out in sides:
+                deltas[(granularity, product, location_id, bucket)] = (sign, sign * qty_in, sign * qty_out)
+    return deltas
+
+def merge_rollup_deltas(*deltas_list):
+    merged = {}
+    for deltas in deltas_list:
+        for key, values in deltas.items():
+            merged[key] = tuple(a + b for a, b in zip(merged.get(key, (0, 0, 0)), values))
+    return merged
+
+def apply_rollup_deltas(deltas):
+    rows = [dict(zip(('granularity', 'product_id', 'location_id', 'bucket') + ROLLUP_MEASURES, key + values))
+            for key, values in deltas.items() if any(values)]
+    if not rows:
+        return
+    table = MovementRollup.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'postgresql':
+            # Importing the PostgreSQL dialect pulls in its async drivers too; SQLite never needs it
+            from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        insert = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(table)
+        db.session.execute(insert.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={measure: table.c[measure] + insert.excluded[measure] for measure in ROLLUP_MEASURES}
+        ), rows)
+        return
+    # Elsewhere: the update-then-insert used by apply_balance_deltas()
+    key_columns = [table.c[column] for column in ('granularity', 'product_id', 'location_id', 'bucket')]
+    existing = set(db.session.query(*key_columns).filter(
+        table.c.bucket.in_({row['bucket'] for row in rows})).all())
+    updates = [{f'b_{column}': value for column, value in row.items()} for row in rows
+               if (row['granularity'], row['product_id'], row['location_id'], row['bucket']) in existing]
+    if updates:
+        db.session.execute(
+            table.update()
+            .where(*(column == bindparam(f'b_{column.name}') for column in key_columns))
+            .values({measure: table.c[measure] + bindparam(f'b_{measure}') for measure in ROLLUP_MEASURES}),
+            updates
+        )
+    inserts = [row for row in rows
+               if (row['granularity'], row['product_id'], row['location_id'], row['bucket']) not in existing]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+TREND_RANGE_UNITS = {'h': timedelta(hours=1), 'd': timedelta(days=1), 'w': timedelta(weeks=1),
+                     'y': timedelta(days=365)}
+TREND_MAX_BUCKETS = 2000
+TREND_SERIES_LIMIT = 5
+TREND_MAX_SERIES = 20
+
+def _as_datetime(value):
+    # Aggregates over a DateTime column come back as strings on SQLite
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def trend_window_from_request(args):
+    # Returns (granularity, start, end) with start/end on bucket boundaries; end is exclusive.
+    # Raises ValueError on malformed or oversized windows
+    granularity = args.get('granularity', 'day')
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f'Invalid granularity: {granularity}')
+    step = ROLLUP_GRANULARITIES[granularity]
+    current = rollup_bucket(datetime.utcnow(), granularity)
+    if args.get('start') or args.get('end'):
+        # Dates, both inclusive; a missing end means the current bucket
+        end = datetime.combine(date.fromisoformat(args['end']) + timedelta(days=1), datetime.min.time()) \
+            if args.get('end') else current + step
+        start = datetime.combine(date.fromisoformat(args['start']), datetime.min.time()) \
+            if args.get('start') else end - 7 * TREND_RANGE_UNITS['d']
+    else:
+        match = re.fullmatch(r'(\d+)([hdwy])', args.get('range', '7d'))
+        if not match:
+            raise ValueError(f"Invalid range: {args.get('range')}")
+        span = int(match.group(1)) * TREND_RANGE_UNITS[match.group(2)]
+        end = current + step
+        start = end - math.ceil(span / step) * step
+    count = (end - start) // step
+    if count <= 0:
+        raise ValueError('The trend window is empty')
+    if count > TREND_MAX_BUCKETS:
+        raise ValueError(f'The trend window spans {count} buckets; the limit is {TREND_MAX_BUCKETS}')
+    return granularity, start, end
+
+def _rollup_bucket_expression(timestamp, granularity):
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # Formatted the way SQLAlchemy stores DateTime on SQLite, so rows written on either path match
+        return func.strftime('%Y-%m-%d %H:00:00.000000' if granularity == 'hour' else '%Y-%m-%d 00:00:00.000000',
+                             timestamp)
+    return func.date_trunc(granularity, timestamp)
+
+def rebuild_movement_rollups():
+    # Recomputes every rollup row from ProductMovement in the database, then adds the archived
+    # movements a partition at a time; returns the row count
+    has_from = and_(ProductMovement.from_location.isnot(None), ProductMovement.from_location != '')
+    has_to = and_(ProductMovement.to_location.isnot(None), ProductMovement.to_location != '')
+    one, zero = literal(1), literal(0)
+    sides = union_all(
+        select(ProductMovement.product_id, literal('').label('location_id'), one.label('movement_count'),
+               case((has_from, 0), else_=ProductMovement.qty).label('qty_in'),
+               case((has_to, 0), else_=ProductMovement.qty).label('qty_out'), ProductMovement.timestamp),
+        select(ProductMovement.product_id, ProductMovement.from_location, one, zero, ProductMovement.qty,
+               ProductMovement.timestamp).where(has_from),
+        select(ProductMovement.product_id, ProductMovement.to_location, one, ProductMovement.qty, zero,
+               ProductMovement.timestamp).where(has_to)
+    ).subquery()
+    table = MovementRollup.__table__
+    MovementRollup.query.delete()
+    for granularity in ROLLUP_GRANULARITIES:
+        bucket = _rollup_bucket_expression(sides.c.timestamp, granularity)
+        for product in (sides.c.product_id, literal('')):
+            group_by = [bucket, sides.c.location_id] + ([] if product is not sides.c.product_id else [product])
+            db.session.execute(table.insert().from_select(
+                ['granularity', 'product_id', 'location_id', 'bucket'] + list(ROLLUP_MEASURES),
+                select(literal(granularity), product, sides.c.location_id, bucket,
+                       *(func.sum(sides.c[measure]) for measure in ROLLUP_MEASURES)).group_by(*group_by)
+            ))
+    for partition in _archived_partitions():
+        apply_rollup_deltas(merge_rollup_deltas(*(
+            movement_rollup_deltas(product_id, from_location, to_location, qty, timestamp)
+            for _, timestamp, product_id, from_location, to_location, qty in _partition_rows(partition.path))))
+    count = MovementRollup.query.count()
+    db.session.commit()
+    return count
+
+# Streaming export - rows are pulled from the database in batches and written out as they
+# arrive, so memory stays flat regardless of table size
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+MOVEMENT_EXPORT_COLUMNS = ('movement_id', 'timestamp', 'product_id', 'from_location', 'to_location', 'qty')
+BALANCE_EXPORT_COLUMNS = ('product_id', 'product_name', 'location_id', 'location_name', 'qty')
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_export_value(value) for value in row])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_chunks(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, (_export_value(value) for value in row)))) + '\n')
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def movement_export_rows(filters):
+    # Newest first, continuing into the archive (archive.FIELDS matches the export columns)
+    columns = [getattr(ProductMovement, column) for column in MOVEMENT_EXPORT_COLUMNS]
+    rows = filter_movements(db.session.query(*columns), **filters) \
+        .order_by(*NEWEST_MOVEMENTS_FIRST) \
+        .yield_per(EXPORT_BATCH_SIZE)
+    return chain(rows, iter_archived_movements(filters))
+
+def balance_export_rows(at=None):
+    if at is not None:
+        return ([row[column] for column in BALANCE_EXPORT_COLUMNS] for row in balance_rows(balances_as_of(at)))
+    return db.session.query(
+        StockBalance.product_id,
+        func.coalesce(Product.name, StockBalance.product_id),
+        StockBalance.location_id,
+        func.coalesce(Location.name, StockBalance.location_id),
+        StockBalance.qty
+    ).outerjoin(Product, Product.product_id == StockBalance.product_id) \
+     .outerjoin(Location, Location.location_id == StockBalance.location_id) \
+     .filter(StockBalance.qty != 0) \
+     .order_by(StockBalance.product_id, StockBalance.location_id) \
+     .yield_per(EXPORT_BATCH_SIZE)
+
+def export_chunks(fmt, columns, rows):
+    return _csv_chunks(columns, rows) if fmt == 'csv' else _ndjson_chunks(columns, rows)
+
+def streaming_export(filename, fmt, columns, rows):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    chunks = export_chunks(fmt, columns, rows)
+    headers = {'Content-Disposition': f'attachment; filename={filename}.{fmt}'}
+    if request.accept_encodings['gzip']:
+        body = _gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = (chunk.encode('utf-8') for chunk in chunks)
+    headers['Vary'] = 'Accept-Encoding'
+    return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+# Bulk movement ingestion
+BULK_IMPORT_CHUNK_SIZE = 1000
+
+def apply_balance_deltas(deltas):
+    # Batched counterpart of apply_movement_to_balances(): {(product_id, location_id): delta}
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    product_ids = {product_id for product_id, _ in deltas}
+    existing = set(db.session.query(StockBalance.product_id, StockBalance.location_id)
+                   .filter(StockBalance.product_id.in_(product_ids)).all())
+    table = StockBalance.__table__
+    updates = [{'b_product_id': p, 'b_location_id': l, 'delta': d}
+               for (p, l), d in deltas.items() if (p, l) in existing]
+    inserts = [{'product_id': p, 'location_id': l, 'qty': d}
+               for (p, l), d in deltas.items() if (p, l) not in existing]
+    if updates:
+        db.session.execute(
+            table.update()
+            .where(table.c.product_id == bindparam('b_product_id'),
+                   table.c.location_id == bindparam('b_location_id'))
+            .values(qty=table.c.qty + bindparam('delta')),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+def _validate_movement_record(record, product_ids, location_ids, default_id=None):
+    # Returns a row dict ready for insert; raises ValueError describing the first problem.
+    # A row without a movement_id gets default_id, or a new time-ordered one
+    if not isinstance(record, dict):
+        raise ValueError('Row must be an object')
+    movement_id = str(record.get('movement_id') or '').strip() or default_id or new_ulid()
+    product_id = record.get('product_id') or None
+    if product_id not in product_ids:
+        raise ValueError(f'Unknown product_id: {product_id}')
+    from_location, to_location, qty = validate_movement_fields(
+        record.get('from_location'), record.get('to_location'), record.get('qty'))
+    for location_id in (from_location, to_location):
+        if location_id and location_id not in location_ids:
+            raise ValueError(f'Unknown location_id: {location_id}')
+    timestamp = record.get('timestamp')
+    try:
+        timestamp = datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid timestamp: {timestamp}')
+    return {
+        'movement_id': movement_id,
+        'timestamp': timestamp,
+        'from_location': from_location,
+        'to_location': to_location,
+        'product_id': product_id,
+        'qty': qty
+    }
+
+def _reject_overdrawn_rows(rows, row_deltas, errors):
+    # Replays the chunk in order against locked on-hand quantities and drops any row that
+    # would take a balance below zero; stock added earlier in the chunk counts
+    product_ids = {product_id for deltas in row_deltas for product_id, _ in deltas}
+    on_hand = {(product_id, location_id): qty for product_id, location_id, qty in
+               db.session.query(StockBalance.product_id, StockBalance.location_id, StockBalance.qty)
+               .filter(StockBalance.product_id.in_(product_ids)).with_for_update()}
+    accepted_rows, accepted_deltas = [], []
+    for (row_number, row), deltas in zip(rows, row_deltas):
+        short = [key for key, delta in deltas.items() if delta < 0 and on_hand.get(key, 0) + delta < 0]
+        if short:
+            product_id, location_id = short[0]
+            errors.append({'row': row_number, 'error': str(InsufficientStockError(product_id, location_id, row['qty']))})
+            continue
+        for key, delta in deltas.items():
+            on_hand[key] = on_hand.get(key, 0) + delta
+        accepted_rows.append((row_number, row))
+        accepted_deltas.append(deltas)
+    return accepted_rows, accepted_deltas
+
+def _import_movement_chunk(chunk, product_ids, location_ids, errors, movement_ids):
+    rows = []
+    seen_ids = set()
+    cutoff = archive_cutoff()
+    for row_number, record in chunk:
+        try:
+            row = _validate_movement_record(record, product_ids, location_ids,
+                                            movement_ids(row_number) if movement_ids else None)
+            check_not_archived(row['timestamp'], cutoff)
+        except ValueError as e:
+            errors.append({'row': row_number, 'error': str(e)})
+            continue
+        if row['movement_id'] in seen_ids:
+            errors.append({'row': row_number, 'error': f"Duplicate movement_id: {row['movement_id']}"})
+            continue
+        seen_ids.add(row['movement_id'])
+        rows.append((row_number, row))
+
+    taken = set(movement_id for (movement_id,) in db.session.query(ProductMovement.movement_id)
+                .filter(ProductMovement.movement_id.in_(seen_ids))) | archived_movement_ids(seen_ids)
+    for row_number, row in rows:
+        if row['movement_id'] in taken:
+            errors.append({'row': row_number, 'error': f"Duplicate movement_id: {row['movement_id']}"})
+    rows = [(row_number, row) for row_number, row in rows if row['movement_id'] not in taken]
+    row_deltas = [movement_balance_deltas(row['product_id'], row['from_location'],
+                                          row['to_location'], row['qty']) for _, row in rows]
+    if not current_app.config['ALLOW_NEGATIVE_STOCK']:
+        rows, row_deltas = _reject_overdrawn_rows(rows, row_deltas, errors)
+    row_numbers = [row_number for row_number, _ in rows]
+    rows = [row for _, row in rows]
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    try:
+        db.session.execute(ProductMovement.__table__.insert(), rows)
+        apply_balance_deltas(merge_balance_deltas(*row_deltas))
+        apply_rollup_deltas(merge_rollup_deltas(*(
+            movement_rollup_deltas(row['product_id'], row['from_location'], row['to_location'], row['qty'],
+                                   row['timestamp']) for row in rows)))
+        invalidate_snapshots_from(min(row['timestamp'] for row in rows))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        # Rows rejected above already have their own error; only the submitted ones failed here
+        for row_number in row_numbers:
+            errors.append({'row': row_number, 'error': f'Chunk failed: {e}'})
+        return 0
+    invalidate_dashboard_cache()
+    for row, deltas in zip(rows, row_deltas):
+        publish_movement_event('movement_created', row, deltas)
+    return len(rows)
+
+def import_movements(records, chunk_size=BULK_IMPORT_CHUNK_SIZE, movement_ids=None):
+    # records is an iterable of dicts (or ValueError instances for unparseable rows);
+    # each chunk commits on its own so one bad row never aborts the whole import.
+    # movement_ids(row_number) names rows that carry no movement_id; by default they get new IDs
+    product_ids = set(product_id for (product_id,) in db.session.query(Product.product_id))
+    location_ids = set(location_id for (location_id,) in db.session.query(Location.location_id))
+    # records may be read off the network (NDJSON from request.stream), so no transaction, and
+    # on SQLite no write lock, is held while a chunk is read; each chunk opens its own
+    db.session.commit()
+    inserted = 0
+    errors = []
+    numbered = enumerate(records, start=1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+        parsed = []
+        for row_number, record in chunk:
+            if isinstance(record, ValueError):
+                errors.append({'row': row_number, 'error': str(record)})
+            else:
+                parsed.append((row_number, record))
+        inserted += _import_movement_chunk(parsed, product_ids, location_ids, errors, movement_ids)
+    errors.sort(key=lambda error: error['row'])
+    return inserted, errors
+
+def _parse_ndjson(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f'Invalid JSON: {e}')
+
+# Idempotency keys - a client that may retry POST /api/movements or /api/movements/bulk sends an
+# Idempotency-Key header. The outcome is stored under the key and replayed to retries of the same
+# request for IDEMPOTENCY_TTL_SECONDS, so a retry costs one primary-key lookup instead of a
+# failed (or duplicated) write. A single movement is stored in the transaction that creates it.
+# A bulk import commits chunk by chunk, so its key is recorded before the first chunk and rows
+# without a movement_id get IDs derived from the key: a retry of an interrupted import finds the
+# rows already written as duplicates instead of inserting them again
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+def idempotency_key_from_request():
+    # None without the header; raises ValueError for a malformed key
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > 255 or not key.isprintable():
+        raise ValueError(f'{IDEMPOTENCY_HEADER} must be 1 to 255 printable characters')
+    return key
+
+def request_fingerprint():
+    # Ties a key to one request: the same key with another endpoint or body is rejected
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def find_idempotency_record(key):
+    # The unexpired record for key, or None
+    record = db.session.get(IdempotencyKey, key)
+    ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS'])
+    if record is None or record.created_at <= datetime.utcnow() - ttl:
+        return None
+    return record
+
+def stage_idempotency_record(key, fingerprint, response=None):
+    # Adds the key to the current transaction, clearing out expired keys (this one included)
+    # first; a concurrent request holding the same key makes the commit fail with IntegrityError
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL_SECONDS'])
+    IdempotencyKey.query.filter(IdempotencyKey.created_at <= cutoff).delete()
+    record = IdempotencyKey(key=key, fingerprint=fingerprint)
+    if response is not None:
+        record.status_code, record.response = response.status_code, response.get_data(as_text=True)
+    db.session.add(record)
+    return record
+
+def idempotent_replay(record, fingerprint):
+    # The stored response for a retried request; None while a bulk import under the key is unfinished
+    if record.fingerprint != fingerprint:
+        return jsonify({'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'}), 422
+    if record.response is None:
+        return None
+    return current_app.response_class(record.response, status=record.status_code, mimetype='application/json',
+                                      headers={'Idempotent-Replayed': 'true'})
+
+# Background jobs - heavy work runs on a pool of worker threads instead of the request thread.
+# The job table is the queue: workers claim rows with a conditional UPDATE, so jobs survive
+# restarts and web processes and `flask run-jobs` workers can share one queue
+JobTask = namedtuple('JobTask', 'run validate read_only')
+JOB_TASKS = {}
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+JOB_PROGRESS_EVERY = EXPORT_BATCH_SIZE * 10
+
+def job_task(kind, validate=None, read_only=False):
+    # run(params, progress) returns a JSON-serializable result; validate(params) raises
+    # ValueError at submission; read-only tasks run in deferred transactions
+    def register(run):
+        JOB_TASKS[kind] = JobTask(run, validate, read_only)
+        return run
+    return register
+
+def _update_job(job_id, **values):
+    # A short transaction of its own, so progress shows while the job's session is mid-query
+    with db.engine.begin() as connection:
+        return connection.execute(Job.__table__.update().where(Job.job_id == job_id).values(**values)).rowcount
+
+def report_job_progress(job_id, fraction, message=None):
+    values = {'heartbeat_at': datetime.utcnow(), 'message': message}
+    if fraction is not None:
+        values['progress'] = max(0.0, min(fraction, 1.0))
+    _update_job(job_id, **values)
+
+def submit_job(kind, params=None):
+    task = JOB_TASKS.get(kind)
+    if task is None:
+        raise ValueError(f'Unknown job kind: {kind}')
+    params = params or {}
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    if task.validate:
+        task.validate(params)
+    job = Job(job_id=uuid.uuid4().hex, kind=kind, params=json.dumps(params))
+    db.session.add(job)
+    db.session.commit()
+    job_runner.notify()
+    return job
+
+def claim_next_job(app):
+    table = Job.__table__
+    with app.app_context():
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=app.config['JOB_STALE_SECONDS'])
+        # Polling an idle queue only reads, so it never takes SQLite's write lock
+        with read_only_transactions(), db.engine.connect() as connection:
+            pending = connection.execute(select(table.c.job_id).where(or_(
+                table.c.status == 'queued',
+                and_(table.c.status == 'running', table.c.heartbeat_at < stale)
+            )).limit(1)).first()
+        if pending is None:
+            return None
+        with db.engine.begin() as connection:
+            # Jobs whose worker stopped heartbeating died with it: retry them, up to a limit
+            connection.execute(table.update().where(
+                table.c.status == 'running', table.c.heartbeat_at < stale,
+                table.c.attempts >= app.config['JOB_MAX_ATTEMPTS']
+            ).values(status='failed', error='Worker stopped responding', finished_at=now))
+            connection.execute(table.update().where(
+                table.c.status == 'running', table.c.heartbeat_at < stale
+            ).values(status='queued', message='Requeued after its worker stopped responding'))
+            for (job_id,) in connection.execute(select(table.c.job_id).where(table.c.status == 'queued')
+                                                .order_by(table.c.created_at).limit(5)):
+                claimed = connection.execute(table.update().where(
+                    table.c.job_id == job_id, table.c.status == 'queued'
+                ).values(status='running', started_at=now, heartbeat_at=now, progress=0.0,
+                         attempts=table.c.attempts + 1)).rowcount
+                if claimed:
+                    return job_id
+    return None
+
+def _heartbeat_job(app, job_id, stop):
+    with app.app_context():
+        while not stop.wait(app.config['JOB_STALE_SECONDS'] / 3):
+            try:
+                _update_job(job_id, heartbeat_at=datetime.utcnow())
+            except SQLAlchemyError:
+                app.logger.warning('Heartbeat for job %s failed', job_id, exc_info=True)
+
+def execute_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        kind, task, params = job.kind, JOB_TASKS.get(job.kind), json.loads(job.params)
+        # Read nothing through `job` after this: reloading it would begin a transaction that, on
+        # SQLite, holds the write lock the status updates below need
+        db.session.commit()
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat_job, args=(app, job_id, stop), daemon=True).start()
+        try:
+            if task is None:
+                raise ValueError(f'Unknown job kind: {kind}')
+            with read_only_transactions() if task.read_only else nullcontext():
+                result = task.run(params, lambda fraction, message=None: report_job_progress(job_id, fraction, message))
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Job %s (%s) failed', job_id, kind)
+            _update_job(job_id, status='failed', error=str(e) or type(e).__name__, finished_at=datetime.utcnow())
+        else:
+            _update_job(job_id, status='succeeded', progress=1.0, message=None, result=json.dumps(result),
+                        finished_at=datetime.utcnow())
+        finally:
+            stop.set()
+
+@bp.before_app_request
+def start_job_runner():
+    # Started lazily so each (possibly forked) worker process gets its own pool
+    if current_app.config['JOB_WORKERS']:
+        job_runner.start()
+
+def job_to_dict(job):
+    return {
+        'job_id': job.job_id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def _rows_with_progress(rows, total, progress):
+    for count, row in enumerate(rows, start=1):
+        yield row
+        if count % JOB_PROGRESS_EVERY == 0:
+            progress(count / total if total else None, f'{count} of {total} rows')
+
+def _export_to_file(name, fmt, columns, rows):
+    os.makedirs(current_app.config['JOBS_DIR'], exist_ok=True)
+    path = os.path.join(current_app.config['JOBS_DIR'], name)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for chunk in export_chunks(fmt, columns, rows):
+            f.write(chunk)
+    return path
+
+def _validate_export_format(params):
+    if params.get('format', 'csv') not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {params.get('format')}")
+
+def _validate_movement_export(params):
+    _validate_export_format(params)
+    movement_filters_from_request(params)
+
+def _validate_balance_export(params):
+    _validate_export_format(params)
+    if params.get('as_of'):
+        parse_as_of(params['as_of'])
+
+@job_task('export_movements', validate=_validate_movement_export, read_only=True)
+def export_movements_job(params, progress):
+    fmt, filters = params.get('format', 'csv'), movement_filters_from_request(params)
+    total = filter_movements(db.session.query(func.count(ProductMovement.movement_id)), **filters).scalar() \
+        + estimate_archived_movements(filters)
+    progress(0.0, f'Exporting up to {total} movements')
+    rows = _rows_with_progress(movement_export_rows(filters), total, progress)
+    # zip() stops at the last row without drawing from the counter again
+    exported = count()
+    path = _export_to_file(f'movements-{uuid.uuid4().hex}.{fmt}', fmt, MOVEMENT_EXPORT_COLUMNS,
+                           (row for row, _ in zip(rows, exported)))
+    return {'file': os.path.basename(path), 'format': fmt, 'rows': next(exported)}
+
+@job_task('export_balances', validate=_validate_balance_export, read_only=True)
+def export_balances_job(params, progress):
+    fmt = params.get('format', 'csv')
+    at = parse_as_of(params['as_of']) if params.get('as_of') else None
+    total = None if at else StockBalance.query.filter(StockBalance.qty != 0).count()
+    progress(0.0, 'Computing balances' if at else f'Exporting {total} balances')
+    rows = _rows_with_progress(balance_export_rows(at), total, progress)
+    path = _export_to_file(f'balances-{uuid.uuid4().hex}.{fmt}', fmt, BALANCE_EXPORT_COLUMNS, rows)
+    return {'file': os.path.basename(path), 'format': fmt, 'as_of': at.isoformat() if at else None}
+
+def _validate_archive(params):
+    if params.get('before'):
+        parse_as_of(params['before'])
+
+@job_task('archive_movements', validate=_validate_archive)
+def archive_movements_job(params, progress):
+    before = parse_as_of(params['before']) if params.get('before') else None
+    archived = archive_movements(before, progress)
+    return {'partitions': archived, 'rows': sum(archived.values())}
+
+@job_task('rebuild_rollups')
+def rebuild_rollups_job(params, progress):
+    progress(0.0, 'Recomputing hourly and daily rollups')
+    return {'rows': rebuild_movement_rollups()}
+
+@job_task('rebuild_balances')
+def rebuild_balances_job(params, progress):
+    progress(0.0, 'Checking the ledger for drift')
+    drift = verify_stock_balances()
+    # End the read before reporting progress; on SQLite it holds the write lock
+    db.session.commit()
+    if params.get('verify_only'):
+        return {'drifted': len(drift), 'rebuilt': None}
+    progress(0.5, f'Rebuilding ({len(drift)} drifted balance(s))')
+    return {'drifted': len(drift), 'rebuilt': rebuild_stock_balances()}
 
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/showcase')
+@bp.route('/showcase')
 def showcase():
     products_count = Product.query.count()
     locations_count = Location.query.count()
-    movements_count = ProductMovement.query.count()
+    movements_count = count_movements()
     return render_template('showcase.html',
                            products_count=products_count,
                            locations_count=locations_count,
                            movements_count=movements_count)
 
 # Product Routes
-@app.route('/products')
+@bp.route('/products')
+@cached_page
 def products():
-    products = Product.query.all()
-    return render_template('products.html', products=products)
+    products, next_after = catalogue_page(Product, request.args)
+    return render_template('products.html', products=products, next_after=next_after,
+                           q=request.args.get('q', ''))
 
-@app.route('/products/add', methods=['GET', 'POST'])
+@bp.route('/products/add', methods=['GET', 'POST'])
 def add_product():
     if request.method == 'POST':
         product = Product(
@@ -76,12 +1947,12 @@ def add_product():
             db.session.add(product)
             db.session.commit()
             flash('Product added successfully!', 'success')
-            return redirect(url_for('products'))
+            return redirect(url_for('.products'))
         except Exception as e:
             flash(f'Error adding product: {str(e)}', 'error')
     return render_template('add_product.html')
 
-@app.route('/products/edit/<product_id>', methods=['GET', 'POST'])
+@bp.route('/products/edit/<product_id>', methods=['GET', 'POST'])
 def edit_product(product_id):
     product = Product.query.get_or_404(product_id)
     if request.method == 'POST':
@@ -90,23 +1961,25 @@ def edit_product(product_id):
         try:
             db.session.commit()
             flash('Product updated successfully!', 'success')
-            return redirect(url_for('products'))
+            return redirect(url_for('.products'))
         except Exception as e:
             flash(f'Error updating product: {str(e)}', 'error')
     return render_template('edit_product.html', product=product)
 
-@app.route('/products/view/<product_id>')
+@bp.route('/products/view/<product_id>')
 def view_product(product_id):
     product = Product.query.get_or_404(product_id)
     return render_template('view_product.html', product=product)
 
 # Location Routes
-@app.route('/locations')
+@bp.route('/locations')
+@cached_page
 def locations():
-    locations = Location.query.all()
-    return render_template('locations.html', locations=locations)
+    locations, next_after = catalogue_page(Location, request.args)
+    return render_template('locations.html', locations=locations, next_after=next_after,
+                           q=request.args.get('q', ''))
 
-@app.route('/locations/add', methods=['GET', 'POST'])
+@bp.route('/locations/add', methods=['GET', 'POST'])
 def add_location():
     if request.method == 'POST':
         location = Location(
@@ -118,12 +1991,12 @@ def add_location():
             db.session.add(location)
             db.session.commit()
             flash('Location added successfully!', 'success')
-            return redirect(url_for('locations'))
+            return redirect(url_for('.locations'))
         except Exception as e:
             flash(f'Error adding location: {str(e)}', 'error')
     return render_template('add_location.html')
 
-@app.route('/locations/edit/<location_id>', methods=['GET', 'POST'])
+@bp.route('/locations/edit/<location_id>', methods=['GET', 'POST'])
 def edit_location(location_id):
     location = Location.query.get_or_404(location_id)
     if request.method == 'POST':
@@ -132,178 +2005,527 @@ def edit_location(location_id):
         try:
             db.session.commit()
             flash('Location updated successfully!', 'success')
-            return redirect(url_for('locations'))
+            return redirect(url_for('.locations'))
         except Exception as e:
             flash(f'Error updating location: {str(e)}', 'error')
     return render_template('edit_location.html', location=location)
 
-@app.route('/locations/view/<location_id>')
+@bp.route('/locations/view/<location_id>')
 def view_location(location_id):
     location = Location.query.get_or_404(location_id)
     return render_template('view_location.html', location=location)
 
 # Product Movement Routes
-@app.route('/movements')
+@bp.route('/movements')
 def movements():
-    movements = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).all()
-    return render_template('movements.html', movements=movements)
+    try:
+        filters = movement_filters_from_request(request.args)
+        movements, next_cursor = query_movements_page(filters, request.args.get('cursor'),
+                                                      page_size_from_request(request.args))
+    except ValueError as e:
+        abort(400, description=str(e))
+    filter_args = {key: request.args[key] for key in ('product_id', 'location_id', 'direction', 'start', 'end', 'limit')
+                   if request.args.get(key)}
+    return render_template('movements.html', movements=movements, next_cursor=next_cursor,
+                           filter_args=filter_args, is_first_page=not request.args.get('cursor'))
 
-@app.route('/movements/add', methods=['GET', 'POST'])
+@bp.route('/movements/add', methods=['GET', 'POST'])
 def add_movement():
     if request.method == 'POST':
-        movement = ProductMovement(
-            movement_id=request.form['movement_id'],
-            from_location=request.form['from_location'] if request.form['from_location'] else None,
-            to_location=request.form['to_location'] if request.form['to_location'] else None,
-            product_id=request.form['product_id'],
-            qty=int(request.form['qty'])
-        )
+        row = {
+            'movement_id': request.form['movement_id'].strip() or new_ulid(),
+            'from_location': request.form['from_location'] if request.form['from_location'] else None,
+            'to_location': request.form['to_location'] if request.form['to_location'] else None,
+            'product_id': request.form['product_id'],
+            'qty': request.form['qty']
+        }
         try:
-            db.session.add(movement)
-            db.session.commit()
+            require_catalogue_entries(row['product_id'], row['from_location'], row['to_location'])
+            create_movement(row)
             flash('Movement added successfully!', 'success')
-            return redirect(url_for('movements'))
+            return redirect(url_for('.movements'))
+        except IntegrityError:
+            # Usually the same form submitted twice; the form carries its ID so it lands once
+            flash(f"Movement {row['movement_id']} already exists and was not added again.", 'error')
         except Exception as e:
             flash(f'Error adding movement: {str(e)}', 'error')
     
-    products = Product.query.all()
-    locations = Location.query.all()
-    return render_template('add_movement.html', products=products, locations=locations)
+    return render_template('add_movement.html', movement_id=new_ulid())
 
-@app.route('/movements/edit/<movement_id>', methods=['GET', 'POST'])
+@bp.route('/movements/edit/<movement_id>', methods=['GET', 'POST'])
 def edit_movement(movement_id):
     movement = ProductMovement.query.get_or_404(movement_id)
     if request.method == 'POST':
-        movement.from_location = request.form['from_location'] if request.form['from_location'] else None
-        movement.to_location = request.form['to_location'] if request.form['to_location'] else None
+        try:
+            from_location, to_location, qty = validate_movement_fields(
+                request.form['from_location'], request.form['to_location'], request.form['qty'])
+            require_catalogue_entries(request.form['product_id'], from_location, to_location)
+        except ValueError as e:
+            flash(f'Error updating movement: {str(e)}', 'error')
+            return render_template('edit_movement.html', movement=movement)
+        reversed_deltas = movement_balance_deltas(movement.product_id, movement.from_location,
+                                                  movement.to_location, movement.qty, sign=-1)
+        reversed_rollups = movement_rollup_deltas(movement.product_id, movement.from_location,
+                                                  movement.to_location, movement.qty, movement.timestamp, sign=-1)
+        movement.from_location = from_location
+        movement.to_location = to_location
         movement.product_id = request.form['product_id']
-        movement.qty = int(request.form['qty'])
+        movement.qty = qty
+        # Only the net change is checked, so editing a movement never trips over its own stock
+        deltas = merge_balance_deltas(reversed_deltas, movement_balance_deltas(
+            movement.product_id, movement.from_location, movement.to_location, movement.qty))
         try:
+            adjust_balances(deltas)
+            apply_rollup_deltas(merge_rollup_deltas(reversed_rollups, movement_rollup_deltas(
+                movement.product_id, movement.from_location, movement.to_location, movement.qty, movement.timestamp)))
+            invalidate_snapshots_from(movement.timestamp)
             db.session.commit()
-            flash('Movement updated successfully!', 'success')
-            return redirect(url_for('movements'))
         except Exception as e:
+            db.session.rollback()
             flash(f'Error updating movement: {str(e)}', 'error')
+        else:
+            publish_movement_event('movement_updated', movement_to_dict(movement), deltas)
+            flash('Movement updated successfully!', 'success')
+            return redirect(url_for('.movements'))
     
-    products = Product.query.all()
-    locations = Location.query.all()
-    return render_template('edit_movement.html', movement=movement, products=products, locations=locations)
+    return render_template('edit_movement.html', movement=movement)
 
-@app.route('/movements/view/<movement_id>')
+@bp.route('/movements/view/<movement_id>')
 def view_movement(movement_id):
-    movement = ProductMovement.query.get_or_404(movement_id)
+    movement = with_movement_relations(ProductMovement.query) \
+        .filter(ProductMovement.movement_id == movement_id).first() or find_archived_movement(movement_id)
+    if movement is None:
+        abort(404)
     return render_template('view_movement.html', movement=movement)
 
 # Balance Report Route
-@app.route('/balance')
+@bp.route('/balance')
 def balance_report():
-    # Calculate balance for each product in each location
-    balance_data = {}
-    
-    # Get all movements
-    movements = ProductMovement.query.all()
-    
-    for movement in movements:
-        product_id = movement.product_id
-        qty = movement.qty
-        
-        # Initialize product in balance_data if not exists
-        if product_id not in balance_data:
-            balance_data[product_id] = {}
-        
-        # Handle incoming movements (to_location)
-        if movement.to_location:
-            if movement.to_location not in balance_data[product_id]:
-                balance_data[product_id][movement.to_location] = 0
-            balance_data[product_id][movement.to_location] += qty
-        
-        # Handle outgoing movements (from_location)
-        if movement.from_location:
-            if movement.from_location not in balance_data[product_id]:
-                balance_data[product_id][movement.from_location] = 0
-            balance_data[product_id][movement.from_location] -= qty
-    
-    # Convert to list format for template
+    as_of = request.args.get('as_of')
+    if as_of:
+        try:
+            balance_list = balance_rows(balances_as_of(parse_as_of(as_of)))
+        except ValueError as e:
+            abort(400, description=str(e))
+        return render_template('balance_report.html', balance_list=balance_list, as_of=as_of)
+
+    # Read the materialized ledger instead of replaying every movement
+    rows = db.session.query(
+        StockBalance.product_id,
+        Product.name,
+        StockBalance.location_id,
+        Location.name,
+        StockBalance.qty
+    ).outerjoin(Product, Product.product_id == StockBalance.product_id) \
+     .outerjoin(Location, Location.location_id == StockBalance.location_id) \
+     .filter(StockBalance.qty != 0) \
+     .order_by(StockBalance.product_id, StockBalance.location_id) \
+     .all()
+
     balance_list = []
-    products = Product.query.all()
-    locations = Location.query.all()
-    
-    product_dict = {p.product_id: p.name for p in products}
-    location_dict = {l.location_id: l.name for l in locations}
-    
-    for product_id, locations_data in balance_data.items():
-        for location_id, qty in locations_data.items():
-            if qty != 0:  # Only show non-zero balances
-                balance_list.append({
-                    'product_id': product_id,
-                    'product_name': product_dict.get(product_id, product_id),
-                    'location_id': location_id,
-                    'location_name': location_dict.get(location_id, location_id),
-                    'qty': qty
-                })
-    
-    return render_template('balance_report.html', balance_list=balance_list)
+    for product_id, product_name, location_id, location_name, qty in rows:
+        balance_list.append({
+            'product_id': product_id,
+            'product_name': product_name or product_id,
+            'location_id': location_id,
+            'location_name': location_name or location_id,
+            'qty': qty
+        })
+
+    return render_template('balance_report.html', balance_list=balance_list, as_of=None)
 
 # API Endpoints - Analytics
-@app.route('/api/metrics')
+@bp.route('/api/metrics')
+@cached_api
 def api_metrics():
     products_count = Product.query.count()
     locations_count = Location.query.count()
-    movements_count = ProductMovement.query.count()
+    movements_count = count_movements()
     return jsonify({
         'products': products_count,
         'locations': locations_count,
         'movements': movements_count
     })
 
-@app.route('/api/movements_trend')
+@bp.route('/api/movements_trend')
+@cached_api
 def api_movements_trend():
-    from datetime import timedelta
-    today = datetime.utcnow().date()
-    start_date = today - timedelta(days=6)  # last 7 days including today
-    # Initialize date map
-    date_map = { (start_date + timedelta(days=i)).isoformat(): 0 for i in range(7) }
-
-    movements = ProductMovement.query.filter(ProductMovement.timestamp >= datetime.combine(start_date, datetime.min.time())).all()
-    for m in movements:
-        d = m.timestamp.date().isoformat()
-        if d in date_map:
-            date_map[d] += 1
-    labels = sorted(date_map.keys())
-    data = [date_map[d] for d in labels]
-    return jsonify({'labels': labels, 'data': data})
+    # ?range=7d|90d|1y|48h (or start/end dates), granularity=day|hour, product_id, location_id,
+    # dimension=product|location with limit; defaults to the last 7 days by day
+    try:
+        granularity, start, end = trend_window_from_request(request.args)
+        dimension = request.args.get('dimension') or None
+        if dimension not in (None, 'product', 'location'):
+            raise ValueError(f'Invalid dimension: {dimension}')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    step = ROLLUP_GRANULARITIES[granularity]
+    buckets = [start + step * i for i in range((end - start) // step)]
+
+    def fill(rows):
+        totals = {_as_datetime(bucket): values for bucket, *values in rows}
+        columns = list(zip(*(totals.get(bucket, (0, 0, 0)) for bucket in buckets))) or [(), (), ()]
+        return {'data': [int(v or 0) for v in columns[0]], 'qty_in': [int(v or 0) for v in columns[1]],
+                'qty_out': [int(v or 0) for v in columns[2]]}
 
-@app.route('/api/top_products')
+    filters = {'product_id': request.args.get('product_id') or None,
+               'location_id': request.args.get('location_id') or None}
+    payload = {
+        'granularity': granularity,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'labels': [bucket.date().isoformat() if granularity == 'day' else bucket.isoformat(timespec='minutes')
+                   for bucket in buckets],
+        **fill(query_movement_trend(granularity, start, end, **filters))
+    }
+    if dimension:
+        limit = max(1, min(request.args.get('limit', TREND_SERIES_LIMIT, type=int), TREND_MAX_SERIES))
+        series = query_movement_trend(granularity, start, end, dimension=dimension, limit=limit, **filters)
+        payload['dimension'] = dimension
+        payload['series'] = [{'id': key, **fill(rows)} for key, rows in series.items()]
+    return jsonify(payload)
+
+@bp.route('/api/top_products')
+@cached_api
 def api_top_products():
-    # Aggregate quantity moved per product (absolute qty)
-    from sqlalchemy import func
-    rows = db.session.query(
-        ProductMovement.product_id,
-        func.sum(func.abs(ProductMovement.qty)).label('total_qty')
-    ).group_by(ProductMovement.product_id).order_by(func.sum(func.abs(ProductMovement.qty)).desc()).limit(5).all()
+    rows = query_top_products()
 
-    # Map IDs to names
-    product_names = {p.product_id: p.name for p in Product.query.all()}
+    # Map IDs to names, loading only the products in the top list
+    product_names = dict(db.session.query(Product.product_id, Product.name)
+                         .filter(Product.product_id.in_([pid for pid, _ in rows])).all())
     labels = [product_names.get(pid, pid) for pid, _ in rows]
     data = [int(total or 0) for _, total in rows]
     return jsonify({'labels': labels, 'data': data})
 
-@app.route('/api/recent_movements')
+@bp.route('/api/recent_movements')
+@cached_api
 def api_recent_movements():
-    recents = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).limit(10).all()
-    items = []
-    for m in recents:
-        items.append({
-            'movement_id': m.movement_id,
-            'timestamp': m.timestamp.isoformat(),
-            'product_id': m.product_id,
-            'from_location': m.from_location,
-            'to_location': m.to_location,
-            'qty': m.qty
-        })
+    recents, _ = query_movements_page({}, limit=10)
+    items = [movement_to_dict(m) for m in recents]
     return jsonify({'items': items})
 
+@bp.route('/api/movements')
+def api_movements():
+    try:
+        filters = movement_filters_from_request(request.args)
+        movements, next_cursor = query_movements_page(filters, request.args.get('cursor'),
+                                                      page_size_from_request(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'items': [movement_to_dict(m) for m in movements],
+        'next_cursor': next_cursor
+    })
+
+# Export Routes
+@bp.route('/export/movements.<fmt>')
+def export_movements(fmt):
+    try:
+        filters = movement_filters_from_request(request.args)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return streaming_export('movements', fmt, MOVEMENT_EXPORT_COLUMNS, movement_export_rows(filters))
+
+@bp.route('/export/balances.<fmt>')
+def export_balances(fmt):
+    as_of = request.args.get('as_of')
+    try:
+        at = parse_as_of(as_of) if as_of else None
+    except ValueError as e:
+        abort(400, description=str(e))
+    return streaming_export('balances', fmt, BALANCE_EXPORT_COLUMNS, balance_export_rows(at))
+
+@bp.route('/api/balances')
+def api_balances():
+    as_of = request.args.get('as_of')
+    try:
+        at = parse_as_of(as_of) if as_of else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if at is None:
+        balances = {(b.product_id, b.location_id): b.qty
+                    for b in StockBalance.query.filter(StockBalance.qty != 0)}
+    else:
+        balances = balances_as_of(at)
+    return jsonify({'as_of': at.isoformat() if at else None, 'items': balance_rows(balances)})
+
+@bp.route('/api/search/<kind>')
+def api_search(kind):
+    model = SEARCHABLE_MODELS.get(kind)
+    if model is None:
+        abort(404)
+    limit = max(1, min(request.args.get('limit', SEARCH_RESULTS_LIMIT, type=int), SEARCH_MAX_RESULTS_LIMIT))
+    results = search_catalogue(model, request.args.get('q', ''), limit)
+    return jsonify({'results': [{'id': item_id, 'name': name} for item_id, name in results]})
+
+def _movement_created_response(movement, deltas):
+    response = jsonify({
+        'movement': movement_to_dict(movement),
+        'balance_deltas': [
+            {'product_id': product_id, 'location_id': location_id, 'delta': delta}
+            for (product_id, location_id), delta in sorted(deltas.items()) if delta
+        ]
+    })
+    response.status_code = 201
+    return response
+
+@bp.route('/api/movements', methods=['POST'])
+def api_create_movement():
+    try:
+        key = idempotency_key_from_request()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if key:
+        fingerprint = request_fingerprint()
+        stored = find_idempotency_record(key)
+        if stored is not None:
+            return idempotent_replay(stored, fingerprint)
+    record = request.get_json(silent=True)
+    if not isinstance(record, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    product_ids = {record.get('product_id')} if db.session.get(Product, record.get('product_id') or '') else set()
+    location_ids = {location_id for location_id in (record.get('from_location'), record.get('to_location'))
+                    if location_id and db.session.get(Location, location_id)}
+
+    def remember(movement, deltas):
+        stage_idempotency_record(key, fingerprint, _movement_created_response(movement, deltas))
+
+    try:
+        row = _validate_movement_record(record, product_ids, location_ids)
+        movement, deltas = create_movement(row, before_commit=remember if key else None)
+    except InsufficientStockError as e:
+        return jsonify({'error': str(e)}), 409
+    except IntegrityError:
+        # Either the movement ID is taken or a concurrent retry stored this key first
+        stored = find_idempotency_record(key) if key else None
+        if stored is not None:
+            return idempotent_replay(stored, fingerprint)
+        return jsonify({'error': f"Duplicate movement_id: {row['movement_id']}"}), 409
+    except ArchivedMovementIdError as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _movement_created_response(movement, deltas)
+
+def _claim_bulk_idempotency_key(key, fingerprint):
+    # (record, None) to go ahead with the import, or (None, response) to return instead
+    stored = find_idempotency_record(key)
+    if stored is None:
+        stage_idempotency_record(key, fingerprint)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        stored = find_idempotency_record(key)
+    # An unfinished import under the key is rerun; its derived IDs stop rows landing twice
+    replay = idempotent_replay(stored, fingerprint)
+    return (stored, None) if replay is None else (None, replay)
+
+@bp.route('/api/movements/bulk', methods=['POST'])
+def api_bulk_movements():
+    # Accepts a JSON array (or {"movements": [...]}) or NDJSON, one movement per line
+    try:
+        key = idempotency_key_from_request()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # With a key the body is read up front to fingerprint it
+        records = _parse_ndjson(io.BytesIO(request.get_data()) if key else request.stream)
+    else:
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get('movements')
+        if not isinstance(payload, list):
+            return jsonify({'error': 'Expected a JSON array of movements or NDJSON'}), 400
+        records = payload
+    movement_ids = None
+    if key:
+        stored, replay = _claim_bulk_idempotency_key(key, request_fingerprint())
+        if replay is not None:
+            return replay
+        started = (stored.created_at - datetime(1970, 1, 1)) // timedelta(milliseconds=1)
+        movement_ids = partial(derived_ulid, started, key)
+    inserted, errors = import_movements(records, movement_ids=movement_ids)
+    response = jsonify({'inserted': inserted, 'errors': errors})
+    if key:
+        # The first run to finish stores its outcome
+        IdempotencyKey.query.filter(IdempotencyKey.key == key, IdempotencyKey.response.is_(None)) \
+            .update({'status_code': response.status_code, 'response': response.get_data(as_text=True)})
+        db.session.commit()
+    return response
+
+# API Endpoints - Background jobs
+@bp.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object with "kind" and optional "params"'}), 400
+    try:
+        job = submit_job(payload.get('kind'), payload.get('params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'job': job_to_dict(job)}), 202, {'Location': url_for('.api_job', job_id=job.job_id)}
+
+@bp.route('/api/jobs')
+def api_jobs():
+    query = Job.query.order_by(Job.created_at.desc())
+    status = request.args.get('status')
+    if status:
+        if status not in JOB_STATUSES:
+            return jsonify({'error': f'Invalid status: {status}'}), 400
+        query = query.filter(Job.status == status)
+    return jsonify({'items': [job_to_dict(job) for job in query.limit(page_size_from_request(request.args))]})
+
+@bp.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    return jsonify({'job': job_to_dict(Job.query.get_or_404(job_id))})
+
+@bp.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'succeeded':
+        return jsonify({'error': f'Job is {job.status}', 'job': job_to_dict(job)}), 409
+    result = json.loads(job.result)
+    if isinstance(result, dict) and result.get('file'):
+        return send_file(os.path.join(current_app.config['JOBS_DIR'], result['file']), as_attachment=True,
+                         mimetype=EXPORT_FORMATS[result['format']],
+                         download_name=f"{job.kind.replace('export_', '')}.{result['format']}")
+    return jsonify({'result': result})
+
+# CLI Commands
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and indexes; run once per deploy when workers start with INIT_DB=0."""
+    init_database()
+    click.echo('Database is ready.')
+
+@bp.cli.command('rebuild-balances')
+@click.option('--verify-only', is_flag=True, help='Report drift without rewriting the ledger.')
+def rebuild_balances_command(verify_only):
+    """Recompute the stock balance ledger from ProductMovement."""
+    drift = verify_stock_balances()
+    if drift:
+        click.echo(f'Found {len(drift)} drifted balance(s):')
+        for (product_id, location_id), (ledger_qty, expected_qty) in sorted(drift.items()):
+            click.echo(f'  {product_id} @ {location_id}: ledger={ledger_qty} expected={expected_qty}')
+    else:
+        click.echo('Stock balance ledger is consistent with movements.')
+    if not verify_only:
+        count = rebuild_stock_balances()
+        click.echo(f'Rebuilt {count} balance row(s).')
+
+@bp.cli.command('import-movements')
+@click.argument('csv_file', type=click.File('r'))
+@click.option('--chunk-size', default=BULK_IMPORT_CHUNK_SIZE, show_default=True, help='Rows per transaction.')
+def import_movements_command(csv_file, chunk_size):
+    """Bulk-load movements from a CSV file with a header row."""
+    started = time.perf_counter()
+    inserted, errors = import_movements(csv.DictReader(csv_file), chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    for error in errors:
+        click.echo(f"Row {error['row']}: {error['error']}", err=True)
+    click.echo(f'Imported {inserted} movement(s) with {len(errors)} error(s) '
+               f'in {elapsed:.2f}s ({inserted / elapsed if elapsed else 0:.0f} rows/sec).')
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Recreate the product and location typeahead index (SQLite FTS5)."""
+    if rebuild_search_index():
+        click.echo('Rebuilt the product and location search index.')
+    else:
+        click.echo('No search index on this database; search uses prefix LIKE queries.')
+
+@bp.cli.command('run-jobs')
+@click.option('--workers', default=None, type=int, help='Worker threads (default: JOB_WORKERS, at least 1).')
+def run_jobs_command(workers):
+    """Run background jobs in the foreground until interrupted."""
+    job_runner.workers = workers or max(current_app.config['JOB_WORKERS'], 1)
+    job_runner.start()
+    click.echo(f'Running jobs with {job_runner.workers} worker thread(s); Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        job_runner.stop()
+
+@bp.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Recompute the hourly and daily movement rollups from ProductMovement."""
+    started = time.perf_counter()
+    count = rebuild_movement_rollups()
+    click.echo(f'Wrote {count} rollup row(s) in {time.perf_counter() - started:.2f}s.')
+
+@bp.cli.command('analytics')
+@click.argument('report', type=click.Choice(['balances', 'top-products', 'turnover', 'flows']))
+@click.option('--start', default=None, help='ISO timestamp; only movements after it count.')
+@click.option('--end', default=None, help='ISO timestamp; only movements up to it count.')
+@click.option('--product', default=None, help='Restrict flows to one product ID.')
+@click.option('--limit', default=5, show_default=True, help='Rows for top-products.')
+@click.option('--output', type=click.File('w'), default='-', help='CSV destination (default: stdout).')
+def analytics_command(report, start, end, product, limit, output):
+    """Vectorized report over the full movement history, as CSV (requires NumPy)."""
+    import analytics  # NumPy is only loaded by this command
+    start = datetime.fromisoformat(start) if start else None
+    end = datetime.fromisoformat(end) if end else None
+    started = time.perf_counter()
+    columns = analytics.load_movement_columns(db.session, ProductMovement.__table__,
+                                              Product.__table__, Location.__table__,
+                                              extra_batches=archived_movement_batches())
+    loaded = time.perf_counter()
+    writer = csv.writer(output)
+    if report == 'balances':
+        writer.writerow(['product_id', 'location_id', 'qty'])
+        writer.writerows((product_id, location_id, qty) for (product_id, location_id), qty
+                         in sorted(analytics.balances(columns, start, end).items()) if qty)
+    elif report == 'top-products':
+        writer.writerow(['product_id', 'total_qty'])
+        writer.writerows(analytics.top_products(columns, limit))
+    elif report == 'turnover':
+        writer.writerow(['product_id', 'shipped', 'opening', 'closing', 'turnover'])
+        writer.writerows([row['product_id'], row['shipped'], row['opening'], row['closing'], f"{row['turnover']:.4f}"]
+                         for row in analytics.turnover(columns, start, end))
+    else:
+        location_ids, transfers, received, shipped = analytics.flow_matrix(columns, start, end, product)
+        # '' stands for outside the business
+        writer.writerow(['from_location', 'to_location', 'qty'])
+        for i, j in zip(*transfers.nonzero()):
+            writer.writerow([location_ids[i], location_ids[j], transfers[i, j]])
+        writer.writerows(('', location_ids[i], received[i]) for i in received.nonzero()[0])
+        writer.writerows((location_ids[i], '', shipped[i]) for i in shipped.nonzero()[0])
+    click.echo(f'{len(columns)} movements loaded in {loaded - started:.2f}s, '
+               f'{report} computed in {time.perf_counter() - loaded:.2f}s.', err=True)
+
+@bp.cli.command('archive-movements')
+@click.option('--before', default=None,
+              help='Archive movements up to this ISO date/timestamp (default: older than ARCHIVE_RETENTION_DAYS).')
+@click.option('--vacuum', is_flag=True, help='VACUUM a SQLite database afterwards to give the space back.')
+def archive_movements_command(before, vacuum):
+    """Move old movements into compressed monthly archive files, keeping balances intact."""
+    started = time.perf_counter()
+    archived = archive_movements(parse_as_of(before) if before else None,
+                                 lambda fraction, message: click.echo(message))
+    cutoff = archive_cutoff()
+    # Reading the cutoff began a transaction (holding the write lock under SQLITE_TUNING); end it
+    # and hand the connection back, or VACUUM below would wait on it until busy_timeout
+    db.session.commit()
+    db.session.remove()
+    click.echo(f'Archived {sum(archived.values())} movement(s) into {len(archived)} partition(s) '
+               f'in {time.perf_counter() - started:.2f}s; archived through {cutoff}.')
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        # VACUUM cannot run inside a transaction, so bypass SQLAlchemy's BEGIN
+        connection = db.engine.raw_connection()
+        try:
+            connection.cursor().execute('VACUUM')
+        finally:
+            connection.close()
+        click.echo('Vacuumed the database.')
+
+@bp.cli.command('snapshot-balances')
+@click.option('--at', 'at', default=None, help='ISO timestamp to checkpoint (default: now, UTC).')
+def snapshot_balances_command(at):
+    """Write a point-in-time balance checkpoint; run this periodically (e.g. nightly from cron)."""
+    snapshot_time, count = create_balance_snapshot(datetime.fromisoformat(at) if at else None)
+    click.echo(f'Snapshot {snapshot_time.isoformat()}: {count} balance row(s).')
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
+    create_app().run(debug=True)
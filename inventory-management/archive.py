@@ -0,0 +1,108 @@
+import json
+import os
+import sys
+import zipfile
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+# Columnar movement archive files. Each partition (one calendar month) is a zip holding
+# meta.json plus one deflated member per column: movement IDs as JSON, product and location IDs
+# dictionary-encoded as int32 codes, timestamps as int64 microsecond deltas and quantities as
+# int64, all in (timestamp, movement_id) order. A file is never modified once written; adding
+# rows to a partition writes a new file.
+
+FORMAT_VERSION = 1
+FIELDS = ('movement_id', 'timestamp', 'product_id', 'from_location', 'to_location', 'qty')
+COLUMNS = {'product_id': 'i', 'from_location': 'i', 'to_location': 'i', 'timestamp': 'q', 'qty': 'q'}
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def partition_key(timestamp):
+    return timestamp.strftime('%Y-%m')
+
+def partition_bounds(key):
+    # [start, end) of a partition's month
+    start = datetime.strptime(key, '%Y-%m')
+    return start, datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def _pack(typecode, values):
+    data = array(typecode, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+def _unpack(typecode, raw):
+    data = array(typecode)
+    data.frombytes(raw)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+def write_partition(path, rows):
+    # rows are (movement_id, timestamp, product_id, from_location, to_location, qty) tuples.
+    # The file is written under a temporary name and renamed into place, so `path` never
+    # holds a partial archive. Returns the partition's metadata
+    rows = sorted(rows, key=lambda row: (row[1], row[0]))
+    movement_ids, timestamps, product_ids, from_locations, to_locations, quantities = \
+        (list(column) for column in zip(*rows)) if rows else ([],) * 6
+    products, locations = {}, {}
+    micros = [(timestamp - EPOCH) // MICROSECOND for timestamp in timestamps]
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': len(rows),
+        'first_timestamp': timestamps[0].isoformat() if rows else None,
+        'last_timestamp': timestamps[-1].isoformat() if rows else None,
+    }
+    members = {
+        'product_id': _pack('i', [products.setdefault(value, len(products)) for value in product_ids]),
+        'from_location': _pack('i', [locations.setdefault(value, len(locations)) for value in from_locations]),
+        'to_location': _pack('i', [locations.setdefault(value, len(locations)) for value in to_locations]),
+        'timestamp': _pack('q', [b - a for a, b in zip([0] + micros, micros)]),
+        'qty': _pack('q', quantities),
+    }
+    # None and '' both mean "no location" but are kept apart so rows round-trip exactly
+    meta['product_ids'] = list(products)
+    meta['location_ids'] = list(locations)
+
+    temporary = f'{path}.tmp'
+    with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED) as f:
+        f.writestr('meta.json', json.dumps(meta))
+        f.writestr('movement_id.json', json.dumps(movement_ids))
+        for name, raw in members.items():
+            f.writestr(name, raw)
+    with open(temporary, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return meta
+
+def read_meta(path):
+    with zipfile.ZipFile(path) as f:
+        return json.loads(f.read('meta.json'))
+
+def read_columns(path, names=FIELDS):
+    # {name: list of values} for the requested columns only; the others are never inflated
+    with zipfile.ZipFile(path) as f:
+        meta = json.loads(f.read('meta.json'))
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported archive format version {meta['version']}")
+        columns = {}
+        for name in names:
+            if name == 'movement_id':
+                columns[name] = json.loads(f.read('movement_id.json'))
+                continue
+            values = _unpack(COLUMNS[name], f.read(name))
+            if name == 'timestamp':
+                columns[name] = [EPOCH + micros * MICROSECOND for micros in accumulate(values)]
+            elif name == 'product_id':
+                columns[name] = list(map(meta['product_ids'].__getitem__, values))
+            elif name in ('from_location', 'to_location'):
+                columns[name] = list(map(meta['location_ids'].__getitem__, values))
+            else:
+                columns[name] = values.tolist()
+    return columns
+
+def read_partition(path):
+    # Every row as a (movement_id, timestamp, product_id, from_location, to_location, qty) tuple
+    columns = read_columns(path)
+    return list(zip(*(columns[name] for name in FIELDS)))
@@ -0,0 +1,803 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+# Point the app at a throwaway database before it is imported
+_tmpdir = tempfile.mkdtemp(prefix='inventory-bench-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+# Background job workers would only add queue polling to the measurements
+os.environ.setdefault('JOB_WORKERS', '0')
+os.environ.setdefault('ARCHIVE_DIR', os.path.join(_tmpdir, 'archive'))
+
+from sqlalchemy import func
+from app import (archive_movements, balances_as_of, compute_balances_from_movements, create_app, import_movements,
+                 prepare_for_fork, query_movements_page, query_top_products, rebuild_stock_balances,
+                 search_catalogue, verify_stock_balances)
+from ids import new_ulid
+from models import db, Product, Location, ProductMovement, StockBalance
+
+app = create_app()
+
+def reset_database(num_products, num_locations):
+    db.drop_all()
+    db.create_all()
+    db.session.add_all(Product(product_id=f'P{i:06d}', name=f'Product {i}') for i in range(num_products))
+    db.session.add_all(Location(location_id=f'L{i:04d}', name=f'Location {i}') for i in range(num_locations))
+    db.session.commit()
+
+def generate_movement_records(count, num_products, num_locations, prefix='M'):
+    # A mix of stock-ins, stock-outs and transfers with no stock behind the outgoing ones; load
+    # them through the write paths with ALLOW_NEGATIVE_STOCK (see without_stock_checks)
+    for i in range(count):
+        product_id = f'P{i % num_products:06d}'
+        from_location = f'L{i % num_locations:04d}' if i % 3 else ''
+        to_location = f'L{(i + 1) % num_locations:04d}' if i % 3 != 1 else ''
+        yield {
+            'movement_id': f'{prefix}{i:09d}',
+            'product_id': product_id,
+            'from_location': from_location,
+            'to_location': to_location,
+            'qty': 1 + i % 17
+        }
+
+@contextmanager
+def without_stock_checks():
+    # The ingest and export benchmarks measure write and read throughput, not stock rules:
+    # with enforcement on, most generated stock-outs and transfers would be rejected
+    previous = app.config['ALLOW_NEGATIVE_STOCK']
+    app.config['ALLOW_NEGATIVE_STOCK'] = True
+    try:
+        yield
+    finally:
+        app.config['ALLOW_NEGATIVE_STOCK'] = previous
+
+def bench_ingest(args):
+    results = {}
+    with app.app_context(), without_stock_checks():
+        reset_database(args.products, args.locations)
+        client = app.test_client()
+        records = list(generate_movement_records(args.per_row, args.products, args.locations, prefix='R'))
+        inserted = 0
+        started = time.perf_counter()
+        for record in records:
+            # add_movement redirects on success and re-renders the form with an error otherwise
+            if client.post('/movements/add', data=record).status_code == 302:
+                inserted += 1
+        elapsed = time.perf_counter() - started
+        results['per_row_form_post'] = inserted / elapsed
+        if inserted < len(records):
+            print(f'warning: {len(records) - inserted} of {len(records)} form post(s) were rejected')
+
+        # The posts share this app context's session; end its last transaction before dropping tables
+        db.session.remove()
+        reset_database(args.products, args.locations)
+        started = time.perf_counter()
+        inserted, errors = import_movements(
+            generate_movement_records(args.movements, args.products, args.locations),
+            chunk_size=args.chunk_size
+        )
+        elapsed = time.perf_counter() - started
+        results['bulk_import'] = inserted / elapsed
+        if errors:
+            print(f'warning: {len(errors)} bulk row error(s), first: {errors[0]}')
+
+    for name, rows_per_sec in results.items():
+        print(f'{name:>20}: {rows_per_sec:10.0f} rows/sec')
+    print(f"{'speedup':>20}: {results['bulk_import'] / results['per_row_form_post']:10.1f}x")
+
+def bench_export_memory(args):
+    # Peak Python heap while streaming /export/movements.csv should not grow with row count
+    with app.app_context(), without_stock_checks():
+        reset_database(args.products, args.locations)
+        client = app.test_client()
+        loaded = 0
+        for count in args.sizes:
+            inserted, errors = import_movements(
+                generate_movement_records(count - loaded, args.products, args.locations, prefix=f'E{count}-'),
+                chunk_size=5000
+            )
+            loaded += inserted
+            if errors:
+                print(f'warning: {len(errors)} row error(s), first: {errors[0]}')
+            db.session.remove()
+            tracemalloc.start()
+            response = client.get('/export/movements.csv', buffered=False)
+            size = rows = 0
+            for chunk in response.response:
+                size += len(chunk)
+                rows += chunk.count(b'\n' if isinstance(chunk, bytes) else '\n')
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            # Less the header line
+            print(f'{rows - 1:>10} rows: {size / 1e6:8.1f} MB exported, peak heap {peak / 1024:8.0f} KB')
+
+def _concurrency_setup(products, locations):
+    with app.app_context():
+        reset_database(products, locations)
+        db.session.add_all(
+            ProductMovement(movement_id=f'SEED{i:06d}', to_location=f'L{i % locations:04d}',
+                            product_id=f'P{i:06d}', qty=1000)
+            for i in range(products)
+        )
+        db.session.commit()
+
+def _concurrency_writer(run, worker, seconds, products, locations):
+    client = app.test_client()
+    ok = failed = 0
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        response = client.post('/movements/add', data={
+            'movement_id': f'W{run}-{worker:03d}-{i:08d}',
+            'product_id': f'P{i % products:06d}',
+            'from_location': f'L{i % locations:04d}',
+            'to_location': f'L{(i + 1) % locations:04d}',
+            'qty': 1
+        })
+        # add_movement redirects on success and re-renders the form with an error otherwise
+        if response.status_code == 302:
+            ok += 1
+        else:
+            failed += 1
+        i += 1
+    return ok, failed
+
+def bench_concurrency(args):
+    context = multiprocessing.get_context('spawn')
+    for label, tuning in (('default pragmas', '0'), ('WAL + busy_timeout', '1')):
+        # WAL is persistent in the database file, so each configuration gets a fresh file
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmpdir, f'concurrency-{tuning}.db')}"
+        os.environ['SQLITE_TUNING'] = tuning
+        with context.Pool(1) as pool:
+            pool.apply(_concurrency_setup, (args.products, args.locations))
+        for writers in args.writers:
+            with context.Pool(writers) as pool:
+                results = pool.starmap(_concurrency_writer, [
+                    (writers, worker, args.seconds, args.products, args.locations) for worker in range(writers)
+                ])
+            ok = sum(r[0] for r in results)
+            failed = sum(r[1] for r in results)
+            print(f'{label:>20} | {writers:>2} writer(s): {ok / args.seconds:8.0f} commits/sec, '
+                  f'{failed} failed')
+
+def bench_contention(args):
+    # Many threads racing transfers over a handful of hot balances: no balance may ever go
+    # negative, the ledger must match the movement history and total stock must be conserved
+    with app.app_context():
+        reset_database(args.products, args.locations)
+        db.session.add_all(
+            ProductMovement(movement_id=f'SEED-{p}-{l}', to_location=f'L{l:04d}', product_id=f'P{p:06d}',
+                            qty=args.initial_stock)
+            for p in range(args.products) for l in range(args.locations)
+        )
+        db.session.commit()
+        rebuild_stock_balances()
+
+    counter = iter(range(args.transfers))
+    counter_lock = threading.Lock()
+    outcomes = {'created': 0, 'rejected': 0, 'failed': 0}
+    outcomes_lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            source, target = rng.sample(range(args.locations), 2)
+            response = client.post('/api/movements', json={
+                'movement_id': f'T{i:08d}',
+                'product_id': f'P{rng.randrange(args.products):06d}',
+                'from_location': f'L{source:04d}',
+                'to_location': f'L{target:04d}' if rng.random() < 0.95 else None,
+                'qty': rng.randint(1, args.max_qty)
+            })
+            outcome = {201: 'created', 409: 'rejected'}.get(response.status_code, 'failed')
+            with outcomes_lock:
+                outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        negative = StockBalance.query.filter(StockBalance.qty < 0).count()
+        drift = verify_stock_balances()
+        on_hand = db.session.query(func.sum(StockBalance.qty)).scalar()
+        stocked_in = args.products * args.locations * args.initial_stock
+        sold = db.session.query(func.coalesce(func.sum(ProductMovement.qty), 0)) \
+            .filter(ProductMovement.to_location.is_(None)).scalar()
+    print(f"{args.transfers} transfers on {args.threads} threads in {elapsed:.1f}s "
+          f"({args.transfers / elapsed:.0f}/sec): {outcomes}")
+    print(f'negative balances: {negative}, ledger drift: {len(drift)}, '
+          f'on hand {on_hand} == stocked {stocked_in} - sold {sold}: {on_hand == stocked_in - sold}')
+    if negative or drift or on_hand != stocked_in - sold or outcomes['failed']:
+        sys.exit(1)
+
+def benchmark_endpoints():
+    # /balance, /movements, the catalogue pages, /showcase and every argument-free GET /api/* route except the
+    # never-ending event stream
+    endpoints = ['/balance', '/movements', '/products', '/locations', '/showcase']
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if rule.rule.startswith('/api/stream/'):
+            continue
+        if rule.rule.startswith('/api/') and 'GET' in rule.methods and not rule.arguments:
+            endpoints.append(rule.rule)
+    return endpoints
+
+def summarize_latencies(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))] * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(50), 3),
+        'p90_ms': round(percentile(90), 3),
+        'p99_ms': round(percentile(99), 3),
+        'max_ms': round(latencies[-1] * 1000, 3)
+    }
+
+def run_test_client(endpoints, requests_per_endpoint, warmup, headers):
+    client = app.test_client()
+    results = {}
+    for endpoint in endpoints:
+        for _ in range(warmup):
+            client.get(endpoint, headers=headers)
+        latencies = []
+        errors = 0
+        sent = 0
+        started = time.perf_counter()
+        for _ in range(requests_per_endpoint):
+            request_started = time.perf_counter()
+            response = client.get(endpoint, headers=headers)
+            latencies.append(time.perf_counter() - request_started)
+            errors += response.status_code >= 400
+            sent += len(response.data)
+        results[endpoint] = summarize_latencies(latencies, time.perf_counter() - started, errors)
+        results[endpoint]['mean_bytes'] = sent // max(requests_per_endpoint, 1)
+        print(f"  test-client {endpoint:<28} p50 {results[endpoint]['p50_ms']:9.2f} ms  "
+              f"p99 {results[endpoint]['p99_ms']:9.2f} ms  {results[endpoint]['throughput_rps']:8.1f} req/s  "
+              f"{results[endpoint]['mean_bytes']:9d} B")
+    return results
+
+def _serve(listener, ready=None):
+    # Prefork worker: every process accepts on the same inherited listening socket
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with app.app_context():
+        # Pooled connections inherited across fork must not be shared with the parent
+        db.engine.dispose(close=False)
+    host, port = listener.getsockname()
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    if ready is not None:
+        ready.send(True)
+    server.serve_forever()
+
+def _wait_for_server(base_url, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/metrics', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server at {base_url} did not start')
+
+def _timed_get(url, headers=None):
+    started = time.perf_counter()
+    size = 0
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=120) as response:
+            size = len(response.read())
+        failed = False
+    except OSError:
+        failed = True
+    return time.perf_counter() - started, failed, size
+
+def run_server(endpoints, requests_per_endpoint, warmup, workers, concurrency, headers):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    base_url = f'http://127.0.0.1:{listener.getsockname()[1]}'
+    context = multiprocessing.get_context('fork')
+    servers = [context.Process(target=_serve, args=(listener,), daemon=True) for _ in range(workers)]
+    for server in servers:
+        server.start()
+    results = {}
+    try:
+        _wait_for_server(base_url)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for endpoint in endpoints:
+                get = partial(_timed_get, headers=headers)
+                list(pool.map(get, [base_url + endpoint] * warmup))
+                started = time.perf_counter()
+                timings = list(pool.map(get, [base_url + endpoint] * requests_per_endpoint))
+                elapsed = time.perf_counter() - started
+                results[endpoint] = summarize_latencies([t for t, _, _ in timings], elapsed,
+                                                        sum(failed for _, failed, _ in timings))
+                results[endpoint]['mean_bytes'] = sum(size for _, _, size in timings) // max(len(timings), 1)
+                print(f"  server      {endpoint:<28} p50 {results[endpoint]['p50_ms']:9.2f} ms  "
+                      f"p99 {results[endpoint]['p99_ms']:9.2f} ms  {results[endpoint]['throughput_rps']:8.1f} req/s  "
+                      f"{results[endpoint]['mean_bytes']:9d} B")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+        listener.close()
+    return results
+
+def bench_http(args):
+    import sample_data
+    started = time.perf_counter()
+    sample_data.create_scaled_data(args.products, args.locations, args.movements, app=app)
+    load_seconds = time.perf_counter() - started
+
+    endpoints = args.endpoints or benchmark_endpoints()
+    report = {
+        'benchmark': 'http',
+        'started_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'database_url': app.config['SQLALCHEMY_DATABASE_URI'],
+        'dataset': {
+            'products': args.products,
+            'locations': args.locations,
+            'movements': args.movements,
+            'load_seconds': round(load_seconds, 2)
+        },
+        'settings': {
+            'requests_per_endpoint': args.requests,
+            'warmup': args.warmup,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'accept_encoding': args.accept_encoding
+        }
+    }
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    with app.app_context():
+        report['test_client'] = run_test_client(endpoints, args.requests, args.warmup, headers)
+    if args.workers:
+        report['server'] = run_server(endpoints, args.requests, args.warmup, args.workers, args.concurrency,
+                                      headers)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f'Results written to {args.output}')
+    else:
+        print(output)
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def _python_loop_balances():
+    # The per-object approach the analytics module replaces
+    balances = {}
+    for movement in ProductMovement.query.yield_per(10000):
+        if movement.to_location:
+            key = (movement.product_id, movement.to_location)
+            balances[key] = balances.get(key, 0) + movement.qty
+        if movement.from_location:
+            key = (movement.product_id, movement.from_location)
+            balances[key] = balances.get(key, 0) - movement.qty
+    return balances
+
+def bench_analytics(args):
+    # SQL aggregation and a per-object Python loop vs the NumPy analytics module; the
+    # vectorized results must match the SQL ones exactly
+    import analytics
+    failures = 0
+    with app.app_context():
+        reset_database(args.products, args.locations)
+        loaded = 0
+        start_time = datetime(2024, 1, 1)
+        for size in args.sizes:
+            started = time.perf_counter()
+            for records in _batched(generate_movement_records(size - loaded, args.products, args.locations,
+                                                              prefix=f'A{size}-'), 50000):
+                for offset, record in enumerate(records):
+                    record['timestamp'] = start_time + timedelta(seconds=(loaded + offset) * 3)
+                    record['from_location'] = record['from_location'] or None
+                    record['to_location'] = record['to_location'] or None
+                db.session.execute(ProductMovement.__table__.insert(), records)
+                loaded += len(records)
+            db.session.commit()
+            print(f'{size} movements ({time.perf_counter() - started:.1f}s to load)')
+
+            sql_balances, sql_balance_time = _timed(compute_balances_from_movements)
+            sql_top, sql_top_time = _timed(query_top_products, 10)
+            columns, load_time = _timed(analytics.load_movement_columns, db.session, ProductMovement.__table__,
+                                        Product.__table__, Location.__table__)
+            np_balances, np_balance_time = _timed(analytics.balances, columns)
+            np_top, np_top_time = _timed(analytics.top_products, columns, 10)
+            _, turnover_time = _timed(analytics.turnover, columns, start_time + timedelta(days=30))
+            _, flow_time = _timed(analytics.flow_matrix, columns)
+            rows = [('balances (SQL GROUP BY)', sql_balance_time), ('top products (SQL)', sql_top_time),
+                    ('load columns', load_time), ('balances (NumPy)', np_balance_time),
+                    ('top products (NumPy)', np_top_time), ('turnover (NumPy)', turnover_time),
+                    ('flow matrix (NumPy)', flow_time)]
+            if size <= args.loop_max:
+                rows.insert(0, ('balances (Python loop)', _timed(_python_loop_balances)[1]))
+            for label, seconds in rows:
+                print(f'  {label:<24} {seconds * 1000:10.1f} ms')
+            identical = np_balances == sql_balances and np_top == [tuple(row) for row in sql_top]
+            print(f'  results identical to SQL: {identical}')
+            failures += not identical
+    if failures:
+        sys.exit(1)
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _database_bytes():
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    if not url.startswith('sqlite:///'):
+        return None
+    path = url[len('sqlite:///'):]
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+def _archive_workload(as_of):
+    # The reads whose cost grows with the movement table, timed against the current state
+    timings = {
+        'verify ledger': _timed(verify_stock_balances)[1],
+        'balances as of 7 days ago': _timed(balances_as_of, as_of)[1],
+        'first listing page': _timed(query_movements_page, {})[1],
+        'top products': _timed(query_top_products, 10)[1],
+    }
+    return timings, {key: qty for key, qty in balances_as_of(as_of).items() if qty}
+
+def bench_archive(args):
+    # Table size, file size and read timings before and after archiving everything older than
+    # --retention-days; balances must come out the same
+    import sample_data
+    sample_data.create_scaled_data(args.products, args.locations, args.movements, days=args.days, app=app)
+    with app.app_context():
+        as_of = datetime.utcnow() - timedelta(days=7)
+        expected = {key: qty for key, qty in compute_balances_from_movements().items() if qty}
+        hot_before, bytes_before = ProductMovement.query.count(), _database_bytes()
+        before, as_of_before = _archive_workload(as_of)
+        db.session.commit()
+
+        started = time.perf_counter()
+        archived = archive_movements(datetime.utcnow() - timedelta(days=args.retention_days))
+        archive_seconds = time.perf_counter() - started
+        if bytes_before is not None:
+            raw = db.engine.raw_connection()
+            try:
+                raw.cursor().execute('VACUUM')
+                raw.cursor().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                raw.close()
+        after, as_of_after = _archive_workload(as_of)
+        archive_bytes = sum(os.path.getsize(os.path.join(app.config['ARCHIVE_DIR'], name))
+                            for name in os.listdir(app.config['ARCHIVE_DIR']))
+        balanced = not verify_stock_balances() and as_of_after == as_of_before \
+            and {key: qty for key, qty in compute_balances_from_movements().items() if qty} == expected
+
+    print(f'Archived {sum(archived.values())} movements into {len(archived)} partitions in {archive_seconds:.1f}s')
+    print(f'  hot table: {hot_before} -> {hot_before - sum(archived.values())} rows')
+    if bytes_before is not None:
+        print(f'  database:  {bytes_before / 1e6:.1f} MB -> {_database_bytes() / 1e6:.1f} MB, '
+              f'archive files {archive_bytes / 1e6:.1f} MB')
+    for label in before:
+        print(f'  {label:<28} {before[label] * 1000:9.1f} ms -> {after[label] * 1000:9.1f} ms')
+    print(f'  balances unchanged: {balanced}')
+    if not balanced:
+        sys.exit(1)
+
+# A worker started from scratch, as a server without --preload does: imports the app, builds it
+# and serves on the listening socket it was handed
+_FRESH_WORKER = """
+import logging, sys
+from werkzeug.serving import make_server
+from app import create_app
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+fd, host, port = int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+server = make_server(host, port, create_app({'INIT_DB': False}), threaded=True, fd=fd)
+print('ready', flush=True)
+server.serve_forever()
+"""
+
+_IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{build}
+print(imported - started, time.perf_counter() - imported, 'numpy' in sys.modules,
+      'sqlalchemy.dialects.postgresql' in sys.modules)
+"""
+
+def _memory_kb(pid):
+    # (Rss, Pss, private) of a process in KB from Linux's smaps_rollup; Pss splits pages shared
+    # with other processes evenly between them, private counts only the process's own pages
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+def _boot_workers(mode, listener, workers):
+    # Starts the workers one at a time; returns (pids, per-worker seconds until ready, stop)
+    here = os.path.dirname(os.path.abspath(__file__))
+    host, port = listener.getsockname()
+    pids, boot_seconds, processes = [], [], []
+    context = multiprocessing.get_context('fork')
+    for _ in range(workers):
+        started = time.perf_counter()
+        if mode == 'fresh':
+            process = subprocess.Popen([sys.executable, '-c', _FRESH_WORKER, str(listener.fileno()), host, str(port)],
+                                       pass_fds=(listener.fileno(),), stdout=subprocess.PIPE, cwd=here, text=True)
+            process.stdout.readline()
+        else:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_serve, args=(listener, sender), daemon=True)
+            process.start()
+            receiver.recv()
+        boot_seconds.append(time.perf_counter() - started)
+        pids.append(process.pid)
+        processes.append(process)
+
+    def stop():
+        for process in processes:
+            process.terminate()
+            if mode == 'fresh':
+                process.wait()
+            else:
+                process.join()
+    return pids, boot_seconds, stop
+
+def bench_startup(args):
+    # Import cost of the models module, the app module and the app factory in fresh
+    # interpreters, then boot time and per-worker memory of --workers server processes started
+    # from scratch, forked from a loaded app, and forked after prepare_for_fork()
+    here = os.path.dirname(os.path.abspath(__file__))
+    # The dataset is built in a child process so its garbage does not end up in forked workers
+    subprocess.run([sys.executable, '-c', 'import sys, sample_data; sample_data.create_scaled_data(*map(int, sys.argv[1:]))',
+                    str(args.products), str(args.locations), str(args.movements)], cwd=here, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    print(f'Import cost, median of {args.rounds} fresh interpreters:')
+    for label, module, build in (('import models', 'models', ''), ('import app', 'app', ''),
+                                 ("create_app()", 'app', "app.create_app({'INIT_DB': False})")):
+        runs = []
+        for _ in range(args.rounds):
+            output = subprocess.run([sys.executable, '-c', _IMPORT_PROBE.format(module=module, build=build)],
+                                    cwd=here, check=True, capture_output=True, text=True).stdout.split()
+            runs.append((float(output[0]) + float(output[1]), output[2] == 'True', output[3] == 'True'))
+        seconds = statistics.median(run[0] for run in runs)
+        print(f'  {label:<16} {seconds * 1000:8.1f} ms   numpy loaded: {runs[0][1]}   '
+              f'postgresql dialect loaded: {runs[0][2]}')
+
+    endpoints = benchmark_endpoints()
+    print(f'{args.workers} workers, each endpoint requested {args.requests} times before measuring:')
+    for mode in ('fresh', 'fork', 'preload'):
+        if mode == 'preload':
+            # Last, since gc.freeze() in prepare_for_fork() lasts for the rest of this process
+            prepare_for_fork(app)
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(128)
+        base_url = f'http://127.0.0.1:{listener.getsockname()[1]}'
+        pids, boot_seconds, stop = _boot_workers(mode, listener, args.workers)
+        try:
+            with ThreadPoolExecutor(max_workers=args.workers * 2) as pool:
+                for endpoint in endpoints:
+                    list(pool.map(_timed_get, [base_url + endpoint] * args.requests))
+            memory = [_memory_kb(pid) for pid in pids]
+        finally:
+            stop()
+            listener.close()
+        rss, pss, private = (sum(values) / len(values) / 1024 for values in zip(*memory))
+        print(f'  {mode:<8} boot {statistics.mean(boot_seconds) * 1000:8.1f} ms/worker   '
+              f'RSS {rss:6.1f} MB   PSS {pss:6.1f} MB   private {private:6.1f} MB per worker   '
+              f'PSS total {sum(p for _, p, _ in memory) / 1024:6.1f} MB')
+
+def bench_ids(args):
+    # Insert rate with random (uuid4) vs time-ordered movement IDs as the table grows, then the
+    # cost of a retried POST /api/movements: replayed from its Idempotency-Key vs failing on a
+    # duplicate movement_id
+    print(f'Inserting {args.movements} movements in batches of {args.batch_size}:')
+    for label, make_id in (('random uuid4', lambda: uuid.uuid4().hex), ('time-ordered', new_ulid)):
+        with app.app_context():
+            reset_database(args.products, args.locations)
+            timings = []
+            for batch in _batched(generate_movement_records(args.movements, args.products, args.locations),
+                                  args.batch_size):
+                for record in batch:
+                    record['movement_id'] = make_id()
+                started = time.perf_counter()
+                db.session.execute(ProductMovement.__table__.insert(), batch)
+                db.session.commit()
+                timings.append((len(batch), time.perf_counter() - started))
+        last = timings[-max(len(timings) // 10, 1):]
+        print(f'  {label:<14} {sum(n for n, _ in timings) / sum(t for _, t in timings):9.0f} rows/s overall  '
+              f'{sum(n for n, _ in last) / sum(t for _, t in last):9.0f} rows/s over the last 10%')
+
+    print(f'Retrying one movement {args.retries} times:')
+    with app.app_context():
+        reset_database(args.products, args.locations)
+    # Requests outside an app context of ours, so each gets its own SQL statement count
+    client = app.test_client()
+    record = {'product_id': 'P000000', 'to_location': 'L0000', 'qty': 1}
+    headers = {'Idempotency-Key': 'bench-retry'}
+    created = client.post('/api/movements', json=record, headers=headers).get_json()['movement']
+    duplicate = dict(record, movement_id=created['movement_id'])
+    for label, kwargs, expected in (('Idempotency-Key replay', {'json': record, 'headers': headers}, 201),
+                                    ('duplicate movement_id', {'json': duplicate}, 409)):
+        timings = []
+        for _ in range(args.retries):
+            started = time.perf_counter()
+            response = client.post('/api/movements', **kwargs)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != expected:
+                sys.exit(f'{label}: expected {expected}, got {response.status_code}')
+        print(f'  {label:<24} mean {statistics.mean(timings) * 1000:7.2f} ms  '
+              f'p99 {sorted(timings)[int(len(timings) * 0.99) - 1] * 1000:7.2f} ms  '
+              f"{response.headers['X-SQL-Query-Count']} SQL statements")
+
+SEARCH_WORDS = ['steel', 'bolt', 'wireless', 'mouse', 'laptop', 'cable', 'filter', 'valve', 'pump', 'sensor',
+                'bracket', 'panel', 'switch', 'adapter', 'battery', 'charger', 'monitor', 'hinge', 'gasket', 'drill']
+
+def bench_search(args):
+    # Typeahead lookups against a catalogue of --products entries with word-salad names
+    rng = random.Random(42)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        for offset in range(0, args.products, 10000):
+            db.session.execute(Product.__table__.insert(), [
+                {'product_id': f'SKU{i:08d}', 'name': ' '.join(rng.sample(SEARCH_WORDS, 3)) + f' {i % 1000}'}
+                for i in range(offset, min(offset + 10000, args.products))
+            ])
+        db.session.commit()
+        print(f'Loaded {args.products} products in {time.perf_counter() - started:.1f}s')
+
+        queries = [word[:length] for word in SEARCH_WORDS for length in (2, 4, len(word))]
+        queries += [f'SKU{rng.randrange(args.products):08d}'[:length] for length in range(4, 12)]
+        queries += [f'{rng.choice(SEARCH_WORDS)} {rng.choice(SEARCH_WORDS)[:3]}' for _ in range(20)]
+        for q in queries[:10]:
+            search_catalogue(Product, q)
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for q in queries:
+                lookup_started = time.perf_counter()
+                search_catalogue(Product, q)
+                latencies.append(time.perf_counter() - lookup_started)
+        summary = summarize_latencies(latencies, time.perf_counter() - started, 0)
+    print(f"{summary['requests']} lookups ({len(queries)} distinct queries): p50 {summary['p50_ms']:.2f} ms  "
+          f"p99 {summary['p99_ms']:.2f} ms  max {summary['max_ms']:.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Inventory management benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help='Per-row form posts vs bulk movement import')
+    ingest.add_argument('--products', type=int, default=1000)
+    ingest.add_argument('--locations', type=int, default=50)
+    ingest.add_argument('--movements', type=int, default=100000, help='Rows for the bulk import')
+    ingest.add_argument('--per-row', type=int, default=2000, help='Rows for the per-row form path')
+    ingest.add_argument('--chunk-size', type=int, default=1000)
+    ingest.set_defaults(func=bench_ingest)
+
+    export = subparsers.add_parser('export-memory', help='Peak memory of the streaming movement export')
+    export.add_argument('--products', type=int, default=1000)
+    export.add_argument('--locations', type=int, default=50)
+    export.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    export.set_defaults(func=bench_export_memory)
+
+    concurrency = subparsers.add_parser('concurrency', help='Write throughput with N parallel writer processes')
+    concurrency.add_argument('--products', type=int, default=200)
+    concurrency.add_argument('--locations', type=int, default=20)
+    concurrency.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8])
+    concurrency.add_argument('--seconds', type=float, default=5.0)
+    concurrency.set_defaults(func=bench_concurrency)
+
+    http = subparsers.add_parser('http', help='Latency percentiles and throughput for the routes and APIs')
+    http.add_argument('--products', type=int, default=1000)
+    http.add_argument('--locations', type=int, default=50)
+    http.add_argument('--movements', type=int, default=100000)
+    http.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint')
+    http.add_argument('--warmup', type=int, default=3)
+    http.add_argument('--workers', type=int, default=4, help='Server processes; 0 skips the server run')
+    http.add_argument('--concurrency', type=int, default=8, help='Client threads against the server')
+    http.add_argument('--endpoints', nargs='+', help='Override the endpoint list')
+    http.add_argument('--accept-encoding', default='gzip, br',
+                      help="Accept-Encoding sent with every request; '' measures uncompressed responses")
+    http.add_argument('--output', help='Write the JSON report here instead of stdout')
+    http.set_defaults(func=bench_http)
+
+    contention = subparsers.add_parser('contention', help='Concurrent transfers must never overdraw stock')
+    contention.add_argument('--products', type=int, default=2)
+    contention.add_argument('--locations', type=int, default=3)
+    contention.add_argument('--initial-stock', type=int, default=100)
+    contention.add_argument('--transfers', type=int, default=5000)
+    contention.add_argument('--threads', type=int, default=16)
+    contention.add_argument('--max-qty', type=int, default=10)
+    contention.set_defaults(func=bench_contention)
+
+    search = subparsers.add_parser('search', help='Typeahead lookup latency over a large catalogue')
+    search.add_argument('--products', type=int, default=1000000)
+    search.add_argument('--rounds', type=int, default=20, help='Passes over the query set')
+    search.set_defaults(func=bench_search)
+
+    analytics = subparsers.add_parser('analytics', help='NumPy analytics vs SQL and Python-loop reports')
+    analytics.add_argument('--products', type=int, default=10000)
+    analytics.add_argument('--locations', type=int, default=200)
+    analytics.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000])
+    analytics.add_argument('--loop-max', type=int, default=1000000, help='Largest size for the Python-loop baseline')
+    analytics.set_defaults(func=bench_analytics)
+
+    archive = subparsers.add_parser('archive', help='Hot-table size and read costs before and after archiving')
+    archive.add_argument('--products', type=int, default=1000)
+    archive.add_argument('--locations', type=int, default=50)
+    archive.add_argument('--movements', type=int, default=1000000)
+    archive.add_argument('--days', type=int, default=730, help='History the movements are spread over')
+    archive.add_argument('--retention-days', type=int, default=90)
+    archive.set_defaults(func=bench_archive)
+
+    startup = subparsers.add_parser('startup', help='Import cost, worker boot time and per-worker memory')
+    startup.add_argument('--products', type=int, default=1000)
+    startup.add_argument('--locations', type=int, default=50)
+    startup.add_argument('--movements', type=int, default=20000)
+    startup.add_argument('--workers', type=int, default=4)
+    startup.add_argument('--requests', type=int, default=3, help='Warm-up requests per endpoint')
+    startup.add_argument('--rounds', type=int, default=5, help='Fresh interpreters per import measurement')
+    startup.set_defaults(func=bench_startup)
+
+    movement_ids = subparsers.add_parser('ids', help='Random vs time-ordered movement IDs, and retried writes')
+    movement_ids.add_argument('--products', type=int, default=1000)
+    movement_ids.add_argument('--locations', type=int, default=50)
+    movement_ids.add_argument('--movements', type=int, default=2000000)
+    movement_ids.add_argument('--batch-size', type=int, default=10000)
+    movement_ids.add_argument('--retries', type=int, default=2000)
+    movement_ids.set_defaults(func=bench_ids)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from collections import deque, namedtuple
+
+Event = namedtuple('Event', 'id type data')
+
+# Yielded by subscribe() when the requested Last-Event-ID has already been dropped from
+# history, so the client knows to refetch state instead of trusting the replay
+RESYNC = Event(None, 'resync', {})
+
+def checkpoint(event_id):
+    # Yielded last by a subscription that reached its time limit: the position to resume from,
+    # which the client sends back as Last-Event-ID when it reconnects
+    return Event(event_id, None, None)
+
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+class InProcessBroker:
+    # Fan-out to subscribers in this worker; keeps the last `history` events for resume
+    def __init__(self, history=1000):
+        self._events = deque(maxlen=history)
+        self._next_id = 1
+        self._cond = threading.Condition()
+
+    def publish(self, event_type, data):
+        with self._cond:
+            event = Event(str(self._next_id), event_type, data)
+            self._next_id += 1
+            self._events.append(event)
+            self._cond.notify_all()
+        return event.id
+
+    def subscribe(self, last_event_id=None, heartbeat=15.0, timeout=None):
+        # Yields events newer than last_event_id (or only new ones), and None on each idle
+        # heartbeat; after `timeout` seconds ends with a checkpoint()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            cursor = self._next_id - 1
+            resync = False
+            if last_event_id is not None:
+                try:
+                    requested = int(last_event_id)
+                except ValueError:
+                    requested = None
+                oldest = int(self._events[0].id) if self._events else self._next_id
+                # Too old for the history, or newer than anything published here (this worker
+                # restarted, or the ID came from another worker): either way it cannot be resumed
+                if requested is None or requested < oldest - 1 or requested > cursor:
+                    resync = True
+                else:
+                    cursor = requested
+        if resync:
+            yield RESYNC
+        while True:
+            remaining = _remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                yield checkpoint(str(cursor))
+                return
+            with self._cond:
+                if self._next_id - 1 <= cursor:
+                    self._cond.wait(heartbeat if remaining is None else min(heartbeat, remaining))
+                pending = [event for event in self._events if int(event.id) > cursor]
+            if not pending:
+                yield None
+            for event in pending:
+                cursor = int(event.id)
+                yield event
+
+def _stream_id(value):
+    milliseconds, _, sequence = value.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+class RedisStreamBroker:
+    # Multi-worker fan-out through a Redis stream (any Redis-compatible server); stream IDs
+    # double as SSE event IDs so resume works across workers
+    def __init__(self, url, stream='inventory:events', history=10000):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('RedisStreamBroker requires the "redis" package: pip install redis') from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.stream = stream
+        self.history = history
+
+    def publish(self, event_type, data):
+        return self._client.xadd(self.stream, {'type': event_type, 'data': json.dumps(data)},
+                                 maxlen=self.history, approximate=True)
+
+    def subscribe(self, last_event_id=None, heartbeat=15.0, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # A concrete ID rather than '$', so a checkpoint can name the position even before any event
+        newest = self._client.xrevrange(self.stream, count=1)
+        cursor = newest[0][0] if newest else '0-0'
+        if last_event_id is not None:
+            oldest = self._client.xrange(self.stream, count=1)
+            try:
+                requested = _stream_id(last_event_id)
+            except ValueError:
+                requested = None
+            # As in InProcessBroker, an ID newer than the stream's newest entry cannot be resumed
+            if requested is None or requested > _stream_id(cursor) or \
+                    (oldest and _stream_id(oldest[0][0]) > requested and
+                     self._client.xrange(self.stream, min=last_event_id, max=last_event_id) == []):
+                yield RESYNC
+            else:
+                cursor = last_event_id
+        while True:
+            remaining = _remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                yield checkpoint(cursor)
+                return
+            wait = heartbeat if remaining is None else min(heartbeat, remaining)
+            response = self._client.xread({self.stream: cursor}, block=max(int(wait * 1000), 1), count=100)
+            if not response:
+                yield None
+                continue
+            for event_id, fields in response[0][1]:
+                cursor = event_id
+                yield Event(event_id, fields['type'], json.loads(fields['data']))
+
+def create_broker(url=None):
+    # '' or 'memory://' -> InProcessBroker, 'redis://...' -> RedisStreamBroker
+    if not url or url.startswith('memory://'):
+        return InProcessBroker()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStreamBroker(url)
+    raise ValueError(f'Unsupported broker URL: {url}')
@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    # In-process cache with per-entry TTL; invalidation only reaches this worker
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value, expires_at = self._data.get(key, (0, None))
+            self._data[key] = (value + 1, expires_at)
+            self._data.move_to_end(key)
+            return value + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class RedisCache:
+    # Shared cache for multi-worker deployments; works with any Redis-compatible server
+    def __init__(self, url, prefix='inventory:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('RedisCache requires the "redis" package: pip install redis') from e
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self._client.incr(self.prefix + key)
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+def create_cache(url=None, maxsize=1024):
+    # '' or 'memory://' -> LRUCache, 'redis://...' / 'rediss://...' / 'unix://...' -> RedisCache
+    if not url or url.startswith('memory://'):
+        return LRUCache(maxsize=maxsize)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(url)
+    raise ValueError(f'Unsupported cache URL: {url}')
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import threading
+import time
+
+# ULID-style identifiers: 26 Crockford base32 characters encoding a 48-bit millisecond timestamp
+# followed by 80 random bits. They sort by creation time, so inserts into an index on them land
+# at its right-hand edge instead of on random pages. IDs made within one millisecond by the same
+# process increment the random part, so they stay strictly ordered too
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_BITS = 80
+LENGTH = 26
+
+_lock = threading.Lock()
+_last = [0, 0]
+
+def _reset_after_fork():
+    # A forked child must not continue its parent's sequence within the same millisecond
+    _last[:] = [0, 0]
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def encode(millis, randomness):
+    value = (millis << RANDOM_BITS) | randomness
+    chars = []
+    for _ in range(LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+def new_ulid():
+    millis = time.time_ns() // 1_000_000
+    with _lock:
+        last_millis, last_random = _last
+        if millis <= last_millis:
+            # Same millisecond, or the clock stepped back: continue the last sequence
+            millis, randomness = last_millis, last_random + 1
+            if randomness >> RANDOM_BITS:
+                millis, randomness = millis + 1, 0
+        else:
+            randomness = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+        _last[:] = [millis, randomness]
+    return encode(millis, randomness)
+
+def derived_ulid(millis, seed, sequence):
+    # A reproducible ID: the same (millis, seed, sequence) always gives the same ID, different
+    # seeds give unrelated ones, and IDs from one seed sort by sequence (< 2**32)
+    prefix = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:6], 'big')
+    return encode(millis, (prefix << 32) | sequence)
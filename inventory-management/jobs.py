@@ -0,0 +1,65 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class JobRunner:
+    # Pool of worker threads that pull work through claim() and hand it to execute(). The queue
+    # itself lives wherever claim() reads from (the job table), so queued work survives restarts
+    # and any number of processes can run a pool against the same queue.
+    def __init__(self, claim, execute, workers=2, poll_interval=5.0):
+        self._claim = claim
+        self._execute = execute
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+
+    def start(self):
+        # Idempotent within a process; a forked child has none of its parent's threads, so it
+        # starts its own pool the first time this is called there
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._threads = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def notify(self):
+        # Wakes an idle worker so newly submitted work starts without waiting for the next poll
+        with self._cond:
+            self._cond.notify()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _work(self):
+        while not self._stopping:
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception('Claiming a job failed')
+                job = None
+            if job is None:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(self.poll_interval)
+                continue
+            try:
+                self._execute(job)
+            except Exception:
+                logger.exception('Job %s crashed its worker', job)
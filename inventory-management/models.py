@@ -0,0 +1,180 @@
+import os
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+from ids import new_ulid
+
+# Database connection settings and models. Nothing here touches the web app, so scripts and
+# workers that only need the tables import this module; create_app() in app.py binds `db`
+db = SQLAlchemy()
+
+def database_url_from_env():
+    url = os.environ.get('DATABASE_URL', 'sqlite:///inventory.db')
+    # Some hosting providers still hand out the pre-SQLAlchemy-1.4 scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def engine_options_from_env(url):
+    options = {'pool_pre_ping': True}
+    if not url.startswith('sqlite'):
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', '5'))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+        options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+        options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    return options
+
+# Database Models
+class Product(db.Model):
+    product_id = db.Column(db.String(50), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<Product {self.product_id}: {self.name}>'
+
+class Location(db.Model):
+    location_id = db.Column(db.String(50), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    
+    def __repr__(self):
+        return f'<Location {self.location_id}: {self.name}>'
+
+class ProductMovement(db.Model):
+    # Generated IDs are time-ordered (ids.new_ulid); clients may still supply their own
+    movement_id = db.Column(db.String(50), primary_key=True, default=new_ulid)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    from_location = db.Column(db.String(50), db.ForeignKey('location.location_id'), nullable=True)
+    to_location = db.Column(db.String(50), db.ForeignKey('location.location_id'), nullable=True)
+    product_id = db.Column(db.String(50), db.ForeignKey('product.product_id'), nullable=False)
+    qty = db.Column(db.Integer, nullable=False)
+    
+    # Relationships
+    product = db.relationship('Product', backref='movements')
+    from_loc = db.relationship('Location', foreign_keys=[from_location], backref='outgoing_movements')
+    to_loc = db.relationship('Location', foreign_keys=[to_location], backref='incoming_movements')
+
+    # Composite indexes backing the keyset-paginated, filtered movement listing
+    __table_args__ = (
+        db.Index('ix_movement_timestamp_id', 'timestamp', 'movement_id'),
+        db.Index('ix_movement_product_timestamp_id', 'product_id', 'timestamp', 'movement_id'),
+        db.Index('ix_movement_from_timestamp_id', 'from_location', 'timestamp', 'movement_id'),
+        db.Index('ix_movement_to_timestamp_id', 'to_location', 'timestamp', 'movement_id'),
+    )
+    
+    def __repr__(self):
+        return f'<Movement {self.movement_id}: {self.qty} of {self.product_id}>'
+
+class StockBalance(db.Model):
+    # Materialized on-hand quantity per (product, location), kept in step with
+    # ProductMovement by apply_movement_to_balances() inside the same transaction
+    product_id = db.Column(db.String(50), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('location.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockBalance {self.product_id}@{self.location_id}: {self.qty}>'
+
+class BalanceSnapshot(db.Model):
+    # Checkpoint of every non-zero balance as of snapshot_time (movements with timestamp <= it)
+    snapshot_time = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.String(50), db.ForeignKey('product.product_id'), primary_key=True)
+    location_id = db.Column(db.String(50), db.ForeignKey('location.location_id'), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.snapshot_time} {self.product_id}@{self.location_id}: {self.qty}>'
+
+class MovementArchive(db.Model):
+    # One monthly partition file of movements moved out of ProductMovement by archive_movements();
+    # path is relative to ARCHIVE_DIR and changes whenever the partition is rewritten
+    partition = db.Column(db.String(7), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    # The archive cutoff once this partition was written; the latest one is the current cutoff
+    archived_through = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<MovementArchive {self.partition}: {self.row_count} rows through {self.archived_through}>'
+
+class ArchivedBalance(db.Model):
+    # Net stock effect of every archived movement per (product, location), i.e. the balances at
+    # the archive cutoff; the ledger check and point-in-time balances start from it
+    product_id = db.Column(db.String(50), primary_key=True)
+    location_id = db.Column(db.String(50), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ArchivedBalance {self.product_id}@{self.location_id}: {self.qty}>'
+
+class ArchivedProductTotal(db.Model):
+    # Total |qty| each product moved in archived movements, so top products still count them
+    product_id = db.Column(db.String(50), primary_key=True)
+    qty_moved = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ArchivedProductTotal {self.product_id}: {self.qty_moved}>'
+
+class ArchivedMovementId(db.Model):
+    # Every movement ID in the archive files and the partition holding it, so a new movement
+    # cannot reuse one (the archive holds one row per ID and would otherwise lose one of the
+    # two) and a lookup by ID opens a single file
+    movement_id = db.Column(db.String(50), primary_key=True)
+    partition = db.Column(db.String(7), nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedMovementId {self.movement_id} in {self.partition}>'
+
+class MovementRollup(db.Model):
+    # Movement totals per hour/day bucket, kept in step with ProductMovement on every write.
+    # '' in product_id or location_id means all products / all locations; at location '' the
+    # quantities count stock entering and leaving the business, so transfers only add to the count
+    granularity = db.Column(db.String(4), primary_key=True)
+    product_id = db.Column(db.String(50), primary_key=True)
+    location_id = db.Column(db.String(50), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    movement_count = db.Column(db.Integer, nullable=False, default=0)
+    qty_in = db.Column(db.Integer, nullable=False, default=0)
+    qty_out = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<MovementRollup {self.granularity} {self.bucket} {self.product_id}@{self.location_id}: {self.movement_count}>'
+
+class Job(db.Model):
+    # Background job queue and outcome; status goes queued -> running -> succeeded or failed
+    job_id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+    message = db.Column(db.String(200))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_created', 'status', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.job_id}: {self.kind} {self.status}>'
+
+class IdempotencyKey(db.Model):
+    # The stored outcome of a movement write sent with an Idempotency-Key header, replayed to
+    # retries of the same request; response is NULL while a bulk import is still running
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}: {self.status_code}>'
@@ -2,13 +2,23 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, Product, Location, ProductMovement
+from app import create_app, rebuild_movement_rollups, rebuild_stock_balances
+from models import (db, Product, Location, ProductMovement, StockBalance, BalanceSnapshot, MovementArchive,
+                    ArchivedBalance, ArchivedProductTotal, ArchivedMovementId, IdempotencyKey)
 from datetime import datetime, timedelta
 import random
 
-def create_sample_data():
+def create_sample_data(app=None):
+    app = app or create_app()
     with app.app_context():
         # Clear existing data
+        IdempotencyKey.query.delete()
+        MovementArchive.query.delete()
+        ArchivedBalance.query.delete()
+        ArchivedProductTotal.query.delete()
+        ArchivedMovementId.query.delete()
+        BalanceSnapshot.query.delete()
+        StockBalance.query.delete()
         ProductMovement.query.delete()
         Product.query.delete()
         Location.query.delete()
@@ -137,11 +147,83 @@ def create_sample_data():
             db.session.add(movement)
         
         db.session.commit()
+        rebuild_stock_balances()
+        rebuild_movement_rollups()
         
         print(f"Sample data created successfully!")
         print(f"- {len(products)} products")
         print(f"- {len(locations)} locations")
         print(f"- {len(movements)} movements")
 
+def create_scaled_data(num_products, num_locations, num_movements, days=90, seed=42, batch_size=10000, app=None):
+    # Synthetic dataset for benchmarking: random stock-ins, transfers and stock-outs spread
+    # over the last `days`, loaded with batched inserts rather than one ORM object per row
+    rng = random.Random(seed)
+    app = app or create_app()
+    with app.app_context():
+        db.create_all()
+        IdempotencyKey.query.delete()
+        MovementArchive.query.delete()
+        ArchivedBalance.query.delete()
+        ArchivedProductTotal.query.delete()
+        ArchivedMovementId.query.delete()
+        BalanceSnapshot.query.delete()
+        StockBalance.query.delete()
+        ProductMovement.query.delete()
+        Product.query.delete()
+        Location.query.delete()
+        db.session.commit()
+
+        product_ids = [f'SKU{i:07d}' for i in range(num_products)]
+        location_ids = [f'LOC{i:05d}' for i in range(num_locations)]
+        for start in range(0, num_products, batch_size):
+            db.session.execute(Product.__table__.insert(), [
+                {'product_id': product_id, 'name': f'Product {product_id}', 'description': None}
+                for product_id in product_ids[start:start + batch_size]
+            ])
+        db.session.execute(Location.__table__.insert(), [
+            {'location_id': location_id, 'name': f'Location {location_id}', 'description': None}
+            for location_id in location_ids
+        ])
+        db.session.commit()
+
+        now = datetime.utcnow()
+        span_seconds = days * 24 * 3600
+        for start in range(0, num_movements, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, num_movements)):
+                kind = rng.random()
+                from_location = rng.choice(location_ids) if kind >= 0.3 else None
+                to_location = rng.choice(location_ids) if kind < 0.8 else None
+                if from_location and from_location == to_location:
+                    to_location = None
+                rows.append({
+                    'movement_id': f'SYN{i:010d}',
+                    'timestamp': now - timedelta(seconds=rng.randrange(span_seconds)),
+                    'from_location': from_location,
+                    'to_location': to_location,
+                    'product_id': rng.choice(product_ids),
+                    'qty': rng.randint(1, 100)
+                })
+            db.session.execute(ProductMovement.__table__.insert(), rows)
+            db.session.commit()
+        rebuild_stock_balances()
+        rebuild_movement_rollups()
+
+        print(f"Scaled data created successfully!")
+        print(f"- {num_products} products")
+        print(f"- {num_locations} locations")
+        print(f"- {num_movements} movements")
+
 if __name__ == '__main__':
-    create_sample_data()
+    import argparse
+    parser = argparse.ArgumentParser(description='Load sample data; pass any count for a synthetic dataset')
+    parser.add_argument('--products', type=int)
+    parser.add_argument('--locations', type=int)
+    parser.add_argument('--movements', type=int)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+    if args.products or args.locations or args.movements:
+        create_scaled_data(args.products or 1000, args.locations or 50, args.movements or 100000, days=args.days)
+    else:
+        create_sample_data()
@@ -0,0 +1,46 @@
+// Typeahead for inputs marked data-typeahead="<search API URL>": suggestions come from the
+// server-side search index as the user types, instead of embedding the whole catalogue.
+(function() {
+  const DEBOUNCE_MS = 150;
+
+  function attach(input) {
+    const list = document.createElement('datalist');
+    list.id = input.id + '_options';
+    input.after(list);
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+
+    let timer = null;
+    let controller = null;
+
+    function render(results) {
+      list.replaceChildren(...results.map(function(item) {
+        const option = document.createElement('option');
+        option.value = item.id;
+        option.label = item.id + ' - ' + item.name;
+        return option;
+      }));
+    }
+
+    function lookup() {
+      const q = input.value.trim();
+      if (!q) { render([]); return; }
+      // Only the latest keystroke's response matters
+      if (controller) controller.abort();
+      controller = new AbortController();
+      fetch(input.dataset.typeahead + '?q=' + encodeURIComponent(q), { signal: controller.signal })
+        .then(function(res) { return res.ok ? res.json() : { results: [] }; })
+        .then(function(data) { render(data.results); })
+        .catch(function(err) { if (err.name !== 'AbortError') render([]); });
+    }
+
+    input.addEventListener('input', function() {
+      clearTimeout(timer);
+      timer = setTimeout(lookup, DEBOUNCE_MS);
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-typeahead]').forEach(attach);
+  });
+})();
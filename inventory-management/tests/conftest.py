@@ -0,0 +1,69 @@
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, init_database
+from models import db, Product, Location
+
+PRODUCTS = [f'P{i:03d}' for i in range(12)]
+LOCATIONS = [f'L{i:02d}' for i in range(6)]
+HISTORY_START = datetime(2026, 1, 1)
+
+# TEST_DATABASE_URL=postgresql://... runs the suite against that database instead of a SQLite
+# file per test. Its tables are dropped and recreated around every test, so point it at a
+# throwaway database
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+sqlite_only = pytest.mark.skipif(bool(TEST_DATABASE_URL) and not TEST_DATABASE_URL.startswith('sqlite'),
+                                 reason='SQLite-specific behaviour')
+
+@pytest.fixture
+def app(tmp_path):
+    # A fresh app on an empty database. No app context is left pushed, so every test-client
+    # request gets its own (and its own SQL statement count)
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URL or f"sqlite:///{tmp_path / 'inventory.db'}",
+        'INIT_DB': False,
+        'JOB_WORKERS': 0,
+        'CACHE_URL': '',
+        'BROKER_URL': '',
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'JOBS_DIR': str(tmp_path / 'jobs'),
+        'PROFILE_DIR': str(tmp_path / 'profiles'),
+    })
+    with app.app_context():
+        if TEST_DATABASE_URL:
+            db.drop_all()
+        init_database()
+        db.session.add_all(Product(product_id=product_id, name=f'Product {product_id}') for product_id in PRODUCTS)
+        db.session.add_all(Location(location_id=location_id, name=f'Location {location_id}')
+                           for location_id in LOCATIONS)
+        db.session.commit()
+    yield app
+    with app.app_context():
+        if TEST_DATABASE_URL:
+            db.drop_all()
+        db.engine.dispose()
+
+def random_movements(seed, count, days=30, prefix='M'):
+    # Movement rows spread over `days` from HISTORY_START: stock-ins, stock-outs and transfers in
+    # random order, with "no location" written as either None or '' the way older rows have it
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        kind = rng.choice(('in', 'out', 'transfer'))
+        from_location, to_location = rng.sample(LOCATIONS, 2)
+        rows.append({
+            'movement_id': f'{prefix}{i:06d}',
+            'timestamp': HISTORY_START + timedelta(seconds=rng.randrange(days * 86400)),
+            'product_id': rng.choice(PRODUCTS),
+            'from_location': from_location if kind != 'in' else rng.choice((None, '')),
+            'to_location': to_location if kind != 'out' else rng.choice((None, '')),
+            'qty': rng.randint(1, 50),
+        })
+    return rows
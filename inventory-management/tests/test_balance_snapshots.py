@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+import pytest
+
+from app import balances_as_of, create_balance_snapshot, latest_snapshot_time
+from conftest import HISTORY_START, LOCATIONS, PRODUCTS, random_movements
+from test_reporting_queries import load_rows, replay_balances
+
+# Point-in-time balances start from the latest checkpoint at or before the date and replay
+# only the movements after it; they must equal replaying every movement from the start
+
+def nonzero(balances):
+    return {key: qty for key, qty in balances.items() if qty}
+
+AS_OF = [HISTORY_START - timedelta(days=1)] + \
+    [HISTORY_START + timedelta(days=days, hours=hours) for days in (0, 4, 9, 10, 17, 29, 40) for hours in (0, 13)]
+
+@pytest.mark.parametrize('seed', [11, 12])
+def test_as_of_balances_match_python_replay(app, seed):
+    rows = random_movements(seed, 2000)
+    load_rows(app, rows)
+    with app.app_context():
+        for days in (5, 10, 20):
+            create_balance_snapshot(HISTORY_START + timedelta(days=days))
+        for at in AS_OF:
+            assert nonzero(balances_as_of(at)) == nonzero(replay_balances(rows, end=at)), at
+
+def test_backdated_movement_drops_later_snapshots(app):
+    rows = random_movements(13, 500)
+    load_rows(app, rows)
+    client = app.test_client()
+    with app.app_context():
+        create_balance_snapshot(HISTORY_START + timedelta(days=5))
+        create_balance_snapshot(HISTORY_START + timedelta(days=20))
+    late = {'movement_id': 'LATE', 'timestamp': (HISTORY_START + timedelta(days=8)).isoformat(),
+            'product_id': PRODUCTS[0], 'to_location': LOCATIONS[0], 'qty': 40}
+    assert client.post('/api/movements', json=late).status_code == 201
+    rows.append(dict(late, timestamp=HISTORY_START + timedelta(days=8), from_location=None))
+    with app.app_context():
+        assert latest_snapshot_time() == HISTORY_START + timedelta(days=5)
+        for at in AS_OF:
+            assert nonzero(balances_as_of(at)) == nonzero(replay_balances(rows, end=at)), at
+
+def test_api_as_of_date_includes_the_whole_day(app):
+    rows = random_movements(14, 300)
+    load_rows(app, rows)
+    day = HISTORY_START + timedelta(days=6)
+    items = app.test_client().get(f'/api/balances?as_of={day.date().isoformat()}').get_json()['items']
+    expected = nonzero(replay_balances(rows, end=day + timedelta(days=1) - timedelta(microseconds=1)))
+    assert {(item['product_id'], item['location_id']): item['qty'] for item in items} == expected
+
+@pytest.mark.parametrize('url', ['/api/balances', '/balance', '/export/balances.csv'])
+@pytest.mark.parametrize('as_of', ['yesterday', '2026-13-01', '2026-02-30', '2026-01-01T25:00'])
+def test_invalid_as_of_is_rejected(app, url, as_of):
+    assert app.test_client().get(url, query_string={'as_of': as_of}).status_code == 400
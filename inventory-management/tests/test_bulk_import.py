@@ -0,0 +1,39 @@
+from sqlalchemy.exc import OperationalError
+
+import app as inventory
+from conftest import LOCATIONS, PRODUCTS
+from models import db, ProductMovement
+
+# Every rejected row is reported once, with the reason it was rejected
+
+def stock_in(movement_id, qty=1):
+    return {'movement_id': movement_id, 'product_id': PRODUCTS[0], 'to_location': LOCATIONS[0], 'qty': qty}
+
+RECORDS = [stock_in('A'), stock_in('B', qty=0), stock_in('A'), stock_in('C')]
+
+def test_rows_are_reported_once(app):
+    with app.app_context():
+        inserted, errors = inventory.import_movements(RECORDS)
+        assert inserted == 2
+        assert [error['row'] for error in errors] == [2, 3]
+        assert ProductMovement.query.count() == 2
+
+def test_failed_chunk_reports_only_submitted_rows(app, monkeypatch):
+    def fail(deltas):
+        raise OperationalError('UPDATE stock_balance', {}, Exception('database is locked'))
+    monkeypatch.setattr(inventory, 'apply_balance_deltas', fail)
+    with app.app_context():
+        inserted, errors = inventory.import_movements(RECORDS)
+        assert inserted == 0
+        assert [(error['row'], error['error'].split(':')[0]) for error in errors] == [
+            (1, 'Chunk failed'), (2, 'qty must be positive'), (3, 'Duplicate movement_id'), (4, 'Chunk failed')]
+        assert db.session.query(ProductMovement).count() == 0
+
+def test_records_are_read_outside_a_transaction(app):
+    # A slow client streaming NDJSON must not hold the write lock while its rows arrive
+    def records():
+        for i in range(25):
+            assert not db.session().in_transaction(), f'row {i + 1} read inside a transaction'
+            yield stock_in(f'S{i}')
+    with app.app_context():
+        assert inventory.import_movements(records(), chunk_size=10) == (25, [])
@@ -0,0 +1,90 @@
+import pytest
+
+import app as inventory
+from conftest import sqlite_only
+from models import db, Location, Product
+
+# Typeahead search matches a word prefix of the ID or name for every term, and the FTS5
+# index follows every insert, edit and delete through its triggers
+
+CATALOGUE = [
+    ('WID-100', 'Blue Widget'),
+    ('WID-200', 'Red Widget Large'),
+    ('GAD-100', 'Gadget Pro'),
+    ('BOLT-M8', 'Hex bolt M8 zinc'),
+]
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        db.session.add_all(Product(product_id=product_id, name=name) for product_id, name in CATALOGUE)
+        db.session.commit()
+    return app.test_client()
+
+def search(client, q, kind='products', **args):
+    response = client.get(f'/api/search/{kind}', query_string=dict(args, q=q))
+    assert response.status_code == 200
+    return sorted(item['id'] for item in response.get_json()['results'])
+
+@sqlite_only
+def test_index_is_used_on_sqlite(app, client):
+    with app.app_context():
+        assert inventory._has_search_index(Product) and inventory._has_search_index(Location)
+
+@pytest.mark.parametrize('q, expected', [
+    ('wid', ['WID-100', 'WID-200']),
+    ('widget', ['WID-100', 'WID-200']),
+    ('red wid', ['WID-200']),
+    ('LARGE', ['WID-200']),
+    ('gad', ['GAD-100']),
+    ('100', ['GAD-100', 'WID-100']),
+    ('zinc he', ['BOLT-M8']),
+    ('idget', []),
+    ('"*', []),
+    ('', []),
+])
+@sqlite_only
+def test_terms_match_word_prefixes(client, q, expected):
+    assert search(client, q) == expected
+
+def test_limit_is_applied_and_clamped(client):
+    assert len(search(client, 'product', limit=3)) == 3
+    assert len(search(client, 'product', limit=0)) == 1
+    assert len(search(client, 'product', limit=500)) == 12
+
+@sqlite_only
+def test_edit_and_delete_update_the_index(app, client):
+    response = client.post('/products/edit/WID-100', data={'name': 'Green Sprocket', 'description': ''})
+    assert response.status_code == 302
+    assert search(client, 'blue') == []
+    assert search(client, 'sprocket') == ['WID-100']
+    assert search(client, 'widget') == ['WID-200']
+
+    with app.app_context():
+        db.session.delete(db.session.get(Product, 'WID-200'))
+        db.session.commit()
+    assert search(client, 'widget') == []
+    assert search(client, 'wid') == ['WID-100']
+
+@sqlite_only
+def test_locations_are_indexed_too(client):
+    client.post('/locations/add', data={'location_id': 'WH-NORTH', 'name': 'North Warehouse', 'description': ''})
+    assert search(client, 'north ware', kind='locations') == ['WH-NORTH']
+    assert client.get('/api/search/suppliers', query_string={'q': 'x'}).status_code == 404
+
+@sqlite_only
+def test_rebuilt_index_matches_the_tables(app, client):
+    with app.app_context():
+        db.session.execute(db.text("INSERT INTO product_search(product_search) VALUES ('delete-all')"))
+        db.session.commit()
+    assert search(client, 'widget') == []
+    with app.app_context():
+        assert inventory.rebuild_search_index()
+    assert search(client, 'widget') == ['WID-100', 'WID-200']
+
+def test_prefix_like_fallback(app, client, monkeypatch):
+    # Other databases have no FTS5 index and match the start of the ID or the whole name
+    monkeypatch.setattr(inventory, '_has_search_index', lambda model: False)
+    assert search(client, 'wid') == ['WID-100', 'WID-200']
+    assert search(client, 'red w') == ['WID-200']
+    assert search(client, 'widget') == []
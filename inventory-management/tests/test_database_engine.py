@@ -0,0 +1,44 @@
+import pytest
+
+from app import create_app
+from conftest import sqlite_only
+from models import db, database_url_from_env, engine_options_from_env
+
+# Engine settings: the SQLite connection pragmas, and the URL and pool options for other
+# databases
+
+def pragma(name):
+    return db.session.connection().exec_driver_sql(f'PRAGMA {name}').scalar()
+
+@sqlite_only
+def test_sqlite_connections_are_tuned(app):
+    with app.app_context():
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('busy_timeout') == app.config['SQLITE_BUSY_TIMEOUT_MS']
+        assert pragma('synchronous') == 1
+        assert pragma('temp_store') == 2
+
+@sqlite_only
+def test_tuning_can_be_turned_off(tmp_path):
+    app = create_app({'TESTING': True, 'SQLITE_TUNING': False, 'JOB_WORKERS': 0,
+                      'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'untuned.db'}"})
+    with app.app_context():
+        assert pragma('journal_mode') == 'delete'
+        assert not db.session.connection().info.get('sqlite_tuned')
+        db.engine.dispose()
+
+@pytest.mark.parametrize('url, expected', [
+    ('postgres://user:secret@db:5432/inventory', 'postgresql://user:secret@db:5432/inventory'),
+    ('postgresql+psycopg://db/inventory', 'postgresql+psycopg://db/inventory'),
+    ('sqlite:///inventory.db', 'sqlite:///inventory.db'),
+])
+def test_database_url_scheme_is_normalised(monkeypatch, url, expected):
+    monkeypatch.setenv('DATABASE_URL', url)
+    assert database_url_from_env() == expected
+
+def test_pool_options_only_apply_to_server_databases(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    assert engine_options_from_env('sqlite:///inventory.db') == {'pool_pre_ping': True}
+    options = engine_options_from_env('postgresql://db/inventory')
+    assert (options['pool_pre_ping'], options['pool_size']) == (True, 3)
+    assert {'max_overflow', 'pool_timeout', 'pool_recycle'} <= set(options)
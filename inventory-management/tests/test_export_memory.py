@@ -0,0 +1,42 @@
+import tracemalloc
+
+import pytest
+
+from conftest import random_movements
+from models import db, ProductMovement
+
+# Exports stream from the database in batches, so the peak Python heap while serving one must
+# not grow with the number of rows exported
+SMALL, LARGE = 2000, 20000
+# Allowed growth of the peak from SMALL to LARGE rows; holding the rows would grow it tenfold
+MAX_GROWTH = 1.25
+
+def load(app, count, prefix):
+    with app.app_context():
+        db.session.execute(ProductMovement.__table__.insert(), random_movements(count, count, prefix=prefix))
+        db.session.commit()
+
+def export_peak(client, url):
+    # (bytes sent, peak traced heap) while streaming the whole response
+    tracemalloc.start()
+    try:
+        response = client.get(url, buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size, peak
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_movement_export_memory_stays_flat(app, fmt):
+    client = app.test_client()
+    url = f'/export/movements.{fmt}'
+    load(app, SMALL, 'S')
+    # One export first, so lazily built state (compiled queries, templates) is not counted
+    export_peak(client, url)
+    small_size, small_peak = export_peak(client, url)
+    load(app, LARGE - SMALL, 'L')
+    large_size, large_peak = export_peak(client, url)
+
+    assert large_size > small_size * (LARGE / SMALL) * 0.9
+    assert large_peak <= small_peak * MAX_GROWTH, (small_peak, large_peak)
@@ -0,0 +1,75 @@
+import gzip
+
+import pytest
+
+import app as inventory
+from conftest import LOCATIONS, PRODUCTS
+
+# Cached API bodies and catalogue pages revalidate without touching the database, change
+# ETag as soon as a write commits, and go out compressed to clients that accept it
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/api/movements', json={'product_id': PRODUCTS[0], 'to_location': LOCATIONS[0], 'qty': 5})
+    return client
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag})
+
+@pytest.mark.parametrize('url', ['/api/top_products', '/api/recent_movements', '/products', '/locations'])
+def test_current_etag_gets_304_without_sql(client, url):
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag']
+    response = revalidate(client, url, first.headers['ETag'])
+    assert response.status_code == 304
+    assert response.headers['X-SQL-Query-Count'] == '0'
+    assert response.get_data() == b''
+
+def test_movement_write_changes_the_api_etag(client):
+    before = client.get('/api/top_products')
+    client.post('/api/movements', json={'product_id': PRODUCTS[1], 'to_location': LOCATIONS[0], 'qty': 7})
+    after = revalidate(client, '/api/top_products', before.headers['ETag'])
+    assert after.status_code == 200
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert f'Product {PRODUCTS[1]}' in after.get_json()['labels']
+
+def test_catalogue_write_changes_the_page_etag(client):
+    before = client.get('/products')
+    client.post('/products/add', data={'product_id': 'NEW1', 'name': 'New product', 'description': ''},
+                follow_redirects=True)
+    after = revalidate(client, '/products', before.headers['ETag'])
+    assert after.status_code == 200
+    assert 'NEW1' in after.get_data(as_text=True)
+
+def test_compressible_response_is_gzipped(client):
+    plain = client.get('/products')
+    response = client.get('/products', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+
+@pytest.mark.skipif(inventory.brotli is None, reason='brotli is not installed')
+def test_brotli_is_preferred_when_available(client):
+    response = client.get('/products', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert inventory.brotli.decompress(response.get_data()) == client.get('/products').get_data()
+
+def test_small_responses_are_left_uncompressed(app, client):
+    app.config['COMPRESS_MIN_BYTES'] = 10 ** 6
+    assert 'Content-Encoding' not in client.get('/products', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_fingerprinted_static_urls_are_immutable(app, client):
+    with app.test_request_context():
+        url = inventory.url_for('static', filename='css/styles.css')
+    assert '?v=' in url
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert f'max-age={inventory.STATIC_MAX_AGE}' in response.headers['Cache-Control']
+    response.close()
+    # A stale or missing fingerprint must not be cached for a year
+    stale = client.get('/static/css/styles.css?v=000000000000')
+    assert 'immutable' not in stale.headers.get('Cache-Control', '')
+    stale.close()
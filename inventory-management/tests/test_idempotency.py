@@ -0,0 +1,104 @@
+import pytest
+
+import app as inventory
+from conftest import LOCATIONS, PRODUCTS
+from models import db, IdempotencyKey, ProductMovement, StockBalance
+
+# A retried write with the same Idempotency-Key lands once and gets the first response back
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def stock_in(qty=5, **values):
+    return dict({'product_id': PRODUCTS[0], 'to_location': LOCATIONS[0], 'qty': qty}, **values)
+
+def post(client, url, body, key):
+    return client.post(url, json=body, headers={'Idempotency-Key': key})
+
+def on_hand(app, location_id=LOCATIONS[0]):
+    with app.app_context():
+        balance = db.session.get(StockBalance, (PRODUCTS[0], location_id))
+        return balance.qty if balance else 0
+
+def movement_count(app):
+    with app.app_context():
+        return ProductMovement.query.count()
+
+def test_retry_replays_the_stored_response(app, client):
+    first = post(client, '/api/movements', stock_in(), 'key-1')
+    retry = post(client, '/api/movements', stock_in(), 'key-1')
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert (movement_count(app), on_hand(app)) == (1, 5)
+
+def test_key_reused_for_another_request_is_rejected(app, client):
+    post(client, '/api/movements', stock_in(), 'key-1')
+    response = post(client, '/api/movements', stock_in(qty=6), 'key-1')
+    assert response.status_code == 422
+    assert post(client, '/api/movements/bulk', [stock_in()], 'key-1').status_code == 422
+    assert (movement_count(app), on_hand(app)) == (1, 5)
+
+def test_rejected_request_is_not_stored(app, client):
+    # A 409 commits nothing, so the same request under the same key runs again once it can succeed
+    transfer = stock_in(from_location=LOCATIONS[0], to_location=LOCATIONS[1], movement_id='T1')
+    assert post(client, '/api/movements', transfer, 'key-1').status_code == 409
+    with app.app_context():
+        assert db.session.get(IdempotencyKey, 'key-1') is None
+    client.post('/api/movements', json=stock_in())
+    assert post(client, '/api/movements', transfer, 'key-1').status_code == 201
+    assert post(client, '/api/movements', transfer, 'key-1').headers['Idempotent-Replayed'] == 'true'
+    assert (on_hand(app), on_hand(app, LOCATIONS[1])) == (0, 5)
+
+def test_taken_movement_id_without_stored_key_is_a_conflict(app, client):
+    client.post('/api/movements', json=stock_in(movement_id='M1'))
+    response = post(client, '/api/movements', stock_in(movement_id='M1'), 'key-1')
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'Duplicate movement_id: M1'}
+
+def test_malformed_key_is_rejected(client):
+    assert post(client, '/api/movements', stock_in(), ' ').status_code == 400
+    assert post(client, '/api/movements', stock_in(), 'k' * 256).status_code == 400
+
+ROWS = [stock_in(qty=1) for _ in range(8)]
+
+def test_bulk_retry_replays_the_stored_response(app, client):
+    first = post(client, '/api/movements/bulk', ROWS, 'bulk-1')
+    retry = post(client, '/api/movements/bulk', ROWS, 'bulk-1')
+    assert first.get_json() == retry.get_json() == {'inserted': 8, 'errors': []}
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert (movement_count(app), on_hand(app)) == (8, 8)
+
+def test_interrupted_bulk_import_resumes_without_duplicates(app, client, monkeypatch):
+    # Rows without a movement_id get IDs derived from the key, so rows written before the
+    # interruption are recognised on the retry instead of landing twice
+    import_movements = inventory.import_movements
+
+    def interrupted(records, **kwargs):
+        import_movements(list(records)[:3], **kwargs)
+        raise ConnectionError('worker went away')
+
+    monkeypatch.setattr(inventory, 'import_movements', interrupted)
+    with pytest.raises(ConnectionError):
+        post(client, '/api/movements/bulk', ROWS, 'bulk-1')
+    assert movement_count(app) == 3
+    with app.app_context():
+        assert db.session.get(IdempotencyKey, 'bulk-1').response is None
+
+    monkeypatch.setattr(inventory, 'import_movements', import_movements)
+    response = post(client, '/api/movements/bulk', ROWS, 'bulk-1')
+    body = response.get_json()
+    assert body['inserted'] == 5
+    assert [error['row'] for error in body['errors']] == [1, 2, 3]
+    assert (movement_count(app), on_hand(app)) == (8, 8)
+    assert post(client, '/api/movements/bulk', ROWS, 'bulk-1').get_json() == body
+
+def test_form_submitted_twice_lands_once(app, client):
+    form = {'movement_id': 'FORM-1', 'product_id': PRODUCTS[0], 'from_location': '', 'to_location': LOCATIONS[0],
+            'qty': '5'}
+    assert client.post('/movements/add', data=form).status_code == 302
+    response = client.post('/movements/add', data=form)
+    assert 'FORM-1 already exists and was not added again' in response.get_data(as_text=True)
+    assert (movement_count(app), on_hand(app)) == (1, 5)
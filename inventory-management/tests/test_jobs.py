@@ -0,0 +1,107 @@
+import csv
+import io
+import time
+
+import pytest
+
+import app as inventory
+from conftest import LOCATIONS, PRODUCTS, random_movements
+from jobs import JobRunner
+from models import db, Job, ProductMovement, StockBalance
+
+# Jobs go through the job table: submitted as queued, claimed by a worker, and finished as
+# succeeded with a result or failed with the error
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        db.session.execute(ProductMovement.__table__.insert(), random_movements(8, 300))
+        db.session.commit()
+        inventory.rebuild_stock_balances()
+    return app.test_client()
+
+def submit(client, kind, **params):
+    response = client.post('/api/jobs', json={'kind': kind, 'params': params})
+    assert response.status_code == 202, response.get_json()
+    job = response.get_json()['job']
+    assert job['status'] == 'queued'
+    assert response.headers['Location'].endswith(f"/api/jobs/{job['job_id']}")
+    return job['job_id']
+
+def run_queued_jobs(app):
+    # What a worker thread does, inline
+    while True:
+        job_id = inventory.claim_next_job(app)
+        if job_id is None:
+            return
+        inventory.execute_job(app, job_id)
+
+def job_status(client, job_id):
+    return client.get(f'/api/jobs/{job_id}').get_json()['job']
+
+def test_export_job_writes_a_downloadable_file(app, client):
+    job_id = submit(client, 'export_movements', format='csv', location_id=LOCATIONS[2])
+    assert client.get(f'/api/jobs/{job_id}/result').status_code == 409
+    run_queued_jobs(app)
+
+    job = job_status(client, job_id)
+    assert (job['status'], job['progress'], job['attempts'], job['error']) == ('succeeded', 1.0, 1, None)
+    response = client.get(f'/api/jobs/{job_id}/result')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    response.close()
+    expected = [row for row in random_movements(8, 300) if LOCATIONS[2] in (row['from_location'], row['to_location'])]
+    assert rows[0] == list(inventory.MOVEMENT_EXPORT_COLUMNS)
+    assert len(rows) - 1 == job['result']['rows'] == len(expected)
+
+def test_rebuild_balances_job_repairs_drift(app, client):
+    with app.app_context():
+        expected = {(b.product_id, b.location_id): b.qty for b in StockBalance.query}
+        StockBalance.query.filter_by(product_id=PRODUCTS[0]).update({'qty': 999})
+        drifted = StockBalance.query.filter_by(product_id=PRODUCTS[0]).count()
+        db.session.commit()
+    job_id = submit(client, 'rebuild_balances')
+    run_queued_jobs(app)
+
+    job = job_status(client, job_id)
+    assert job['status'] == 'succeeded'
+    assert job['result']['drifted'] == drifted > 0
+    with app.app_context():
+        assert {(b.product_id, b.location_id): b.qty for b in StockBalance.query} == expected
+
+def test_failed_job_records_the_error(app, client, monkeypatch):
+    def explode(params, progress):
+        progress(0.1, 'About to fail')
+        raise RuntimeError('disk full')
+    monkeypatch.setitem(inventory.JOB_TASKS, 'explode', inventory.JobTask(explode, None, False))
+    job_id = submit(client, 'explode')
+    run_queued_jobs(app)
+
+    job = job_status(client, job_id)
+    assert (job['status'], job['error'], job['result']) == ('failed', 'disk full', None)
+    assert job['finished_at'] is not None
+    assert client.get(f'/api/jobs/{job_id}/result').status_code == 409
+
+@pytest.mark.parametrize('payload', [
+    {'kind': 'reticulate_splines'},
+    {'kind': 'export_movements', 'params': {'format': 'xlsx'}},
+    {'kind': 'export_balances', 'params': {'as_of': 'yesterday'}},
+    {'kind': 'rebuild_balances', 'params': ['not', 'an', 'object']},
+])
+def test_invalid_jobs_are_rejected_at_submission(app, client, payload):
+    assert client.post('/api/jobs', json=payload).status_code == 400
+    with app.app_context():
+        assert Job.query.count() == 0
+
+def test_runner_threads_pick_up_submitted_jobs(app, client):
+    runner = JobRunner(lambda: inventory.claim_next_job(app), lambda job_id: inventory.execute_job(app, job_id),
+                       workers=2, poll_interval=0.05)
+    runner.start()
+    try:
+        job_ids = [submit(client, 'export_balances', format='ndjson'), submit(client, 'rebuild_rollups')]
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and \
+                any(job_status(client, job_id)['status'] in ('queued', 'running') for job_id in job_ids):
+            time.sleep(0.05)
+    finally:
+        runner.stop(timeout=5)
+    assert [job_status(client, job_id)['status'] for job_id in job_ids] == ['succeeded', 'succeeded']
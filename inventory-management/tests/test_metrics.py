@@ -0,0 +1,96 @@
+import re
+
+from metrics import Registry
+
+# /metrics speaks the Prometheus text exposition format (0.0.4). The registry is per process
+# and outlives each test's app, so assertions are on the change between two scrapes
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*",?)*\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def parse(text):
+    # {(name, ((label, value), ...)): value}, checking every line against the format
+    assert text.endswith('\n')
+    samples, declared = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            declared[name] = kind
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.group(1), match.group(2) or '', match.group(3)
+        family = re.sub(r'_(bucket|sum|count)$', '', name) if name not in declared else name
+        assert family in declared, f'{name} has no TYPE line'
+        samples[(name, tuple(LABEL.findall(labels)))] = float(value)
+    return samples, declared
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    return parse(response.get_data(as_text=True))
+
+def series(samples, name, **labels):
+    # The sample(s) of `name` whose labels include `labels`
+    wanted = set(labels.items())
+    return {key[1]: value for key, value in samples.items() if key[0] == name and wanted <= set(key[1])}
+
+def test_histograms_are_well_formed(app):
+    client = app.test_client()
+    client.get('/products')
+    samples, declared = scrape(client)
+    assert declared['inventory_request_duration_seconds'] == 'histogram'
+    assert declared['inventory_slow_requests_profiled_total'] == 'counter'
+    for name, kind in declared.items():
+        if kind != 'histogram':
+            continue
+        for labels, count in series(samples, f'{name}_count').items():
+            buckets = sorted(((float(dict(key)['le']), value) for key, value in
+                              series(samples, f'{name}_bucket', **dict(labels)).items()))
+            assert buckets[-1] == (float('inf'), count)
+            assert [value for _, value in buckets] == sorted(value for _, value in buckets)
+            assert (f'{name}_sum', labels) in samples
+
+def test_requests_are_counted_per_route(app):
+    client = app.test_client()
+    labels = {'endpoint': '/products/view/<product_id>', 'method': 'GET', 'status': '200'}
+    before, _ = scrape(client)
+    for product_id in ('P000', 'P001', 'P002'):
+        client.get(f'/products/view/{product_id}')
+    client.get('/no/such/page')
+    after, _ = scrape(client)
+
+    def count(samples, name, **labels):
+        return sum(series(samples, name, **labels).values())
+    # Routes are labelled by rule, not by URL, so IDs cannot blow up the series count
+    assert count(after, 'inventory_request_duration_seconds_count', **labels) - \
+        count(before, 'inventory_request_duration_seconds_count', **labels) == 3
+    assert count(after, 'inventory_request_sql_statements_sum', **labels) > \
+        count(before, 'inventory_request_sql_statements_sum', **labels)
+    assert count(after, 'inventory_request_duration_seconds_count', endpoint='unmatched', status='404') - \
+        count(before, 'inventory_request_duration_seconds_count', endpoint='unmatched', status='404') == 1
+    assert count(after, 'inventory_template_render_duration_seconds_count', template='view_product.html') >= 3
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = registry.counter('test_total', 'A counter', ('path',))
+    counter.inc(('a "quoted"\\path\nnext',), 2)
+    histogram = registry.histogram('test_seconds', 'A histogram', buckets=(0.1, 1.0))
+    histogram.observe(0.5)
+    assert registry.render().splitlines() == [
+        '# HELP test_total A counter',
+        '# TYPE test_total counter',
+        'test_total{path="a \\"quoted\\"\\\\path\\nnext"} 2',
+        '# HELP test_seconds A histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 0',
+        'test_seconds_bucket{le="1.0"} 1',
+        'test_seconds_bucket{le="+Inf"} 1',
+        'test_seconds_sum 0.5',
+        'test_seconds_count 1',
+    ]
+    samples, _ = parse(registry.render())
+    assert samples[('test_total', (('path', 'a \\"quoted\\"\\\\path\\nnext'),))] == 2
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+import app as inventory
+from app import archive_movements, balances_as_of, find_archived_movement, rebuild_archived_movement_ids
+from conftest import LOCATIONS, PRODUCTS, sqlite_only
+from models import db, ArchivedMovementId, ProductMovement
+
+# A movement ID stays taken once its movement is archived; reusing it would leave two rows
+# with one ID, and the archive keeps only one of them
+
+def stock_in(movement_id, timestamp, qty):
+    return {'movement_id': movement_id, 'timestamp': timestamp, 'product_id': PRODUCTS[0],
+            'to_location': LOCATIONS[0], 'qty': qty}
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    assert client.post('/api/movements', json=stock_in('DUP', '2025-03-05T09:00:00', 10)).status_code == 201
+    with app.app_context():
+        archive_movements(datetime(2025, 3, 10))
+    return client
+
+def test_archived_id_cannot_be_reused(app, client):
+    response = client.post('/api/movements', json=stock_in('DUP', '2025-03-20T09:00:00', 5))
+    assert response.status_code == 409
+    assert 'archived' in response.get_json()['error']
+
+    response = client.post('/api/movements/bulk', json=[stock_in('DUP', '2025-03-20T09:00:00', 5),
+                                                         stock_in('NEW', '2025-03-20T09:00:00', 5)])
+    assert response.get_json() == {'inserted': 1, 'errors': [{'row': 1, 'error': 'Duplicate movement_id: DUP'}]}
+
+    with app.app_context():
+        archive_movements(datetime(2025, 3, 31))
+        assert balances_as_of(datetime(2025, 3, 25)) == {(PRODUCTS[0], LOCATIONS[0]): 15}
+        assert find_archived_movement('DUP').qty == 10
+
+def test_archiving_refuses_to_merge_a_duplicate_id(app, client):
+    # A row that got past the checks (written straight to the table) stops the archive run
+    # instead of replacing the archived row
+    with app.app_context():
+        db.session.add(ProductMovement(movement_id='DUP', timestamp=datetime(2025, 3, 20), product_id=PRODUCTS[0],
+                                       to_location=LOCATIONS[0], qty=5))
+        db.session.commit()
+        with pytest.raises(RuntimeError, match='already archived: DUP'):
+            archive_movements(datetime(2025, 3, 31))
+        assert db.session.get(ProductMovement, 'DUP').qty == 5
+        assert find_archived_movement('DUP').qty == 10
+
+def test_ids_are_rebuilt_from_the_files(app, client):
+    with app.app_context():
+        ArchivedMovementId.query.delete()
+        db.session.commit()
+        rebuild_archived_movement_ids()
+        assert [(row.movement_id, row.partition) for row in ArchivedMovementId.query] == [('DUP', '2025-03')]
+
+def test_lookup_by_id_opens_at_most_one_partition(app, client, monkeypatch):
+    with app.app_context():
+        db.session.add(ProductMovement(movement_id='APR', timestamp=datetime(2025, 4, 2), product_id=PRODUCTS[0],
+                                       to_location=LOCATIONS[0], qty=1))
+        db.session.commit()
+        archive_movements(datetime(2025, 4, 30))
+        opened = []
+        read = inventory._partition_rows
+        monkeypatch.setattr(inventory, '_partition_rows', lambda path: opened.append(path) or read(path))
+        assert find_archived_movement('MISSING') is None
+        assert opened == []
+        assert find_archived_movement('DUP').qty == 10
+        assert len(opened) == 1
+    assert client.get('/movements/view/MISSING').status_code == 404
+
+@sqlite_only
+def test_archive_command_vacuums_the_database(app, client):
+    # With SQLITE_TUNING on, the session's transaction holds the write lock until it ends
+    app.config.update(SQLITE_TUNING=True, SQLITE_BUSY_TIMEOUT_MS=1000)
+    result = app.test_cli_runner().invoke(args=['archive-movements', '--before', '2025-03-31', '--vacuum'])
+    assert result.exit_code == 0, result.output
+    assert 'Vacuumed the database.' in result.output
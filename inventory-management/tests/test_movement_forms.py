@@ -0,0 +1,58 @@
+import pytest
+
+from app import rebuild_stock_balances
+from conftest import LOCATIONS, PRODUCTS
+from models import db, ProductMovement, StockBalance
+
+# The add and edit forms apply the same rules as the API before any stock moves
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        db.session.add(ProductMovement(movement_id='SEED', product_id=PRODUCTS[0], to_location=LOCATIONS[0], qty=10))
+        db.session.commit()
+        rebuild_stock_balances()
+    return app.test_client()
+
+def form(**values):
+    fields = {'movement_id': '', 'product_id': PRODUCTS[0], 'from_location': '', 'to_location': '', 'qty': '1'}
+    fields.update(values)
+    return fields
+
+def balances(app):
+    with app.app_context():
+        return {(b.product_id, b.location_id): b.qty for b in StockBalance.query}
+
+INVALID = [
+    (form(from_location=LOCATIONS[0], qty='-50'), 'qty must be positive'),
+    (form(to_location=LOCATIONS[1], qty='0'), 'qty must be positive'),
+    (form(from_location=LOCATIONS[0], to_location=LOCATIONS[0]), 'cannot be the same'),
+    (form(to_location=LOCATIONS[1], qty='lots'), 'Invalid qty'),
+    (form(), 'from_location or to_location is required'),
+]
+
+@pytest.mark.parametrize('fields, error', INVALID)
+def test_add_form_rejects_invalid_movements(app, client, fields, error):
+    before = balances(app)
+    response = client.post('/movements/add', data=fields)
+    assert response.status_code == 200
+    assert error in response.get_data(as_text=True)
+    assert balances(app) == before
+    with app.app_context():
+        assert ProductMovement.query.count() == 1
+
+@pytest.mark.parametrize('fields, error', INVALID)
+def test_edit_form_rejects_invalid_movements(app, client, fields, error):
+    before = balances(app)
+    response = client.post('/movements/edit/SEED', data=fields)
+    assert response.status_code == 200
+    assert error in response.get_data(as_text=True)
+    assert balances(app) == before
+    with app.app_context():
+        movement = db.session.get(ProductMovement, 'SEED')
+        assert (movement.to_location, movement.qty) == (LOCATIONS[0], 10)
+
+def test_add_form_records_a_valid_transfer(app, client):
+    response = client.post('/movements/add', data=form(from_location=LOCATIONS[0], to_location=LOCATIONS[1], qty='4'))
+    assert response.status_code == 302
+    assert balances(app) == {(PRODUCTS[0], LOCATIONS[0]): 6, (PRODUCTS[0], LOCATIONS[1]): 4}
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from broker import RESYNC, InProcessBroker
+from conftest import LOCATIONS, PRODUCTS
+from models import db, ProductMovement, StockBalance
+
+# Movements commit even when the broker or the cache is down, and a stream holds a worker
+# thread only for a bounded time
+
+class Unavailable:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('service unavailable')
+        return fail
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(params=['movement_broker', 'dashboard_cache'])
+def outage(app, request):
+    app.extensions['inventory'][request.param] = Unavailable()
+
+def stock_in(movement_id, qty=5):
+    return {'movement_id': movement_id, 'product_id': PRODUCTS[0], 'to_location': LOCATIONS[0], 'qty': qty}
+
+def on_hand(app):
+    with app.app_context():
+        return db.session.get(StockBalance, (PRODUCTS[0], LOCATIONS[0])).qty
+
+def test_create_survives_an_outage(app, client, outage):
+    response = client.post('/api/movements', json=stock_in('A1'))
+    assert response.status_code == 201
+    assert on_hand(app) == 5
+
+def test_bulk_import_survives_an_outage(app, client, outage):
+    response = client.post('/api/movements/bulk', json=[stock_in(f'B{i}', 1) for i in range(30)])
+    assert response.get_json() == {'inserted': 30, 'errors': []}
+    assert on_hand(app) == 30
+
+def test_edit_survives_an_outage(app, client, outage):
+    client.post('/api/movements', json=stock_in('E1'))
+    response = client.post('/movements/edit/E1', data={'product_id': PRODUCTS[0], 'from_location': '',
+                                                       'to_location': LOCATIONS[0], 'qty': '7'},
+                           follow_redirects=True)
+    body = response.get_data(as_text=True)
+    assert 'Movement updated successfully!' in body
+    assert 'Error updating movement' not in body
+    assert on_hand(app) == 7
+    with app.app_context():
+        assert db.session.get(ProductMovement, 'E1').qty == 7
+
+def test_broker_resyncs_an_id_it_never_issued():
+    # After a restart the counter starts over; a client holding a higher ID must refetch
+    # rather than silently skip every event up to its old position
+    broker = InProcessBroker()
+    broker.publish('movement_created', {'n': 1})
+    events = broker.subscribe('40', heartbeat=0.01, timeout=0.05)
+    assert next(events) == RESYNC
+    broker.publish('movement_created', {'n': 2})
+    assert [event.data for event in events if event is not None and event.type][:1] == [{'n': 2}]
+
+def test_broker_resumes_from_a_known_id():
+    broker = InProcessBroker()
+    for n in range(3):
+        broker.publish('movement_created', {'n': n})
+    events = [event for event in broker.subscribe('1', heartbeat=0.01, timeout=0.05) if event is not None]
+    assert [event.data for event in events[:-1]] == [{'n': 1}, {'n': 2}]
+    # The stream ends with a checkpoint at the last event delivered
+    assert events[-1] == ('3', None, None)
+
+def test_stream_ends_with_a_resumable_id(app, client):
+    app.config.update(STREAM_MAX_SECONDS=0.2, STREAM_HEARTBEAT_SECONDS=0.05)
+    client.post('/api/movements', json=stock_in('S1'))
+    response = client.get('/api/stream/movements')
+    body = response.get_data(as_text=True)
+    response.close()
+    assert body.startswith('retry: 3000\n\n')
+    assert body.endswith('id: 1\n\n')
+
+    client.post('/api/movements', json=stock_in('S2'))
+    response = client.get('/api/stream/movements', headers={'Last-Event-ID': '1'})
+    body = response.get_data(as_text=True)
+    response.close()
+    assert 'id: 2\nevent: movement_created\n' in body and '"S2"' in body
+    assert body.endswith('id: 2\n\n')
+
+def test_stream_slots_are_capped_and_released(app, client):
+    app.config.update(STREAM_MAX_SECONDS=0.1, STREAM_HEARTBEAT_SECONDS=0.05)
+    app.extensions['inventory']['stream_slots'] = threading.BoundedSemaphore(1)
+    first = client.get('/api/stream/movements')
+    assert first.status_code == 200
+    second = client.get('/api/stream/movements')
+    assert second.status_code == 503
+    assert second.headers['Retry-After'] == '30'
+    first.get_data()
+    first.close()
+    third = client.get('/api/stream/movements')
+    assert third.status_code == 200
+    third.close()
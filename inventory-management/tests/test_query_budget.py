@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import event
+
+from app import query_movements_page, rebuild_stock_balances
+from conftest import LOCATIONS, PRODUCTS, random_movements, sqlite_only
+from models import db, ProductMovement
+
+# The listing and detail pages eager-load what their templates touch, so their statement count
+# must not grow with the number of rows shown. An N+1 regression on a 500-row page would issue
+# hundreds of statements
+QUERY_BUDGET = 5
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        db.session.execute(ProductMovement.__table__.insert(), random_movements(1, 2000))
+        db.session.commit()
+        rebuild_stock_balances()
+    return app.test_client()
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, url
+    return int(response.headers['X-SQL-Query-Count'])
+
+@pytest.mark.parametrize('url', [
+    '/movements?limit=500',
+    '/movements/view/M000005',
+    '/api/movements?limit=500',
+    f'/movements?limit=500&location_id={LOCATIONS[1]}',
+    f'/api/movements?limit=500&product_id={PRODUCTS[2]}&direction=transfer',
+])
+def test_pages_stay_within_query_budget(client, url):
+    assert query_count(client, url) <= QUERY_BUDGET
+
+def test_later_pages_cost_the_same(client):
+    first = client.get('/api/movements?limit=500')
+    cursor = first.get_json()['next_cursor']
+    assert query_count(client, f'/api/movements?limit=500&cursor={cursor}') <= QUERY_BUDGET
+
+def test_strict_budget_fails_the_request(app, client):
+    app.config.update(SQL_QUERY_BUDGET=1, SQL_QUERY_BUDGET_STRICT=True)
+    with pytest.raises(RuntimeError, match='budget 1'):
+        client.get('/movements?limit=500')
+
+@sqlite_only
+def test_location_pages_walk_the_indexes(app, client):
+    # Each location column's index is read in order and merged, never sorted as a whole
+    statements = []
+    filters = {'product_id': None, 'location_id': LOCATIONS[1], 'direction': None, 'start': None, 'end': None}
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, params, context, many: statements.append((statement, params)))
+        pages, cursor = [], None
+        while True:
+            page, cursor = query_movements_page(filters, cursor, limit=97)
+            pages += [movement.movement_id for movement in page]
+            if cursor is None:
+                break
+        statement, params = next((statement, params) for statement, params in statements if 'UNION ALL' in statement)
+        plan = ' '.join(row[3] for row in db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, params))
+        expected = [movement.movement_id for movement in ProductMovement.query.filter(
+            (ProductMovement.from_location == LOCATIONS[1]) | (ProductMovement.to_location == LOCATIONS[1])
+        ).order_by(ProductMovement.timestamp.desc(), ProductMovement.movement_id.desc())]
+    assert 'MERGE (UNION ALL)' in plan and 'TEMP B-TREE' not in plan
+    assert pages == expected
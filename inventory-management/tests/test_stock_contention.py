@@ -0,0 +1,66 @@
+import random
+import threading
+
+from sqlalchemy import func
+
+from app import rebuild_stock_balances, verify_stock_balances
+from conftest import LOCATIONS, PRODUCTS
+from models import db, ProductMovement, StockBalance
+
+# Many threads racing transfers and stock-outs over a handful of hot balances: none may go
+# negative, the ledger must match the movement history and total stock must be conserved
+HOT_PRODUCTS = PRODUCTS[:3]
+HOT_LOCATIONS = LOCATIONS[:3]
+INITIAL_STOCK = 20
+THREADS = 8
+TRANSFERS = 600
+
+def test_concurrent_transfers_never_overdraw(app):
+    with app.app_context():
+        db.session.add_all(
+            ProductMovement(movement_id=f'SEED-{product_id}-{location_id}', to_location=location_id,
+                            product_id=product_id, qty=INITIAL_STOCK)
+            for product_id in HOT_PRODUCTS for location_id in HOT_LOCATIONS)
+        db.session.commit()
+        rebuild_stock_balances()
+
+    counter = iter(range(TRANSFERS))
+    lock = threading.Lock()
+    statuses = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            source, target = rng.sample(HOT_LOCATIONS, 2)
+            response = client.post('/api/movements', json={
+                'movement_id': f'T{i:06d}',
+                'product_id': rng.choice(HOT_PRODUCTS),
+                'from_location': source,
+                'to_location': target if rng.random() < 0.9 else None,
+                'qty': rng.randint(1, 8),
+            })
+            with lock:
+                statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(statuses) == TRANSFERS
+    assert set(statuses) <= {201, 409}
+    # The stock-outs drain the hot balances, so some requests must have been turned away
+    assert 201 in statuses and 409 in statuses
+    with app.app_context():
+        assert StockBalance.query.filter(StockBalance.qty < 0).count() == 0
+        assert verify_stock_balances() == {}
+        on_hand = db.session.query(func.sum(StockBalance.qty)).scalar()
+        sold = db.session.query(func.coalesce(func.sum(ProductMovement.qty), 0)) \
+            .filter(ProductMovement.to_location.is_(None)).scalar()
+        assert on_hand == len(HOT_PRODUCTS) * len(HOT_LOCATIONS) * INITIAL_STOCK - sold
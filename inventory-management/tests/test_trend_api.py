@@ -0,0 +1,90 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import LOCATIONS, PRODUCTS, random_movements
+from test_reporting_queries import load_rows, replay_trend
+
+# /api/movements_trend: window and dimension parameters, and series that agree with a replay
+
+ROWS = random_movements(21, 1500)
+WINDOW = {'start': '2026-01-03', 'end': '2026-01-16'}
+START, END = datetime(2026, 1, 3), datetime(2026, 1, 17)
+
+@pytest.fixture
+def client(app):
+    load_rows(app, ROWS)
+    return app.test_client()
+
+def trend(client, **args):
+    response = client.get('/api/movements_trend', query_string=args)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def replayed(granularity, start, end, **filters):
+    # The API's series layout: one entry per bucket, zeros where nothing moved
+    totals = replay_trend(ROWS, granularity, start, end, **filters)
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    buckets = [start + step * i for i in range((end - start) // step)]
+    return {name: [totals.get(bucket, (0, 0, 0))[i] for bucket in buckets]
+            for i, name in enumerate(('data', 'qty_in', 'qty_out'))}
+
+def series_values(payload):
+    return {name: payload[name] for name in ('data', 'qty_in', 'qty_out')}
+
+def test_date_window_is_inclusive_and_matches_replay(client):
+    payload = trend(client, **WINDOW)
+    assert (payload['granularity'], payload['start'], payload['end']) == ('day', START.isoformat(), END.isoformat())
+    assert payload['labels'][0] == '2026-01-03' and payload['labels'][-1] == '2026-01-16'
+    assert series_values(payload) == replayed('day', START, END)
+
+def test_hourly_filtered_trend_matches_replay(client):
+    payload = trend(client, granularity='hour', start='2026-01-05', end='2026-01-06', product_id=PRODUCTS[1],
+                    location_id=LOCATIONS[3])
+    assert len(payload['labels']) == 48 and payload['labels'][1] == '2026-01-05T01:00'
+    assert series_values(payload) == replayed('hour', datetime(2026, 1, 5), datetime(2026, 1, 7),
+                                              product_id=PRODUCTS[1], location_id=LOCATIONS[3])
+
+def test_product_dimension_returns_the_busiest_products(client):
+    payload = trend(client, dimension='product', limit=3, **WINDOW)
+    counts = Counter(row['product_id'] for row in ROWS if START <= row['timestamp'] < END)
+    expected = sorted(counts, key=lambda product_id: (-counts[product_id], product_id))[:3]
+    assert payload['dimension'] == 'product'
+    assert [series['id'] for series in payload['series']] == expected
+    for series in payload['series']:
+        assert series_values(series) == replayed('day', START, END, product_id=series['id'])
+
+def test_location_dimension_within_one_product(client):
+    payload = trend(client, dimension='location', product_id=PRODUCTS[4], limit=99, **WINDOW)
+    assert sorted(series['id'] for series in payload['series']) == sorted(
+        {location_id for row in ROWS if row['product_id'] == PRODUCTS[4] and START <= row['timestamp'] < END
+         for location_id in (row['from_location'], row['to_location']) if location_id})
+    for series in payload['series']:
+        assert series_values(series) == replayed('day', START, END, product_id=PRODUCTS[4], location_id=series['id'])
+
+def test_series_limit_is_clamped(client):
+    assert len(trend(client, dimension='product', limit=0, **WINDOW)['series']) == 1
+    assert len(trend(client, dimension='product', limit=1000, **WINDOW)['series']) == len(PRODUCTS)
+
+def test_range_covers_the_current_bucket(client):
+    payload = trend(client, range='48h', granularity='hour')
+    assert len(payload['labels']) == 48
+    assert datetime.fromisoformat(payload['end']) > datetime.utcnow() >= datetime.fromisoformat(payload['end']) - \
+        timedelta(hours=1)
+    assert 'series' not in payload
+
+@pytest.mark.parametrize('args', [
+    {'granularity': 'week'},
+    {'range': '7x'},
+    {'range': 'forever'},
+    {'range': '-3d'},
+    {'start': '2026-13-01'},
+    {'start': '2026-01-10', 'end': '2026-01-01'},
+    {'range': '100d', 'granularity': 'hour'},
+    {'dimension': 'warehouse'},
+])
+def test_invalid_parameters_are_rejected(client, args):
+    response = client.get('/api/movements_trend', query_string=args)
+    assert response.status_code == 400
+    assert response.get_json()['error']
@@ -1,6 +1,11 @@
-from app import app, db, Product, Location, ProductMovement
+from flask import Flask
+from models import db, database_url_from_env, Product, Location, ProductMovement, StockBalance
 
 def view_database():
+    # Only reads the tables, so the models are bound to a bare app instead of the full web app
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url_from_env()
+    db.init_app(app)
     with app.app_context():
         print("=" * 50)
         print("INVENTORY DATABASE CONTENTS")
@@ -52,32 +57,18 @@ def view_database():
         # View Balance Summary
         print("\n📊 BALANCE SUMMARY:")
         print("-" * 30)
-        balance_data = {}
-        
-        for movement in ProductMovement.query.all():
-            product_id = movement.product_id
-            qty = movement.qty
-            
-            if product_id not in balance_data:
-                balance_data[product_id] = {}
-            
-            # Handle incoming movements (to_location)
-            if movement.to_location:
-                if movement.to_location not in balance_data[product_id]:
-                    balance_data[product_id][movement.to_location] = 0
-                balance_data[product_id][movement.to_location] += qty
-            
-            # Handle outgoing movements (from_location)
-            if movement.from_location:
-                if movement.from_location not in balance_data[product_id]:
-                    balance_data[product_id][movement.from_location] = 0
-                balance_data[product_id][movement.from_location] -= qty
-        
-        for product_id, locations_data in balance_data.items():
-            print(f"Product: {product_id}")
-            for location_id, qty in locations_data.items():
-                if qty != 0:
-                    print(f"  {location_id}: {qty}")
+        balances = StockBalance.query.filter(StockBalance.qty != 0) \
+            .order_by(StockBalance.product_id, StockBalance.location_id).all()
+
+        current_product = None
+        for balance in balances:
+            if balance.product_id != current_product:
+                if current_product is not None:
+                    print("-" * 15)
+                current_product = balance.product_id
+                print(f"Product: {balance.product_id}")
+            print(f"  {balance.location_id}: {balance.qty}")
+        if current_product is not None:
             print("-" * 15)
 
 if __name__ == '__main__':
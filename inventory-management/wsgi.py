@@ -0,0 +1,8 @@
+# WSGI entry point for production servers. Load it once in the master and fork the workers
+# from it, so they share the loaded code and warm caches instead of each building their own:
+#   gunicorn --preload --workers 4 --threads 4 wsgi:app
+# Movement streams hold a thread each and are capped at STREAM_MAX_CONNECTIONS per worker,
+# so keep --threads above that cap
+from app import create_app, prepare_for_fork
+
+app = prepare_for_fork(create_app())